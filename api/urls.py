@@ -31,5 +31,9 @@ urlpatterns = [
 
     # System Status endpoints
     path('system/status/', views.system_status, name='system_status'),
+    path('system/ingest-stats/', views.ingest_stats, name='ingest_stats'),
+
+    # Archived readings
+    path('archive/query/', views.archive_query, name='archive_query'),
     path('ai/status/', views.ai_status, name='ai_status'),
 ]
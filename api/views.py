@@ -1,5 +1,6 @@
 from django.shortcuts import render
 from django.http import JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.utils.decorators import method_decorator
@@ -8,6 +9,8 @@ from django.conf import settings
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
+from devices import scenes
+from devices.models import Device
 import json
 import random
 import time
@@ -319,31 +322,31 @@ Respond naturally and be ready to help with any smart home or architecture quest
 
 # ===== DEVICE CONTROL VIEWS =====
 
-@csrf_exempt
 @require_http_methods(["POST"])
 def toggle_lights(request):
-    """Toggle all smart lights"""
-    try:
-        # Simulate light control
-        success = random.choice([True, True, True, False])  # 75% success rate
+    """Toggle all smart lights in the user's homes (session auth, so CSRF-protected)"""
+    if not request.user.is_authenticated:
+        return JsonResponse({'success': False, 'error': 'Authentication required'}, status=401)
 
-        if success:
-            return JsonResponse({
-                'success': True,
-                'message': 'Lights toggled successfully',
-                'lights_on': random.choice([True, False])
-            })
-        else:
-            return JsonResponse({
-                'success': False,
-                'error': 'Some lights are offline'
-            }, status=500)
+    lights = Device.objects.filter(home__in=scenes.user_homes(request.user), device_type='light')
+    report = scenes.toggle_devices(lights, user=request.user, description='Toggle all lights')
+    if not report['devices']:
+        return JsonResponse({'success': False, 'error': 'No lights found'}, status=404)
 
-    except Exception as e:
+    lights_on = any((device['state'] or {}).get('status') == 'on' for device in report['results'])
+    if report['failed']:
         return JsonResponse({
             'success': False,
-            'error': str(e)
+            'error': f"{report['failed']} of {report['devices']} lights could not be toggled",
+            'lights_on': lights_on,
+            **report,
         }, status=500)
+    return JsonResponse({
+        'success': True,
+        'message': 'Lights toggled successfully',
+        'lights_on': lights_on,
+        **report,
+    })
 
 @csrf_exempt
 @require_http_methods(["POST"])
@@ -429,19 +432,28 @@ def submit_consultation(request):
 
 @require_http_methods(["GET"])
 def system_status(request):
-    """Get overall system status"""
+    """Get overall system status; answered 304 while device state is unchanged"""
+    from automation.state_cache import state_cache
+
     try:
-        return JsonResponse({
-            'success': True,
-            'status': {
-                'devices_online': random.randint(20, 24),
-                'total_devices': 24,
-                'security_armed': True,
-                'energy_usage': round(random.uniform(2.0, 3.5), 1),
-                'temperature': random.randint(20, 25),
-                'last_updated': time.time()
-            }
-        })
+        etag = state_cache.etag()
+        response = get_conditional_response(request, etag=etag)
+        if response is not None:
+            state_cache.not_modified()
+        else:
+            summary = state_cache.summary()
+            response = JsonResponse({
+                'success': True,
+                'status': {
+                    'devices_online': summary['online_devices'],
+                    'total_devices': summary['total_devices'],
+                    'security_armed': True,
+                    'cursor': summary['cursor'],
+                }
+            })
+        response['ETag'] = etag
+        patch_cache_control(response, no_cache=True)
+        return response
 
     except Exception as e:
         return JsonResponse({
@@ -449,6 +461,83 @@ def system_status(request):
             'error': str(e)
         }, status=500)
 
+@require_http_methods(["GET"])
+def ingest_stats(request):
+    """Get write-behind buffer, alert, rule, safety dispatch, heartbeat, device state cache and command counters"""
+    from core.buffers import buffer_stats
+    from automation.alert_state import tracker
+    from automation.anomaly import detector
+    from automation.command_queue import command_queue
+    from automation.dispatch import dispatcher
+    from automation.heartbeat import tracker as heartbeat_tracker
+    from automation.state_cache import state_cache
+    from automation.rules import rule_index
+
+    return JsonResponse({
+        'success': True,
+        'buffers': buffer_stats(),
+        'alert_state': tracker.stats(),
+        'anomaly': detector.stats(),
+        'rules': rule_index.stats(),
+        'safety_dispatch': dispatcher.stats(),
+        'heartbeats': heartbeat_tracker.stats(),
+        'device_state_cache': state_cache.stats(),
+        'device_commands': command_queue.stats(),
+    })
+
+@require_http_methods(["GET"])
+def archive_query(request):
+    """Range aggregates over archived readings, read from memory-mapped files"""
+    from django.utils.dateparse import parse_datetime
+    from core.archive import ArchiveSeries, list_series, series_names
+
+    kind = request.GET.get('kind', 'sensor')
+    device_id = request.GET.get('device_id')
+    if kind not in ('sensor', 'energy') or not device_id:
+        return JsonResponse({
+            'success': False,
+            'error': 'device_id and kind (sensor or energy) are required'
+        }, status=400)
+
+    start = parse_datetime(request.GET.get('start', ''))
+    end = parse_datetime(request.GET.get('end', ''))
+    if request.GET.get('series'):
+        if request.GET['series'] not in series_names(kind):
+            return JsonResponse({
+                'success': False,
+                'error': f"series must be one of: {', '.join(series_names(kind))}"
+            }, status=400)
+        names = [request.GET['series']]
+    else:
+        names = list_series(kind, device_id)
+
+    try:
+        bucket_seconds = float(request.GET['bucket']) if request.GET.get('bucket') else None
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'bucket must be a number of seconds'}, status=400)
+    if bucket_seconds is not None and (not bucket_seconds >= 1 or not (start and end)):
+        return JsonResponse({
+            'success': False,
+            'error': 'bucket needs a size of at least 1 second and both start and end'
+        }, status=400)
+
+    results = {}
+    try:
+        for name in names:
+            series = ArchiveSeries(kind, device_id, name)
+            results[name] = {'summary': series.aggregate(start, end)}
+            if bucket_seconds:
+                results[name]['buckets'] = series.buckets(start, end, bucket_seconds)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+    return JsonResponse({
+        'success': True,
+        'kind': kind,
+        'device_id': device_id,
+        'series': results,
+    })
+
 @require_http_methods(["GET"])
 def ai_status(request):
     """Get AI assistant status including OpenRouter availability"""
@@ -1,7 +1,8 @@
 from django.contrib import admin
 from .models import (
     AutomationRule, SensorReading, VoiceCommand, GestureCommand,
-    SafetyProtocol, AutomationLog, DeviceStatus
+    SafetyProtocol, AutomationLog, DeviceStatus, DeviceStateEvent, DeviceStateSnapshot,
+    DeviceCommand, SensorRollup, AlertIncident, AnomalyFinding
 )
 
 @admin.register(AutomationRule)
@@ -38,3 +39,41 @@ class AutomationLogAdmin(admin.ModelAdmin):
 class DeviceStatusAdmin(admin.ModelAdmin):
     list_display = ['device_id', 'device_name', 'device_type', 'is_online', 'last_seen']
     list_filter = ['device_type', 'is_online']
+
+
+@admin.register(DeviceStateEvent)
+class DeviceStateEventAdmin(admin.ModelAdmin):
+    list_display = ['device_id', 'version', 'action', 'change_seq', 'timestamp']
+    list_filter = ['action']
+    search_fields = ['device_id']
+
+
+@admin.register(DeviceStateSnapshot)
+class DeviceStateSnapshotAdmin(admin.ModelAdmin):
+    list_display = ['device_id', 'version', 'is_online', 'timestamp']
+    search_fields = ['device_id']
+
+
+@admin.register(DeviceCommand)
+class DeviceCommandAdmin(admin.ModelAdmin):
+    list_display = ['seq', 'device_id', 'action', 'status', 'attempts', 'created_at', 'finished_at', 'owner']
+    list_filter = ['status', 'action']
+    search_fields = ['device_id']
+
+
+@admin.register(SensorRollup)
+class SensorRollupAdmin(admin.ModelAdmin):
+    list_display = ['device_id', 'sensor_type', 'resolution', 'bucket_start', 'count', 'min_value', 'max_value']
+    list_filter = ['resolution', 'sensor_type']
+
+
+@admin.register(AlertIncident)
+class AlertIncidentAdmin(admin.ModelAdmin):
+    list_display = ['device_id', 'sensor_type', 'location', 'status', 'reading_count', 'peak_value', 'started_at', 'ended_at']
+    list_filter = ['status', 'sensor_type']
+
+
+@admin.register(AnomalyFinding)
+class AnomalyFindingAdmin(admin.ModelAdmin):
+    list_display = ['device_id', 'sensor_type', 'kind', 'start', 'end', 'reading_count', 'score']
+    list_filter = ['kind', 'sensor_type']
@@ -0,0 +1,278 @@
+"""Per-device alert state machine that collapses repeated alerts into incidents.
+
+Each (device_id, sensor_type) that is over its threshold, or recently was,
+has a small slot that moves between three states:
+
+    ARMED     over threshold, waiting out the debounce window
+    FIRING    incident open; further over-threshold readings only bump a counter
+    COOLDOWN  value fell below the hysteresis band; the incident reopens if the
+              value crosses again before the cooldown window expires, and is
+              resolved once it does
+
+Only the ARMED -> FIRING transition opens an incident and runs safety
+protocols. Counter and status changes are written in one bulk_update per
+flush interval. State is held per process.
+"""
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+ARMED, FIRING, COOLDOWN = 'armed', 'firing', 'cooldown'
+
+INCIDENT_FIELDS = ['status', 'reading_count', 'peak_value', 'last_value', 'last_seen_at', 'ended_at']
+
+
+def get_alert_state_settings():
+    """Alert debounce settings merged over the defaults"""
+    defaults = {
+        'DEBOUNCE_SECONDS': 0,     # Time over threshold before an incident opens (0 = first reading)
+        'HYSTERESIS': 0.1,         # Fraction of the threshold the value must fall past to clear
+        'COOLDOWN_SECONDS': 60,    # Time below the band before an incident is resolved
+        'FLUSH_INTERVAL': 5.0,     # Seconds between incident counter writes
+    }
+    defaults.update(getattr(settings, 'ALERT_STATE_SETTINGS', {}))
+    return defaults
+
+
+def to_datetime(seconds):
+    return datetime.fromtimestamp(seconds, tz=dt_timezone.utc)
+
+
+class AlertSlot:
+    __slots__ = ('state', 'since', 'threshold', 'op', 'protocol_id', 'count', 'peak', 'last_value',
+                 'last_seen', 'ended', 'incident', 'dirty')
+
+    def __init__(self, now):
+        self.state = ARMED
+        self.since = now
+        self.threshold = None
+        self.op = '>'
+        self.protocol_id = None
+        self.count = 0
+        self.peak = None
+        self.last_value = None
+        self.last_seen = now
+        self.ended = None
+        self.incident = None
+        self.dirty = False
+
+    def is_clear(self, value, hysteresis):
+        """True once ``value`` is past the threshold by the hysteresis margin"""
+        margin = abs(self.threshold) * hysteresis
+        if self.op in ('>', '>='):
+            return value < self.threshold - margin
+        if self.op in ('<', '<='):
+            return value > self.threshold + margin
+        return value != self.threshold
+
+    def record(self, value, rule, now):
+        self.threshold, self.op, self.protocol_id = rule.threshold, rule.op, rule.protocol_id
+        self.count += 1
+        if self.peak is None:
+            self.peak = value
+        elif self.op in ('<', '<='):
+            self.peak = min(self.peak, value)
+        else:
+            self.peak = max(self.peak, value)
+        self.last_value = value
+        self.last_seen = now
+        self.dirty = True
+
+
+class AlertTracker:
+    """In-memory alert slots keyed by (device_id, sensor_type)"""
+
+    def __init__(self, debounce=None, hysteresis=None, cooldown=None, flush_interval=None):
+        config = get_alert_state_settings()
+        self.debounce = config['DEBOUNCE_SECONDS'] if debounce is None else debounce
+        self.hysteresis = config['HYSTERESIS'] if hysteresis is None else hysteresis
+        self.cooldown = config['COOLDOWN_SECONDS'] if cooldown is None else cooldown
+        self.flush_interval = flush_interval or config['FLUSH_INTERVAL']
+
+        self._slots = {}
+        self._closed = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stopped = False
+        self.counters = {
+            'opened': 0,
+            'collapsed': 0,
+            'reopened': 0,
+            'resolved': 0,
+        }
+
+    def observe(self, device_id, sensor_type, value, rule, now=None):
+        """Feed one reading; ``rule`` is the matched threshold rule or None.
+
+        Returns True if this reading opens a new incident, in which case the
+        caller stores it synchronously, calls ``open_incident`` and runs the
+        safety protocols.
+        """
+        key = (device_id, sensor_type)
+        slot = self._slots.get(key)
+        if slot is None and rule is None:
+            return False
+        now = time.time() if now is None else now
+
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is not None and slot.state == COOLDOWN and now - slot.since >= self.cooldown:
+                self._resolve(key, slot)
+                slot = None
+            if slot is None:
+                if rule is None:
+                    return False
+                slot = self._slots[key] = AlertSlot(now)
+
+            if slot.state == ARMED:
+                if rule is None:
+                    # Dropped back before the debounce window elapsed
+                    del self._slots[key]
+                    return False
+                slot.record(value, rule, now)
+                if now - slot.since < self.debounce:
+                    return False
+                slot.state = FIRING
+                self.counters['opened'] += 1
+                return True
+
+            if rule is not None:
+                if slot.state == COOLDOWN:
+                    self.counters['reopened'] += 1
+                slot.state = FIRING
+                slot.record(value, rule, now)
+                self.counters['collapsed'] += 1
+            elif slot.state == FIRING and slot.is_clear(value, self.hysteresis):
+                slot.state = COOLDOWN
+                slot.since = now
+                slot.last_value = value
+                slot.dirty = True
+
+        self._ensure_worker()
+        return False
+
+    def is_open(self, device_id, sensor_type):
+        """True while an incident is firing or cooling down for this sensor"""
+        slot = self._slots.get((device_id, sensor_type))
+        return slot is not None and slot.state != ARMED
+
+    def open_incident(self, reading):
+        """Create the incident for a reading that ``observe`` reported as opening one"""
+        from .models import AlertIncident
+
+        key = (reading.device_id, reading.sensor_type)
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None or slot.incident is not None:
+                return None
+            values = {
+                'threshold': slot.threshold,
+                'protocol_id': slot.protocol_id,
+                'reading_count': slot.count,
+                'peak_value': slot.peak,
+                'last_value': slot.last_value,
+                'last_seen_at': to_datetime(slot.last_seen),
+            }
+            slot.dirty = False
+
+        incident = AlertIncident.objects.create(
+            device_id=reading.device_id,
+            sensor_type=reading.sensor_type,
+            location=reading.location,
+            first_reading=reading,
+            started_at=reading.timestamp,
+            **values
+        )
+        with self._lock:
+            slot.incident = incident
+        self._ensure_worker()
+        return incident
+
+    def flush(self, now=None):
+        """Resolve expired cooldowns and write changed incidents; returns rows updated"""
+        from .models import AlertIncident
+
+        now = time.time() if now is None else now
+        with self._flush_lock:
+            with self._lock:
+                for key, slot in list(self._slots.items()):
+                    if slot.state == COOLDOWN and now - slot.since >= self.cooldown:
+                        self._resolve(key, slot)
+                    elif slot.state == ARMED and now - slot.last_seen >= self.cooldown:
+                        # Debounce never completed and the sensor went quiet
+                        del self._slots[key]
+
+                changed = self._closed
+                self._closed = []
+                changed.extend(slot for slot in self._slots.values() if slot.dirty and slot.incident)
+                incidents = []
+                for slot in changed:
+                    incident = slot.incident
+                    incident.status = 'resolved' if slot.ended else slot.state
+                    incident.reading_count = slot.count
+                    incident.peak_value = slot.peak
+                    incident.last_value = slot.last_value
+                    incident.last_seen_at = to_datetime(slot.last_seen)
+                    incident.ended_at = to_datetime(slot.ended) if slot.ended else None
+                    slot.dirty = False
+                    incidents.append(incident)
+
+            if incidents:
+                try:
+                    AlertIncident.objects.bulk_update(incidents, INCIDENT_FIELDS)
+                except Exception:
+                    logger.exception('Failed to update %d alert incidents', len(incidents))
+                    return 0
+            return len(incidents)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            states = [slot.state for slot in self._slots.values()]
+        for state in (ARMED, FIRING, COOLDOWN):
+            stats[state] = states.count(state)
+        return stats
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=self.flush_interval * 2)
+        self.flush()
+
+    def _resolve(self, key, slot):
+        del self._slots[key]
+        slot.ended = slot.since
+        self.counters['resolved'] += 1
+        if slot.incident is not None:
+            self._closed.append(slot)
+
+    def _ensure_worker(self):
+        if self._thread is not None or self._stopped:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='alert-state', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            if self._stopped:
+                break
+            self.flush()
+            close_old_connections()
+
+
+tracker = AlertTracker()
+
+atexit.register(tracker.stop)
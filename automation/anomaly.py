@@ -0,0 +1,164 @@
+"""Online per-device anomaly detection for sensor readings.
+
+Each (device_id, sensor_type) series gets a slot in a set of flat
+``array('d')`` columns holding an exponentially weighted mean and variance,
+a smoothed rate of change and two-sided CUSUM sums. Every reading updates
+its slot in constant time with no database access, and is flagged when:
+
+* its z-score against the EWMA baseline reaches ``Z_THRESHOLD`` (spikes), or
+* a CUSUM sum reaches ``CUSUM_H`` standard deviations (slow drifts such as a
+  gas build-up that never crosses a fixed threshold), or
+* the smoothed rate of change exceeds the sensor type's ``RATE_LIMITS`` entry.
+
+Nothing is flagged until a series has seen ``WARMUP`` readings. NaN and
+infinite values are skipped, since one would poison the series' state for good.
+"""
+import math
+import threading
+import time
+from array import array
+
+from django.conf import settings
+
+# Which deviations matter per sensor type: 'up', 'down' or 'both'
+DEFAULT_DIRECTIONS = {
+    'gas': 'up',
+    'smoke': 'up',
+    'fire': 'up',
+    'water': 'up',
+    'temperature': 'both',
+    'humidity': 'both',
+    'light': 'both',
+}
+
+COLUMNS = ('mean', 'var', 'rate', 'last_value', 'last_time', 'cusum_up', 'cusum_down')
+
+
+def get_anomaly_settings():
+    """Anomaly detector settings merged over the defaults"""
+    defaults = {
+        'ENABLED': True,
+        'ALPHA': 0.05,          # EWMA weight of the newest reading
+        'Z_THRESHOLD': 4.0,     # Flag readings this many standard deviations out
+        'CUSUM_K': 0.5,         # Drift allowance per reading, in standard deviations
+        'CUSUM_H': 8.0,         # CUSUM alarm level, in standard deviations
+        'WARMUP': 30,           # Readings per series before anything is flagged
+        'MIN_STD': 0.01,        # Floor on the standard deviation of flat-lining sensors
+        'MAX_SERIES': 200000,   # Series tracked per process; new series beyond this are skipped
+        'DIRECTIONS': DEFAULT_DIRECTIONS,
+        'RATE_LIMITS': {},      # Optional max units/second per sensor type
+    }
+    defaults.update(getattr(settings, 'ANOMALY_SETTINGS', {}))
+    return defaults
+
+
+class AnomalyDetector:
+    """Array-backed EWMA/CUSUM state table keyed by (device_id, sensor_type)"""
+
+    def __init__(self, **overrides):
+        config = get_anomaly_settings()
+        config.update({key.upper(): value for key, value in overrides.items()})
+        self.enabled = config['ENABLED']
+        self.alpha = config['ALPHA']
+        self.z_threshold = config['Z_THRESHOLD']
+        self.cusum_k = config['CUSUM_K']
+        self.cusum_h = config['CUSUM_H']
+        self.warmup = config['WARMUP']
+        self.min_var = config['MIN_STD'] ** 2
+        self.max_series = config['MAX_SERIES']
+        self.directions = config['DIRECTIONS']
+        self.rate_limits = config['RATE_LIMITS']
+
+        self._slots = {}
+        self._count = array('l')
+        for column in COLUMNS:
+            setattr(self, column, array('d'))
+        self._lock = threading.Lock()
+        self.counters = {'readings': 0, 'flagged': 0, 'untracked': 0, 'non_finite': 0}
+
+    def __len__(self):
+        return len(self._slots)
+
+    def observe(self, device_id, sensor_type, value, timestamp=None):
+        """Update the series with one reading; returns True if it is anomalous"""
+        direction = self.directions.get(sensor_type)
+        if not self.enabled or direction is None:
+            return False
+        now = time.time() if timestamp is None else timestamp
+
+        with self._lock:
+            if not math.isfinite(value):
+                self.counters['non_finite'] += 1
+                return False
+            slot = self._slots.get((device_id, sensor_type))
+            if slot is None:
+                return self._add(device_id, sensor_type, value, now)
+
+            self.counters['readings'] += 1
+            mean, var = self.mean[slot], self.var[slot]
+            count = self._count[slot]
+            dt = now - self.last_time[slot]
+            if dt > 0:
+                rate = (value - self.last_value[slot]) / dt
+                self.rate[slot] += self.alpha * (rate - self.rate[slot])
+            self.last_value[slot] = value
+            self.last_time[slot] = now
+
+            flagged = False
+            if count >= self.warmup:
+                z = (value - mean) / math.sqrt(max(var, self.min_var))
+                up = max(0.0, self.cusum_up[slot] + z - self.cusum_k)
+                down = max(0.0, self.cusum_down[slot] - z - self.cusum_k)
+                if direction != 'down':
+                    flagged = z >= self.z_threshold or up >= self.cusum_h
+                if direction != 'up':
+                    flagged = flagged or -z >= self.z_threshold or down >= self.cusum_h
+                limit = self.rate_limits.get(sensor_type)
+                if limit is not None and abs(self.rate[slot]) > limit:
+                    flagged = True
+                if flagged:
+                    # Start accumulating afresh so a sustained shift re-alarms periodically
+                    up = down = 0.0
+                    self.counters['flagged'] += 1
+                self.cusum_up[slot], self.cusum_down[slot] = up, down
+
+            # Incremental EWMA mean and variance
+            diff = value - mean
+            increment = self.alpha * diff
+            self.mean[slot] = mean + increment
+            self.var[slot] = (1 - self.alpha) * (var + diff * increment)
+            self._count[slot] = count + 1
+            return flagged
+
+    def state(self, device_id, sensor_type):
+        """Current baseline for a series, or None if it is not tracked"""
+        with self._lock:
+            slot = self._slots.get((device_id, sensor_type))
+            if slot is None:
+                return None
+            state = {column: getattr(self, column)[slot] for column in COLUMNS}
+            state['count'] = self._count[slot]
+        state['std'] = math.sqrt(state['var'])
+        return state
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['series'] = len(self._slots)
+        stats['state_bytes'] = sum(getattr(self, column).itemsize for column in COLUMNS) * stats['series'] \
+            + self._count.itemsize * stats['series']
+        return stats
+
+    def _add(self, device_id, sensor_type, value, now):
+        if len(self._slots) >= self.max_series:
+            self.counters['untracked'] += 1
+            return False
+        self._slots[(device_id, sensor_type)] = len(self._count)
+        self._count.append(1)
+        for column, initial in zip(COLUMNS, (value, 0.0, 0.0, value, now, 0.0, 0.0)):
+            getattr(self, column).append(initial)
+        self.counters['readings'] += 1
+        return False
+
+
+detector = AnomalyDetector()
@@ -0,0 +1,712 @@
+"""Acknowledged, retried delivery of device commands.
+
+``control_device`` submits a command here instead of changing DeviceStatus
+itself. Each command gets a sequence number and joins its device's queue.
+A device has one command in flight at a time, so its commands apply in
+order. The command is sent to the device's channel group (its ingest
+websocket, see consumers.py) and resent with exponential backoff until
+the device acknowledges it or ``MAX_ATTEMPTS`` sends go unanswered.
+Devices must treat a repeated sequence number as already applied and
+acknowledge it again. Only an acknowledgement changes DeviceStatus:
+acknowledged commands are applied through the action executor in one
+batch per worker cycle, using the state the device reported if any. If
+the batch raises, each command is applied in its own savepoint; one that
+keeps raising, or that the executor rejects (say its device was deleted),
+is recorded as failed rather than holding up the others.
+
+Commands are held in memory. One unacknowledged for ``SPILL_AFTER``
+seconds is written to the DeviceCommand table under a lease its process
+keeps renewing. New commands go straight to the table when the process
+already holds ``MAX_IN_MEMORY`` commands and none for the device, or when
+the device had pending rows there at the last check. Any process adopts
+pending rows whose lease ran out, including those left by a process that
+stopped or died, but not while an older pending row for the same device
+is leased to another process. A device's queue therefore has one owner
+at a time and keeps its order across processes; only commands for one
+device submitted in two processes close together, before either process
+sees the other's, are ordered as they reach the device. Every finished
+command is written with one bulk statement per cycle, so its status can
+be looked up from any process.
+"""
+import asyncio
+import atexit
+import hashlib
+import heapq
+import logging
+import os
+import random
+import re
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from core.sequences import reserve
+
+from .dispatch import latency_summary
+from .executor import DEVICE_ACTIONS, DeviceAction, apply_device_actions
+from .models import AutomationLog, DeviceCommand
+
+logger = logging.getLogger(__name__)
+
+# core.sequences counter the command sequence numbers are reserved from
+COMMAND_SEQUENCE = 'device_commands'
+
+PENDING_STATUSES = ('queued', 'sent')
+
+OUTCOME_FIELDS = ['status', 'attempts', 'error', 'result', 'finished_at', 'owner', 'lease_until']
+
+# Channel layer group names: letters, digits, hyphens, underscores and periods
+GROUP_NAME = re.compile(r'^[a-zA-Z\d\-_.]{1,80}$')
+
+# Finished commands whose status is kept in memory for lookups and duplicate acks
+FINISHED_KEPT = 10000
+
+# Cycles an acknowledged command may fail to apply before it is recorded as failed
+MAX_APPLY_ATTEMPTS = 3
+
+
+def get_command_settings():
+    """Device command queue settings merged over the defaults"""
+    defaults = {
+        'ACK_TIMEOUT': 5.0,      # Seconds to wait for an acknowledgement before resending
+        'MAX_ATTEMPTS': 5,       # Sends before an unacknowledged command fails
+        'BACKOFF_BASE': 1.0,     # Seconds before the first resend, doubled for each later one
+        'BACKOFF_MAX': 60.0,
+        'SPILL_AFTER': 10.0,     # Seconds unacknowledged before a command is written to the database
+        'LEASE': 30.0,           # Seconds a process owns its spilled commands without renewing the lease
+        'MAX_IN_MEMORY': 10000,  # Commands held per process; more go straight to the database
+        'SEQ_BLOCK': 100,        # Sequence numbers reserved per database round trip
+        'LATENCY_SAMPLES': 10000,
+    }
+    defaults.update(getattr(settings, 'DEVICE_COMMAND_SETTINGS', {}))
+    return defaults
+
+
+def device_group(device_id):
+    """Channel layer group of a device's open websockets"""
+    if GROUP_NAME.match(device_id):
+        return f'device.{device_id}'
+    return f"device-hash.{hashlib.sha1(device_id.encode('utf-8')).hexdigest()}"
+
+
+def deliver_over_channels(commands, reply_to):
+    """Send each command to its device's channel group"""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+
+    async def send_all():
+        await asyncio.gather(*(
+            channel_layer.group_send(device_group(command.device_id), {
+                'type': 'device.command',
+                'command': command.message(),
+                'reply_to': reply_to,
+            })
+            for command in commands
+        ))
+
+    async_to_sync(send_all)()
+
+
+def command_log(command):
+    """AutomationLog fields for a finished command"""
+    return {
+        'user_id': command.user_id,
+        'log_type': 'manual_action',
+        'description': f"Device {command.device_id} action: {command.action} (command {command.seq})",
+        'metadata': {
+            'action': command.action,
+            'parameters': command.parameters,
+            'command': command.seq,
+            'attempts': command.attempts,
+        },
+    }
+
+
+def device_action(command):
+    """The executor action for an acknowledged command: the reported state, or the command itself"""
+    if command.result:
+        return DeviceAction(command.device_id, 'set_value', command.result, log=command_log(command))
+    return DeviceAction(command.device_id, command.action, command.parameters, log=command_log(command))
+
+
+class PendingCommand:
+    __slots__ = (
+        'seq', 'device_id', 'action', 'parameters', 'user_id', 'status', 'attempts', 'awaiting_ack',
+        'due_at', 'submitted_at', 'created_at', 'finished_at', 'row_id', 'error', 'result', 'apply_attempts',
+    )
+
+    def __init__(self, seq, device_id, action, parameters, user_id=None, created_at=None, attempts=0):
+        self.seq = seq
+        self.device_id = device_id
+        self.action = action
+        self.parameters = parameters
+        self.user_id = user_id
+        self.status = 'queued' if not attempts else 'sent'
+        self.attempts = attempts
+        self.awaiting_ack = False
+        self.due_at = None
+        self.submitted_at = time.monotonic()
+        self.created_at = created_at or timezone.now()
+        self.finished_at = None
+        self.row_id = None    # DeviceCommand pk once spilled
+        self.error = ''
+        self.result = None
+        self.apply_attempts = 0
+
+    @classmethod
+    def from_row(cls, row):
+        command = cls(row.seq, row.device_id, row.action, row.parameters, row.requested_by_id,
+                      row.created_at, row.attempts)
+        command.row_id = row.pk
+        command.status = row.status
+        command.error = row.error
+        command.result = row.result
+        command.finished_at = row.finished_at
+        return command
+
+    def message(self):
+        """What the device receives"""
+        return {'seq': self.seq, 'action': self.action, 'parameters': self.parameters, 'attempt': self.attempts}
+
+    def row(self, owner='', lease_until=None):
+        return DeviceCommand(
+            id=self.row_id, seq=self.seq, device_id=self.device_id, action=self.action, parameters=self.parameters,
+            status=self.status, attempts=self.attempts, error=self.error, result=self.result,
+            requested_by_id=self.user_id, created_at=self.created_at, finished_at=self.finished_at,
+            owner=owner, lease_until=lease_until,
+        )
+
+    def describe(self):
+        return {
+            'seq': self.seq,
+            'device_id': self.device_id,
+            'action': self.action,
+            'parameters': self.parameters,
+            'status': self.status,
+            'attempts': self.attempts,
+            'error': self.error,
+            'result': self.result,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class CommandQueue:
+    """Per-device command queues with acknowledgements, resends and a durable spill"""
+
+    def __init__(self, deliver=deliver_over_channels, ack_timeout=None, max_attempts=None, backoff_base=None,
+                 spill_after=None, lease=None, max_in_memory=None):
+        config = get_command_settings()
+        self.deliver = deliver
+        self.ack_timeout = ack_timeout or config['ACK_TIMEOUT']
+        self.max_attempts = max_attempts or config['MAX_ATTEMPTS']
+        self.backoff_base = backoff_base or config['BACKOFF_BASE']
+        self.backoff_max = config['BACKOFF_MAX']
+        self.spill_after = spill_after or config['SPILL_AFTER']
+        self.lease = lease or config['LEASE']
+        self.max_in_memory = max_in_memory or config['MAX_IN_MEMORY']
+        self.seq_block = config['SEQ_BLOCK']
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'[-64:]
+        self.reply_to = None   # Channel the ingest consumers forward other processes' acks to
+
+        self._commands = {}        # seq -> PendingCommand, every unfinished command this process holds
+        self._devices = {}         # device_id -> deque of seqs; the head is in flight
+        self._timers = []          # heap of (due_at, seq): next send or acknowledgement deadline
+        self._finished = OrderedDict()  # seq -> finished PendingCommand
+        self._unwritten = []       # finished commands awaiting the outcome write
+        self._writing = False      # an outcome write is in progress
+        self._stored = None        # devices with pending rows this process does not own, as of the last check
+        self._seqs = iter(())
+        self._seq_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._threads = []
+        self._stopped = False
+        self._spilled_at = 0.0
+        self._leased_at = 0.0
+        self._adopted_at = 0.0
+        self._latencies = deque(maxlen=config['LATENCY_SAMPLES'])   # (acked at, ms since submit)
+        self.counters = {
+            'submitted': 0,
+            'sent': 0,
+            'resent': 0,
+            'acked': 0,
+            'rejected': 0,
+            'timed_out': 0,
+            'duplicate_acks': 0,
+            'spilled': 0,
+            'overflowed': 0,
+            'behind_stored': 0,
+            'adopted': 0,
+            'finished_elsewhere': 0,
+            'apply_failures': 0,
+            'write_failures': 0,
+        }
+
+    def submit(self, device_id, action, parameters=None, user_id=None):
+        """Queue a command and return its sequence number; raises ValueError for unknown actions"""
+        if action not in DEVICE_ACTIONS:
+            raise ValueError(f"Unknown device action '{action}'")
+        command = PendingCommand(self._next_seq(), device_id, action, parameters or {}, user_id)
+        if self._stored is None:
+            self._stored = self._stored_devices()
+        with self._lock:
+            self.counters['submitted'] += 1
+            # A device queued here keeps its commands here, past the capacity if need be
+            queued_here = device_id in self._devices
+            # Behind the device's stored commands, whichever process adopts them
+            stored = device_id in self._stored
+            overflow = not queued_here and len(self._commands) >= self.max_in_memory
+            if queued_here or not (stored or overflow):
+                self._hold(command, time.monotonic())
+        if not queued_here and (stored or overflow):
+            # Leased to nobody, so whichever process has room adopts it
+            command.row().save(force_insert=True)
+            with self._lock:
+                self.counters['overflowed' if overflow else 'behind_stored'] += 1
+        self._ensure_workers()
+        self._wakeup.set()
+        return command.seq
+
+    def ack(self, device_id, seq, success=True, state=None, error=''):
+        """Record a device's acknowledgement; returns False if this process does not know the command"""
+        now = time.monotonic()
+        with self._lock:
+            command = self._commands.get(seq)
+            if command is None or command.device_id != device_id:
+                finished = self._finished.get(seq)
+                if finished is not None and finished.device_id == device_id:
+                    self.counters['duplicate_acks'] += 1
+                    return True
+                return False
+            command.result = state if isinstance(state, dict) else None
+            self._finish(command, 'acked' if success else 'failed', '' if success else str(error or 'Rejected'))
+            self.counters['acked' if success else 'rejected'] += 1
+            self._latencies.append((now, (now - command.submitted_at) * 1000))
+        self._wakeup.set()
+        return True
+
+    def device_connected(self, device_id):
+        """Resend a reconnected device's in-flight command now instead of after its backoff"""
+        with self._lock:
+            queue = self._devices.get(device_id)
+            command = self._commands.get(queue[0]) if queue else None
+            if command is not None and command.attempts:
+                command.awaiting_ack = False
+                self._schedule(command, time.monotonic())
+        # Also starts adopting commands other processes left, now that a device is reachable here
+        self._ensure_workers()
+        self._wakeup.set()
+
+    def status(self, seq):
+        """Status dict of a command held or recently finished here, else from the database; None if unknown"""
+        with self._lock:
+            command = self._commands.get(seq) or self._finished.get(seq)
+            if command is not None:
+                return command.describe()
+        row = DeviceCommand.objects.filter(seq=seq).first()
+        return PendingCommand.from_row(row).describe() if row is not None else None
+
+    def drain(self, timeout=None):
+        """Block until every held command has finished and been written"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                if not self._commands and not self._unwritten and not self._writing:
+                    return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            self._wakeup.set()
+            time.sleep(0.01)
+
+    def stop(self, timeout=5.0):
+        """Stop the workers and hand every unfinished command over to the database"""
+        self._stopped = True
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        with self._lock:
+            held = list(self._commands.values())
+            self._commands.clear()
+            self._devices.clear()
+            self._timers.clear()
+        try:
+            self._write_outcomes()
+            # Leased to nobody, so another process adopts them at once
+            with transaction.atomic():
+                DeviceCommand.objects.bulk_create([command.row() for command in held if command.row_id is None])
+                DeviceCommand.objects.bulk_update(
+                    [command.row() for command in held if command.row_id is not None],
+                    ['status', 'attempts', 'owner', 'lease_until'],
+                )
+        except Exception:
+            logger.exception('Failed to hand over %d device commands', len(held))
+        finally:
+            close_old_connections()
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            stats = dict(self.counters)
+            stats['in_memory'] = len(self._commands)
+            stats['in_flight'] = sum(1 for command in self._commands.values() if command.awaiting_ack)
+            stats['devices'] = len(self._devices)
+            samples = list(self._latencies)
+        stats['ack_latency_ms'] = latency_summary([latency for _, latency in samples])
+        recent = [acked_at for acked_at, _ in samples if now - acked_at <= 60]
+        span = now - min(recent) if recent else 0
+        stats['acked_per_second'] = round(len(recent) / span, 1) if span > 0 else 0.0
+        return stats
+
+    def reset_stats(self):
+        with self._lock:
+            self._latencies.clear()
+            for name in self.counters:
+                self.counters[name] = 0
+
+    # Internals
+
+    def _next_seq(self):
+        with self._seq_lock:
+            seq = next(self._seqs, None)
+            if seq is None:
+                self._seqs = iter(reserve(COMMAND_SEQUENCE, self.seq_block))
+                seq = next(self._seqs)
+            return seq
+
+    def _hold(self, command, now):
+        self._commands[command.seq] = command
+        queue = self._devices.setdefault(command.device_id, deque())
+        # In sequence order behind the in-flight head; adopted commands can be older than held ones
+        position = len(queue)
+        while position > 1 and queue[position - 1] > command.seq:
+            position -= 1
+        queue.insert(position, command.seq)
+        if len(queue) == 1:
+            self._schedule(command, now)
+
+    def _schedule(self, command, due_at):
+        command.due_at = due_at
+        heapq.heappush(self._timers, (due_at, command.seq))
+
+    def _backoff(self, attempts):
+        delay = min(self.backoff_base * 2 ** (attempts - 1), self.backoff_max)
+        # Jitter so devices that reconnect together are not all resent at once
+        return delay * random.uniform(0.5, 1.0)
+
+    def _finish(self, command, status, error=''):
+        command.status = status
+        command.error = error
+        command.awaiting_ack = False
+        command.finished_at = timezone.now()
+        del self._commands[command.seq]
+        queue = self._devices[command.device_id]
+        queue.remove(command.seq)
+        if queue:
+            self._schedule(self._commands[queue[0]], time.monotonic())
+        else:
+            del self._devices[command.device_id]
+        self._unwritten.append(command)
+        self._finished[command.seq] = command
+        while len(self._finished) > FINISHED_KEPT:
+            self._finished.popitem(last=False)
+
+    def _due(self, now):
+        """Commands to send now; fails those out of attempts"""
+        sends = []
+        with self._lock:
+            while self._timers and self._timers[0][0] <= now:
+                due_at, seq = heapq.heappop(self._timers)
+                command = self._commands.get(seq)
+                if command is None or command.due_at != due_at:
+                    continue   # Finished or rescheduled since
+                if command.awaiting_ack:
+                    # No acknowledgement in time
+                    command.awaiting_ack = False
+                    self.counters['timed_out'] += 1
+                    if command.attempts >= self.max_attempts:
+                        self._finish(command, 'failed', f'No acknowledgement after {command.attempts} attempts')
+                    else:
+                        self._schedule(command, now + self._backoff(command.attempts))
+                    continue
+                command.attempts += 1
+                command.status = 'sent'
+                command.awaiting_ack = True
+                self._schedule(command, now + self.ack_timeout)
+                self.counters['sent' if command.attempts == 1 else 'resent'] += 1
+                sends.append(command)
+        return sends
+
+    def _next_timeout(self):
+        with self._lock:
+            if not self._timers:
+                return 1.0
+            return min(max(self._timers[0][0] - time.monotonic(), 0.0), 1.0)
+
+    def _ensure_workers(self):
+        if self._threads or self._stopped:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            targets = [('device-commands', self._run)]
+            if self.deliver is deliver_over_channels and get_channel_layer() is not None:
+                targets.append(('device-command-acks', self._receive_acks))
+            for name, target in targets:
+                thread = threading.Thread(target=target, name=name, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self._next_timeout())
+            self._wakeup.clear()
+            if self._stopped:
+                break
+            self._cycle()
+
+    def _cycle(self):
+        sends = self._due(time.monotonic())
+        if sends:
+            try:
+                self.deliver(sends, self.reply_to)
+            except Exception:
+                # Unacknowledged either way; the timeouts resend them
+                logger.warning('Delivering %d device commands failed', len(sends), exc_info=True)
+        try:
+            self._write_outcomes()
+            self._maintain()
+        except Exception:
+            logger.exception('Device command queue database maintenance failed')
+        finally:
+            close_old_connections()
+
+    def _write_outcomes(self):
+        """Apply acknowledged commands and record every finished one"""
+        with self._lock:
+            finished, self._unwritten = self._unwritten, []
+            self._writing = bool(finished)
+        if not finished:
+            return
+        retry = []
+        try:
+            with transaction.atomic():
+                retry, logged = self._apply_acked([command for command in finished if command.status == 'acked'])
+                retrying = set(retry)
+                outcomes = [command for command in finished if command not in retrying]
+                failed = [command for command in outcomes if command.status != 'acked' and command not in logged]
+                if failed:
+                    AutomationLog.objects.bulk_create([
+                        AutomationLog(device_id=command.device_id, success=False, error_message=command.error,
+                                      **command_log(command))
+                        for command in failed
+                    ])
+                DeviceCommand.objects.bulk_update(
+                    [command.row() for command in outcomes if command.row_id is not None], OUTCOME_FIELDS
+                )
+                DeviceCommand.objects.bulk_create([command.row() for command in outcomes if command.row_id is None])
+        except Exception:
+            with self._lock:
+                self._unwritten = finished + self._unwritten
+                self.counters['write_failures'] += 1
+                self._writing = False
+            raise
+        with self._lock:
+            self._unwritten = retry + self._unwritten
+            self._writing = False
+
+    def _apply_acked(self, acked):
+        """Apply acknowledged commands in one executor batch, else each in its own savepoint.
+
+        Commands the executor rejects, or that raise on ``MAX_APPLY_ATTEMPTS``
+        cycles, become failed. Returns the commands to retry next cycle and
+        those the executor already wrote an AutomationLog row for.
+        """
+        if not acked:
+            return [], set()
+        retry = []
+        try:
+            with transaction.atomic():
+                batches = [(acked, apply_device_actions([device_action(command) for command in acked]))]
+        except Exception:
+            logger.warning('Applying %d acknowledged device commands failed; applying them one at a time',
+                           len(acked), exc_info=True)
+            batches = []
+            for command in acked:
+                try:
+                    with transaction.atomic():
+                        batches.append(([command], apply_device_actions([device_action(command)])))
+                except Exception as e:
+                    command.apply_attempts += 1
+                    with self._lock:
+                        self.counters['apply_failures'] += 1
+                    if command.apply_attempts < MAX_APPLY_ATTEMPTS:
+                        retry.append(command)
+                        continue
+                    logger.exception('Giving up on applying device command %s', command.seq)
+                    command.status = 'failed'
+                    command.error = f'Acknowledged but not applied: {e}'
+
+        logged = set()
+        for commands, results in batches:
+            for command, result in zip(commands, results):
+                logged.add(command)
+                if not result.success:
+                    # e.g. the device was deleted after the command was submitted
+                    command.status = 'failed'
+                    command.error = f'Acknowledged but not applied: {result.error}'
+        return retry, logged
+
+    def _maintain(self):
+        now = time.monotonic()
+        if now - self._spilled_at >= self.spill_after / 2:
+            self._spilled_at = now
+            self._spill(now)
+        if now - self._leased_at >= self.lease / 3:
+            self._leased_at = now
+            self._renew_lease()
+            self._adopt()
+            self._stored = self._stored_devices()
+
+    def _spill(self, now):
+        """Write commands unacknowledged for ``spill_after`` seconds, leased to this process"""
+        with self._lock:
+            due = [
+                command for command in self._commands.values()
+                if command.row_id is None and now - command.submitted_at >= self.spill_after
+            ]
+        if not due:
+            return
+        rows = DeviceCommand.objects.bulk_create([
+            command.row(self.owner, timezone.now() + timedelta(seconds=self.lease)) for command in due
+        ])
+        if any(row.pk is None for row in rows):
+            # Backends that cannot return inserted keys
+            ids = dict(DeviceCommand.objects.filter(seq__in=[row.seq for row in rows]).values_list('seq', 'id'))
+            for row in rows:
+                row.pk = ids[row.seq]
+        with self._lock:
+            for command, row in zip(due, rows):
+                command.row_id = row.pk
+            self.counters['spilled'] += len(due)
+
+    def _renew_lease(self):
+        """Extend the lease on this process's spilled commands and drop any finished elsewhere"""
+        with self._lock:
+            spilled = [command.seq for command in self._commands.values() if command.row_id is not None]
+        if not spilled:
+            return
+        DeviceCommand.objects.filter(owner=self.owner, status__in=PENDING_STATUSES).update(
+            lease_until=timezone.now() + timedelta(seconds=self.lease)
+        )
+        # Acknowledged through the database after its reply route was lost (see record_stored_ack)
+        done = DeviceCommand.objects.filter(seq__in=spilled).exclude(status__in=PENDING_STATUSES)
+        for seq, status, error in done.values_list('seq', 'status', 'error'):
+            with self._lock:
+                command = self._commands.get(seq)
+                if command is not None:
+                    self._finish(command, status, error)
+                    self._unwritten.remove(command)
+                    self.counters['finished_elsewhere'] += 1
+
+    def _stored_devices(self):
+        return frozenset(
+            DeviceCommand.objects.filter(status__in=PENDING_STATUSES).exclude(owner=self.owner)
+            .values_list('device_id', flat=True).distinct()
+        )
+
+    def _adopt(self):
+        """Take over pending commands whose lease ran out, up to this process's capacity.
+
+        A row is skipped while an older pending row for its device is leased
+        to another process, which keeps that device's queue.
+        """
+        with self._lock:
+            room = self.max_in_memory - len(self._commands)
+        if room <= 0:
+            return
+        now = timezone.now()
+        with transaction.atomic():
+            # Locked oldest first, so concurrent adopters wait for each other and cannot split a device's queue
+            stale = DeviceCommand.objects.filter(status__in=PENDING_STATUSES).filter(
+                Q(lease_until__isnull=True) | Q(lease_until__lt=now)
+            )
+            candidates = list(stale.select_for_update().order_by('seq').values_list('id', 'device_id', 'seq')[:room])
+            if not candidates:
+                return
+            leased = (
+                DeviceCommand.objects.filter(device_id__in={device_id for _, device_id, _ in candidates},
+                                             status__in=PENDING_STATUSES, lease_until__gte=now)
+                .exclude(owner=self.owner).values('device_id').annotate(oldest=Min('seq'))
+            )
+            held_elsewhere = {row['device_id']: row['oldest'] for row in leased}
+            ids = [
+                pk for pk, device_id, seq in candidates
+                if device_id not in held_elsewhere or seq < held_elsewhere[device_id]
+            ]
+            DeviceCommand.objects.filter(id__in=ids).update(
+                owner=self.owner, lease_until=now + timedelta(seconds=self.lease)
+            )
+        rows = DeviceCommand.objects.filter(id__in=ids, owner=self.owner).order_by('seq')
+        started = time.monotonic()
+        with self._lock:
+            for row in rows:
+                if row.seq not in self._commands:
+                    self._hold(PendingCommand.from_row(row), started)
+                    self.counters['adopted'] += 1
+        self._wakeup.set()
+
+    def _receive_acks(self):
+        """Take acknowledgements forwarded by ingest consumers in other processes"""
+        channel_layer = get_channel_layer()
+
+        async def receive():
+            self.reply_to = await channel_layer.new_channel('device-commands.')
+            while not self._stopped:
+                try:
+                    message = await asyncio.wait_for(channel_layer.receive(self.reply_to), timeout=1.0)
+                except asyncio.TimeoutError:
+                    continue
+                except Exception:
+                    logger.warning('Receiving device command acknowledgements failed', exc_info=True)
+                    await asyncio.sleep(1.0)
+                    continue
+                self.ack(message.get('device_id'), message.get('seq'), message.get('success', True),
+                         message.get('state'), message.get('error'))
+
+        asyncio.run(receive())
+
+
+def record_stored_ack(device_id, seq, success=True, state=None, error=''):
+    """Finish a spilled command in the database when no process route for its ack is known"""
+    with transaction.atomic():
+        row = DeviceCommand.objects.select_for_update().filter(
+            seq=seq, device_id=device_id, status__in=PENDING_STATUSES
+        ).first()
+        if row is None:
+            return False
+        command = PendingCommand.from_row(row)
+        command.status = 'acked' if success else 'failed'
+        command.error = '' if success else str(error or 'Rejected')
+        command.result = state if isinstance(state, dict) else None
+        command.finished_at = timezone.now()
+        command.row().save(update_fields=OUTCOME_FIELDS)
+        if success:
+            apply_device_actions([device_action(command)])
+    return True
+
+
+command_queue = CommandQueue()
+
+atexit.register(command_queue.stop)
@@ -0,0 +1,267 @@
+import asyncio
+import hmac
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+
+from devices.auth import authenticate_key
+from .command_queue import command_queue, device_group, record_stored_ack
+from .dispatch import dispatcher
+from .heartbeat import tracker as heartbeat_tracker
+from .ingest import alert_tracker, ingest_batch, is_alert_reading, validate_reading
+from .thresholds import engine as threshold_engine
+from .wire import decode_readings
+
+logger = logging.getLogger(__name__)
+
+# Commands per connection whose origin process is remembered for forwarding acks
+MAX_REPLY_ROUTES = 1000
+
+
+def get_ingest_settings():
+    """Device websocket settings merged over the defaults"""
+    defaults = {
+        'TOKEN': '',             # Legacy shared token; empty disables it
+        'BATCH_SIZE': 200,       # Readings per database write
+        'FLUSH_INTERVAL': 0.5,   # Max seconds a reading waits before it is written
+        'MAX_PENDING': 2000,     # Readings buffered per connection before throttling
+    }
+    defaults.update(getattr(settings, 'DEVICE_INGEST_SETTINGS', {}))
+    return defaults
+
+
+def ingest_and_alert(items, received_at=None):
+    """Write a batch and queue safety protocols for its alerts (sync, for the DB thread)"""
+    results, alerts = ingest_batch(items)
+    for reading in alerts:
+        dispatcher.submit(reading.sensor_type, reading.value, reading.location, received_at)
+    return results, alerts
+
+
+class DeviceIngestConsumer(AsyncWebsocketConsumer):
+    """Long-lived ingestion channel for devices.
+
+    The device authenticates once with ``{"type": "auth", "key"}`` (a
+    DeviceAPIKey) or the legacy ``{"type": "auth", "device_id", "token"}``, and then streams ``reading`` / ``readings`` JSON messages or binary frames
+    in the automation.wire format. Readings are validated on arrival and
+    written in batches; every write is acknowledged with per-item errors and
+    the connection's remaining credit. Alerts are written immediately.
+    ``{"type": "heartbeat"}`` keeps an idle device marked online.
+
+    Queued device commands (see command_queue.py) arrive as ``{"type":
+    "command", "seq", "action", "parameters", "attempt"}``. The device
+    answers ``{"type": "command_ack", "seq", "success", "state", "error"}``
+    once it has applied the command, and again for any resend of a ``seq``
+    it has already applied.
+    """
+
+    async def connect(self):
+        self.config = get_ingest_settings()
+        self.device_id = None
+        self.bound_device_id = None   # Set when the device's key is bound to one device
+        self.pending = []
+        self.pending_since = None
+        self.flush_lock = asyncio.Lock()
+        self.flusher = None
+        self.reply_routes = OrderedDict()   # command seq -> reply channel of the process that sent it
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        if self.device_id is not None:
+            await self.channel_layer.group_discard(device_group(self.device_id), self.channel_name)
+        if self.flusher:
+            self.flusher.cancel()
+        if self.pending:
+            await self.flush()
+
+    async def receive(self, text_data=None, bytes_data=None):
+        if self.device_id is None:
+            await self.authenticate(text_data)
+            return
+
+        if bytes_data is not None:
+            try:
+                items = decode_readings(bytes_data)
+            except ValueError as e:
+                await self.send_json({'type': 'error', 'error': str(e)})
+                return
+        else:
+            try:
+                message = json.loads(text_data)
+            except ValueError:
+                await self.send_json({'type': 'error', 'error': 'Invalid JSON'})
+                return
+            if not isinstance(message, dict):
+                await self.send_json({'type': 'error', 'error': 'Messages must be JSON objects'})
+                return
+            if message.get('type') == 'heartbeat':
+                # Liveness only; readings count as heartbeats when they are stored
+                heartbeat_tracker.beat(self.device_id)
+                return
+            if message.get('type') == 'command_ack':
+                await self.command_acked(message)
+                return
+            if message.get('type') == 'readings':
+                items = message.get('readings') or []
+                if not isinstance(items, list):
+                    await self.send_json({'type': 'error', 'error': 'readings must be a list'})
+                    return
+            elif message.get('type') == 'reading':
+                items = [message]
+            else:
+                await self.send_json({'type': 'error', 'error': f"Unknown message type {message.get('type')!r}"})
+                return
+
+        await self.enqueue(items)
+
+    async def authenticate(self, text_data):
+        try:
+            message = json.loads(text_data or '')
+        except ValueError:
+            message = {}
+        if not isinstance(message, dict):
+            message = {}
+        device_id = message.get('device_id')
+
+        if message.get('type') == 'auth' and message.get('key'):
+            # Per-device API key; served from the key cache after the first lookup
+            identity = await database_sync_to_async(authenticate_key)(str(message['key']))
+            if identity is not None:
+                self.bound_device_id = identity.device_id
+                device_id = identity.device_id or device_id
+        else:
+            # Legacy shared token
+            token = str(message.get('token') or '')
+            expected = self.config['TOKEN']
+            identity = message.get('type') == 'auth' and expected and hmac.compare_digest(token, expected)
+
+        if not identity or not device_id:
+            await self.send_json({'type': 'auth_failed'})
+            await self.close(code=4001)
+            return
+
+        self.device_id = str(device_id)
+        heartbeat_tracker.beat(self.device_id)
+        await self.channel_layer.group_add(device_group(self.device_id), self.channel_name)
+        command_queue.device_connected(self.device_id)
+        self.flusher = asyncio.ensure_future(self.flush_periodically())
+        await self.send_json({
+            'type': 'auth_ok',
+            'device_id': self.device_id,
+            'batch_size': self.config['BATCH_SIZE'],
+            'credit': self.config['MAX_PENDING'],
+        })
+
+    async def enqueue(self, items):
+        errors = []
+        urgent = False
+        if not threshold_engine.fresh():
+            # Recompiling the threshold table reads the database, which is not allowed on the event loop
+            await database_sync_to_async(threshold_engine.table)()
+        for item in items:
+            if isinstance(item, ValueError):
+                errors.append(str(item))
+                continue
+            if not isinstance(item, dict):
+                errors.append('Each reading must be a JSON object')
+                continue
+            if not item.get('device_id'):
+                item['device_id'] = self.device_id
+            elif self.bound_device_id and item['device_id'] != self.bound_device_id:
+                # Keys bound to a device may only report for that device
+                errors.append(f"This key is bound to device {self.bound_device_id}, not {item['device_id']}")
+                continue
+            cleaned, item_errors = validate_reading(item)
+            if item_errors:
+                errors.extend(item_errors)
+                continue
+            if len(self.pending) >= self.config['MAX_PENDING']:
+                # Backpressure: refuse instead of growing without bound
+                errors.append('throttled')
+                continue
+            if not self.pending:
+                self.pending_since = time.monotonic()
+            # Flush at once for a possible new incident, not for repeats of an open one
+            urgent = urgent or (
+                is_alert_reading(cleaned['sensor_type'], cleaned['value'], cleaned['location'])
+                and not alert_tracker.is_open(cleaned['device_id'], cleaned['sensor_type'])
+            )
+            self.pending.append(cleaned)
+
+        if errors:
+            await self.send_json({
+                'type': 'rejected',
+                'errors': errors[:50],
+                'count': len(errors),
+                'credit': self.credit(),
+            })
+        if urgent or len(self.pending) >= self.config['BATCH_SIZE']:
+            await self.flush()
+
+    async def flush(self):
+        async with self.flush_lock:
+            batch, self.pending = self.pending, []
+            if not batch:
+                return
+            try:
+                results, alerts = await database_sync_to_async(ingest_and_alert)(batch, self.pending_since)
+            except Exception:
+                logger.exception('Device %s: failed to store %d readings', self.device_id, len(batch))
+                await self.send_json({'type': 'error', 'error': 'Storage failure, resend batch', 'count': len(batch)})
+                return
+
+        await self.send_json({
+            'type': 'ack',
+            'accepted': sum(1 for result in results if result['success']),
+            'alerts': len(alerts),
+            'credit': self.credit(),
+        })
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.config['FLUSH_INTERVAL'])
+            if self.pending:
+                await self.flush()
+
+    async def device_command(self, event):
+        """Relay a queued command to the device"""
+        command = event['command']
+        if event.get('reply_to'):
+            self.reply_routes[command['seq']] = event['reply_to']
+            while len(self.reply_routes) > MAX_REPLY_ROUTES:
+                self.reply_routes.popitem(last=False)
+        await self.send_json({'type': 'command', **command})
+
+    async def command_acked(self, message):
+        try:
+            seq = int(message.get('seq'))
+        except (TypeError, ValueError):
+            await self.send_json({'type': 'error', 'error': 'command_ack needs the command seq'})
+            return
+        success = message.get('success', True) is not False
+        state = message.get('state') if isinstance(message.get('state'), dict) else None
+        error = str(message.get('error') or '')
+        reply_to = self.reply_routes.pop(seq, None)
+
+        if command_queue.ack(self.device_id, seq, success, state, error):
+            return
+        if reply_to:
+            # Held by the process that sent it
+            await self.channel_layer.send(reply_to, {
+                'type': 'command.ack', 'device_id': self.device_id, 'seq': seq,
+                'success': success, 'state': state, 'error': error,
+            })
+        else:
+            await database_sync_to_async(record_stored_ack)(self.device_id, seq, success, state, error)
+
+    def credit(self):
+        """How many more readings the device may send before it is throttled"""
+        return max(self.config['MAX_PENDING'] - len(self.pending), 0)
+
+    async def send_json(self, payload):
+        await self.send(text_data=json.dumps(payload))
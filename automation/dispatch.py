@@ -0,0 +1,258 @@
+"""Priority dispatch of safety protocols off the request path.
+
+Alert readings are submitted with the priority of the SafetyProtocol that
+matched them (1 = highest) and executed by a small pool of worker threads,
+so a gas or fire alert never waits behind lower-priority work. Jobs for a
+(sensor_type, location) that is already queued are coalesced, and when the
+queue is full the lowest-priority job is dropped to make room.
+"""
+import atexit
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections
+
+from .thresholds import engine as threshold_engine
+
+logger = logging.getLogger(__name__)
+
+# Priority used when no protocol rule matches a submitted alert
+DEFAULT_PRIORITY = 5
+
+
+def get_dispatch_settings():
+    """Safety dispatch settings merged over the defaults"""
+    defaults = {
+        'ENABLED': True,
+        'WORKERS': 4,              # Worker threads executing protocols
+        'MAX_QUEUE': 10000,        # Queued jobs before low-priority work is shed
+        'LATENCY_SAMPLES': 10000,  # Recent latencies kept for percentiles
+    }
+    defaults.update(getattr(settings, 'SAFETY_DISPATCH_SETTINGS', {}))
+    return defaults
+
+
+class SafetyJob:
+    __slots__ = ('priority', 'sensor_type', 'value', 'location', 'received_at', 'coalesced', 'cancelled')
+
+    def __init__(self, priority, sensor_type, value, location, received_at):
+        self.priority = priority
+        self.sensor_type = sensor_type
+        self.value = value
+        self.location = location
+        self.received_at = received_at
+        self.coalesced = 0
+        self.cancelled = False
+
+    @property
+    def key(self):
+        return (self.sensor_type, self.location)
+
+
+def run_safety_protocol(job):
+    from .views import trigger_safety_protocol
+
+    trigger_safety_protocol(job.sensor_type, job.value, job.location)
+
+
+class SafetyDispatcher:
+    """Heap-ordered job queue drained by a lazily started worker pool"""
+
+    def __init__(self, action=run_safety_protocol, workers=None, max_queue=None, enabled=None):
+        config = get_dispatch_settings()
+        self.action = action
+        self.workers = workers or config['WORKERS']
+        self.max_queue = max_queue or config['MAX_QUEUE']
+        self.enabled = config['ENABLED'] if enabled is None else enabled
+
+        self._heap = []
+        self._queued = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._threads = []
+        self._stopped = False
+        self._active = 0
+        self._latencies = deque(maxlen=config['LATENCY_SAMPLES'])
+        self.counters = {
+            'submitted': 0,
+            'executed': 0,
+            'coalesced': 0,
+            'dropped': 0,
+            'failed': 0,
+        }
+
+    def submit(self, sensor_type, value, location='', received_at=None, priority=None):
+        """Queue a protocol run for an alert reading; returns False if it was shed.
+
+        ``received_at`` is the ``time.monotonic()`` at which the reading
+        arrived and is used for the webhook-to-actuation latency.
+        """
+        if priority is None:
+            rule = threshold_engine.match(sensor_type, value, location)
+            priority = rule.priority if rule else DEFAULT_PRIORITY
+        job = SafetyJob(priority, sensor_type, value, location or '', received_at or time.monotonic())
+
+        if not self.enabled:
+            with self._condition:
+                self.counters['submitted'] += 1
+            self._execute(job)
+            return True
+
+        with self._condition:
+            self.counters['submitted'] += 1
+            queued = self._queued.get(job.key)
+            if queued is not None:
+                # The queued run will act on the latest value for this location
+                queued.value = value
+                queued.coalesced += 1
+                self.counters['coalesced'] += 1
+                if priority < queued.priority:
+                    queued.cancelled = True
+                    job.received_at = min(job.received_at, queued.received_at)
+                    job.coalesced = queued.coalesced
+                    self._push(job)
+                return True
+
+            if len(self._queued) >= self.max_queue and not self._shed(priority):
+                self.counters['dropped'] += 1
+                return False
+            self._push(job)
+
+        self._ensure_workers()
+        return True
+
+    def drain(self, timeout=None):
+        """Block until the queue is empty and no job is running"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._queued or self._active:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def stop(self, timeout=5.0):
+        """Finish queued jobs, then stop the worker pool"""
+        self.drain(timeout)
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=1.0)
+
+    def stats(self):
+        with self._condition:
+            stats = dict(self.counters)
+            stats['queued'] = len(self._queued)
+            stats['running'] = self._active
+            samples = list(self._latencies)
+
+        stats['latency_ms'] = latency_summary([latency for _, latency in samples])
+        by_priority = {}
+        for priority, latency in samples:
+            by_priority.setdefault(priority, []).append(latency)
+        stats['latency_ms_by_priority'] = {
+            priority: latency_summary(latencies) for priority, latencies in sorted(by_priority.items())
+        }
+        return stats
+
+    def reset_stats(self):
+        with self._condition:
+            self._latencies.clear()
+            for name in self.counters:
+                self.counters[name] = 0
+
+    def _push(self, job):
+        heapq.heappush(self._heap, (job.priority, next(self._sequence), job))
+        self._queued[job.key] = job
+        self._condition.notify()
+
+    def _shed(self, priority):
+        """Drop the newest lowest-priority job if it ranks below ``priority``"""
+        victim = max(
+            (entry for entry in self._heap if not entry[2].cancelled),
+            key=lambda entry: (entry[0], entry[1]),
+            default=None,
+        )
+        if victim is None or victim[0] <= priority:
+            return False
+        victim[2].cancelled = True
+        del self._queued[victim[2].key]
+        self.counters['dropped'] += 1
+        logger.warning('Safety dispatch queue full; dropped priority %s job for %s', victim[0], victim[2].key)
+        return True
+
+    def _ensure_workers(self):
+        if self._threads or self._stopped:
+            return
+        with self._condition:
+            if self._threads:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'safety-dispatch-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _next_job(self):
+        with self._condition:
+            while True:
+                while self._heap:
+                    _, _, job = heapq.heappop(self._heap)
+                    if job.cancelled:
+                        continue
+                    del self._queued[job.key]
+                    self._active += 1
+                    return job
+                if self._stopped:
+                    return None
+                self._condition.wait()
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            try:
+                self._execute(job)
+            finally:
+                close_old_connections()
+                with self._condition:
+                    self._active -= 1
+                    self._condition.notify_all()
+
+    def _execute(self, job):
+        try:
+            self.action(job)
+        except Exception:
+            logger.exception('Safety protocol for %s at %s failed', job.sensor_type, job.location)
+            with self._condition:
+                self.counters['failed'] += 1
+            return
+        latency = (time.monotonic() - job.received_at) * 1000
+        with self._condition:
+            self.counters['executed'] += 1
+            self._latencies.append((job.priority, latency))
+
+
+def latency_summary(latencies):
+    if not latencies:
+        return {'count': 0, 'p50': None, 'p99': None, 'max': None}
+    p50, p99 = np.percentile(latencies, [50, 99])
+    return {
+        'count': len(latencies),
+        'p50': round(float(p50), 2),
+        'p99': round(float(p99), 2),
+        'max': round(max(latencies), 2),
+    }
+
+
+dispatcher = SafetyDispatcher()
+
+atexit.register(dispatcher.stop)
@@ -0,0 +1,173 @@
+"""Batched execution of device actions.
+
+A list of actions (a scene, a safety protocol, a rule firing) is applied in
+one pass: the affected DeviceStatus rows are read with a single query,
+new states are computed in memory (several actions on the same device are
+folded into one update), and the rows and their AutomationLog entries are
+written with one ``bulk_update`` and one ``bulk_create`` in a single
+transaction, all stamped with one ``change_seq`` for delta polling, along
+with their DeviceStateEvents (see state_log.py). Once
+that commits, the device state cache is updated and one consolidated
+``device_update`` message goes to the dashboard channel group.
+"""
+import logging
+from collections import namedtuple
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+from core.sequences import next_value
+
+from .models import DEVICE_CHANGE_SEQUENCE, AutomationLog, DeviceStatus
+from .state_cache import state_cache
+from .state_log import device_change, is_first_change, logged_versions, record_changes
+
+logger = logging.getLogger(__name__)
+
+DEVICE_ACTIONS = ('turn_on', 'turn_off', 'toggle', 'set_value')
+
+DASHBOARD_GROUP = 'dashboard'
+
+# ``defaults`` are DeviceStatus field values applied like update_or_create's:
+# set on an existing device, or used to create a missing one. Without them a
+# missing device fails the action. ``log`` holds AutomationLog fields
+# (log_type, description, user, metadata); None writes no log row.
+DeviceAction = namedtuple('DeviceAction', ['device_id', 'action', 'parameters', 'defaults', 'log'],
+                          defaults=(None, None, None))
+
+ActionResult = namedtuple('ActionResult', ['device_id', 'action', 'success', 'state', 'error'])
+
+
+def next_state(state, action, parameters=None):
+    """New current_state after applying ``action``; raises ValueError for unknown actions"""
+    state = dict(state)
+    if action == 'turn_on':
+        state['status'] = 'on'
+    elif action == 'turn_off':
+        state['status'] = 'off'
+    elif action == 'toggle':
+        state['status'] = 'off' if state.get('status') == 'on' else 'on'
+    elif action == 'set_value':
+        state.update(parameters or {})
+    else:
+        raise ValueError(f"Unknown device action '{action}'")
+    return state
+
+
+def apply_device_actions(actions, broadcast=True):
+    """Apply ``actions`` in order and return one ActionResult per action"""
+    actions = list(actions)
+    if not actions:
+        return []
+    results = []
+    logs = []
+    changed = {}
+    created = {}
+    fields = {'current_state', 'change_seq', 'state_version'}
+    last_action = {}
+
+    with transaction.atomic():
+        # Lock in a fixed order so concurrent batches cannot deadlock
+        devices = {
+            device.device_id: device
+            for device in DeviceStatus.objects.select_for_update()
+            .filter(device_id__in={action.device_id for action in actions})
+            .order_by('device_id')
+        }
+        # Stored values, for the state log
+        previous = {
+            device.device_id: {
+                'current_state': device.current_state,
+                'is_online': device.is_online,
+                'state_version': device.state_version,
+            }
+            for device in devices.values()
+        }
+        for action in actions:
+            device = devices.get(action.device_id)
+            if device is None and action.defaults is not None:
+                device = devices[action.device_id] = created[action.device_id] = DeviceStatus(
+                    device_id=action.device_id, **action.defaults
+                )
+            elif device is not None and action.defaults:
+                for name, value in action.defaults.items():
+                    setattr(device, name, value)
+                fields.update(action.defaults)
+
+            result = _apply(device, action)
+            results.append(result)
+            if result.success:
+                last_action[action.device_id] = action.action
+                if action.device_id not in created:
+                    changed[action.device_id] = device
+            if action.log is not None:
+                logs.append(AutomationLog(
+                    device_id=action.device_id,
+                    success=result.success,
+                    error_message=result.error,
+                    **action.log,
+                ))
+
+        state_changes = []
+        if changed or created:
+            # One change sequence value for the whole batch; it commits with it
+            change_seq = next_value(DEVICE_CHANGE_SEQUENCE)
+            written = {**changed, **created}
+            logged = logged_versions(
+                device_id for device_id in written if is_first_change(previous.get(device_id))
+            )
+            for device_id, device in written.items():
+                device.change_seq = change_seq
+                change = device_change(device, last_action.get(device_id, 'create'), previous.get(device_id),
+                                       logged.get(device_id, 0))
+                if change is not None:
+                    state_changes.append(change)
+        if created:
+            DeviceStatus.objects.bulk_create(created.values())
+        if changed:
+            DeviceStatus.objects.bulk_update(changed.values(), sorted(fields))
+        if logs:
+            AutomationLog.objects.bulk_create(logs)
+        if state_changes:
+            record_changes(state_changes, change_seq)
+
+        if changed or created:
+            updated = [devices[device_id] for device_id in {**changed, **created}]
+            transaction.on_commit(lambda: state_cache.saved(updated, membership_changed=bool(created)))
+            if broadcast:
+                transaction.on_commit(lambda: broadcast_device_updates(updated))
+    return results
+
+
+def _apply(device, action):
+    if device is None:
+        return ActionResult(action.device_id, action.action, False, None, f'Device {action.device_id} not found')
+    try:
+        device.current_state = next_state(device.current_state, action.action, action.parameters)
+    except ValueError as e:
+        return ActionResult(action.device_id, action.action, False, device.current_state, str(e))
+    return ActionResult(action.device_id, action.action, True, device.current_state, '')
+
+
+def broadcast_device_updates(devices):
+    """Send one device_update message listing every changed device"""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    message = {
+        'devices': [
+            {
+                'device_id': device.device_id,
+                'is_online': device.is_online,
+                'current_state': device.current_state,
+                'location': device.location,
+            }
+            for device in devices
+        ],
+    }
+    try:
+        async_to_sync(channel_layer.group_send)(DASHBOARD_GROUP, {'type': 'device_update', 'message': message})
+    except Exception:
+        # The state is already committed; a missed push is caught up on the next poll
+        logger.warning('Device update broadcast failed', exc_info=True)
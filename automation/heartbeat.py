@@ -0,0 +1,234 @@
+"""Coalesced device heartbeats.
+
+A heartbeat (an explicit ping, or any reading a device sends) only records
+the device's last-seen time in a per-process dict, so a device pinging
+every few seconds costs one dict assignment per ping. A background thread
+flushes the latest time per device every ``FLUSH_INTERVAL`` seconds with
+one ``bulk_update`` touching only ``last_seen``, never the ``current_state``
+JSON. Devices go offline through a periodic sweep that flips ``is_online``
+for every row not seen within ``OFFLINE_AFTER`` seconds rather than
+anything being written per request. Only those ``is_online`` flips (not
+``last_seen`` refreshes) advance ``change_seq`` and are written to the
+device state log, so idle pollers see no changes. Both keep the device
+state cache current.
+"""
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from core.sequences import next_value
+
+from .state_cache import state_cache
+from .state_log import logged_versions, record_changes, state_change
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_FIELDS = ['last_seen']
+
+
+def get_heartbeat_settings():
+    """Device heartbeat settings merged over the defaults"""
+    defaults = {
+        'FLUSH_INTERVAL': 10.0,    # Seconds between last_seen writes
+        'OFFLINE_AFTER': 90,       # Seconds without a heartbeat before a device is offline
+        'SWEEP_INTERVAL': 30.0,    # Seconds between offline sweeps
+        'BATCH_SIZE': 1000,        # Rows per bulk_update statement
+    }
+    defaults.update(getattr(settings, 'HEARTBEAT_SETTINGS', {}))
+    return defaults
+
+
+class HeartbeatTracker:
+    """Latest heartbeat per device_id, written behind in bulk"""
+
+    def __init__(self, flush_interval=None, offline_after=None, sweep_interval=None):
+        config = get_heartbeat_settings()
+        self.flush_interval = flush_interval or config['FLUSH_INTERVAL']
+        self.offline_after = offline_after or config['OFFLINE_AFTER']
+        self.sweep_interval = sweep_interval or config['SWEEP_INTERVAL']
+        self.batch_size = config['BATCH_SIZE']
+
+        self._pending = {}
+        self._ids = {}   # device_id -> DeviceStatus pk, so flushes need no lookup
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stopped = False
+        self._swept_at = 0.0
+        self.counters = {
+            'beats': 0,
+            'written': 0,
+            'unknown': 0,
+            'flushes': 0,
+            'came_online': 0,
+            'went_offline': 0,
+            'failed': 0,
+        }
+
+    def beat(self, device_id, now=None):
+        """Record that ``device_id`` is alive"""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._pending[device_id] = now
+            self.counters['beats'] += 1
+        self._ensure_worker()
+
+    def beat_many(self, device_ids, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            for device_id in device_ids:
+                self._pending[device_id] = now
+                self.counters['beats'] += 1
+        self._ensure_worker()
+
+    def flush(self):
+        """Write the latest heartbeat of every device seen since the last flush"""
+        from .models import DeviceStatus
+
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+
+            try:
+                missing = [device_id for device_id in batch if device_id not in self._ids]
+                if missing:
+                    self._ids.update(
+                        DeviceStatus.objects.filter(device_id__in=missing).values_list('device_id', 'id')
+                    )
+                known = [device_id for device_id in batch if device_id in self._ids]
+                rows = [
+                    DeviceStatus(id=self._ids[device_id],
+                                 last_seen=datetime.fromtimestamp(batch[device_id], tz=dt_timezone.utc))
+                    for device_id in known
+                ]
+                with transaction.atomic():
+                    written = DeviceStatus.objects.bulk_update(rows, HEARTBEAT_FIELDS, batch_size=self.batch_size)
+                    came_online, change_seq = self._mark_online([row.id for row in rows])
+            except Exception:
+                logger.exception('Failed to write %d device heartbeats', len(batch))
+                with self._lock:
+                    self.counters['failed'] += len(batch)
+                return 0
+            changes = {device_id: {'last_seen': row.last_seen} for device_id, row in zip(known, rows)}
+            for device_id, row in zip(known, rows):
+                if row.id in came_online:
+                    changes[device_id].update(is_online=True, change_seq=change_seq)
+            state_cache.patched(changes)
+            if written < len(rows):
+                # A cached row was deleted or recreated; look everything up again next time
+                self._ids.clear()
+
+            with self._lock:
+                self.counters['written'] += written
+                self.counters['unknown'] += len(batch) - len(rows)
+                self.counters['came_online'] += len(came_online)
+                self.counters['flushes'] += 1
+            return written
+
+    def _mark_online(self, ids):
+        """Flip offline rows among ``ids`` online under one new change_seq; returns (flipped ids, change_seq)"""
+        from .models import DeviceStatus
+
+        offline = []
+        for start in range(0, len(ids), self.batch_size):
+            offline += DeviceStatus.objects.select_for_update().filter(
+                id__in=ids[start:start + self.batch_size], is_online=False
+            ).order_by('device_id').values_list('id', 'device_id', 'current_state', 'state_version')
+        if not offline:
+            return set(), None
+        change_seq = self._set_online(offline, True, 'online')
+        return {pk for pk, _, _, _ in offline}, change_seq
+
+    def _set_online(self, rows, is_online, action):
+        """Write ``is_online`` to locked ``(id, device_id, current_state, state_version)`` rows and log it"""
+        from .models import DEVICE_CHANGE_SEQUENCE, DeviceStatus
+
+        change_seq = next_value(DEVICE_CHANGE_SEQUENCE)
+        # Devices not logged yet start after any events left by an earlier DeviceStatus with their device_id
+        unlogged = [(pk, device_id) for pk, device_id, _, version in rows if version == 0]
+        logged = logged_versions(device_id for _, device_id in unlogged)
+        for pk, device_id in unlogged:
+            if device_id in logged:
+                DeviceStatus.objects.filter(id=pk).update(state_version=logged[device_id])
+        for start in range(0, len(rows), self.batch_size):
+            DeviceStatus.objects.filter(id__in=[pk for pk, _, _, _ in rows[start:start + self.batch_size]]).update(
+                is_online=is_online, change_seq=change_seq, state_version=F('state_version') + 1
+            )
+        record_changes([
+            state_change(device_id, logged.get(device_id, 0) + 1, action, None, (state, is_online)) if version == 0
+            else state_change(device_id, version + 1, action, (state, not is_online), (state, is_online))
+            for _, device_id, state, version in rows
+        ], change_seq)
+        return change_seq
+
+    def sweep(self, now=None):
+        """Mark devices not seen within ``offline_after`` as offline; returns how many"""
+        from .models import DeviceStatus
+
+        now = timezone.now() if now is None else now
+        cutoff = now - timedelta(seconds=self.offline_after)
+        with transaction.atomic():
+            # Locked, so a heartbeat flushed meanwhile waits and then flips the device back online
+            rows = list(DeviceStatus.objects.select_for_update().filter(is_online=True, last_seen__lt=cutoff)
+                        .order_by('device_id').values_list('id', 'device_id', 'current_state', 'state_version'))
+            if rows:
+                change_seq = self._set_online(rows, False, 'offline')
+        if rows:
+            state_cache.patched({
+                device_id: {'is_online': False, 'change_seq': change_seq} for _, device_id, _, _ in rows
+            })
+        with self._lock:
+            self.counters['went_offline'] += len(rows)
+        self._swept_at = time.monotonic()
+        return len(rows)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['pending'] = len(self._pending)
+        stats['devices_per_flush'] = round(stats['written'] / stats['flushes'], 1) if stats['flushes'] else 0.0
+        return stats
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=self.flush_interval * 2)
+        self.flush()
+
+    def _ensure_worker(self):
+        if self._thread is not None or self._stopped:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='device-heartbeat', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            if self._stopped:
+                break
+            # Flush first so devices that just pinged are not swept offline
+            self.flush()
+            if time.monotonic() - self._swept_at >= self.sweep_interval:
+                try:
+                    self.sweep()
+                except Exception:
+                    logger.exception('Device offline sweep failed')
+            close_old_connections()
+
+
+tracker = HeartbeatTracker()
+
+atexit.register(tracker.stop)
@@ -0,0 +1,226 @@
+"""Sensor reading ingestion shared by the single and batch webhooks"""
+import json
+import math
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core.buffers import WriteBehindBuffer, get_buffer_settings
+
+from . import rollups
+from .alert_state import tracker as alert_tracker
+from .anomaly import detector as anomaly_detector
+from .heartbeat import tracker as heartbeat_tracker
+from .models import SensorReading
+from .rules import rule_index
+from .thresholds import engine as threshold_engine
+
+SENSOR_TYPE_CODES = {code for code, _ in SensorReading.SENSOR_TYPES}
+
+# Upper bound on readings accepted in a single batch request
+MAX_BATCH_SIZE = 5000
+
+# Write-behind buffer for non-alert readings from the single-item webhook
+sensor_buffer = WriteBehindBuffer('sensor_readings', SensorReading, on_flush=rollups.apply_readings)
+
+
+def is_alert_reading(sensor_type, value, location=''):
+    """Check a reading against the compiled safety protocol thresholds"""
+    return threshold_engine.match(sensor_type, value, location) is not None
+
+
+def is_anomalous(cleaned):
+    """Feed a validated reading to the per-device anomaly detector"""
+    timestamp = cleaned.get('timestamp')
+    return anomaly_detector.observe(
+        cleaned['device_id'], cleaned['sensor_type'], cleaned['value'],
+        timestamp.timestamp() if timestamp else None,
+    )
+
+
+def classify_reading(cleaned):
+    """Threshold- and anomaly-check a validated reading and feed the alert state machine.
+
+    Returns ``(is_alert, opens_incident)``. Only threshold breaches open
+    incidents, which need a synchronous write and safety protocols; repeats
+    of an open incident are counted on it instead. Anomalies are flagged as
+    alerts without actuating anything.
+    """
+    rule = threshold_engine.match(cleaned['sensor_type'], cleaned['value'], cleaned['location'])
+    anomalous = is_anomalous(cleaned)
+    opens_incident = alert_tracker.observe(cleaned['device_id'], cleaned['sensor_type'], cleaned['value'], rule)
+    return rule is not None or anomalous, opens_incident
+
+
+def validate_reading(data):
+    """Validate one reading payload, returning (cleaned, errors)"""
+    if not isinstance(data, dict):
+        return None, ['Reading must be a JSON object']
+
+    device_id = data.get('device_id')
+    sensor_type = data.get('sensor_type')
+    value = data.get('value')
+
+    if not all([device_id, sensor_type, value is not None]):
+        return None, ['Missing required fields']
+
+    errors = []
+    if sensor_type not in SENSOR_TYPE_CODES:
+        errors.append(f"Unknown sensor_type '{sensor_type}'")
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        errors.append('value must be a number')
+    else:
+        if not math.isfinite(value):
+            errors.append('value must be a finite number')
+    timestamp = parse_timestamp(data.get('timestamp'))
+    if timestamp is False:
+        errors.append('timestamp must be an ISO 8601 string or unix seconds')
+    if errors:
+        return None, errors
+
+    cleaned = {
+        'device_id': str(device_id),
+        'sensor_type': sensor_type,
+        'value': value,
+        'unit': data.get('unit', '') or '',
+        'location': data.get('location', '') or '',
+    }
+    if timestamp is not None:
+        cleaned['timestamp'] = timestamp
+    return cleaned, []
+
+
+def parse_timestamp(value):
+    """Device-supplied reading time; None if absent, False if unparseable"""
+    if value in (None, ''):
+        return None
+    if isinstance(value, datetime):
+        parsed = value
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        try:
+            return datetime.fromtimestamp(value, tz=dt_timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            return False
+    elif isinstance(value, str):
+        try:
+            parsed = parse_datetime(value)
+        except ValueError:
+            return False
+        if parsed is None:
+            return False
+    else:
+        return False
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, dt_timezone.utc)
+    return parsed
+
+
+def parse_batch(body, content_type=''):
+    """Parse a JSON array or NDJSON request body into a list of items.
+
+    Lines of an NDJSON body that are not valid JSON are returned as
+    ``ValueError`` instances so they can be reported per item.
+    """
+    text = body.decode('utf-8') if isinstance(body, bytes) else body
+
+    if 'ndjson' not in content_type and text.lstrip().startswith('['):
+        items = json.loads(text)
+        if not isinstance(items, list):
+            raise ValueError('Expected a JSON array of readings')
+        return items
+
+    items = []
+    for line_no, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            items.append(json.loads(line))
+        except ValueError as e:
+            items.append(ValueError(f'Line {line_no}: {e}'))
+    return items
+
+
+def store_reading(cleaned, is_alert, urgent=None):
+    """Persist one validated reading.
+
+    Urgent readings (by default, alerts) are written synchronously so safety
+    protocols see them immediately; everything else goes through the
+    write-behind buffer when it is enabled. Returns ``(reading, queued)``;
+    ``reading`` is None if the buffer was full and the reading was dropped.
+    Every reading also counts as a heartbeat from its device.
+    """
+    urgent = is_alert if urgent is None else urgent
+    heartbeat_tracker.beat(cleaned['device_id'])
+    if urgent or not get_buffer_settings()['ENABLED']:
+        with transaction.atomic():
+            reading = SensorReading.objects.create(is_alert=is_alert, **cleaned)
+            rollups.apply_readings([reading])
+        return reading, False
+
+    reading = SensorReading(is_alert=is_alert, **cleaned)
+    if not sensor_buffer.add(reading):
+        return None, True
+    return reading, True
+
+
+def ingest_batch(items):
+    """Validate, bulk insert and alert-check a batch of reading payloads.
+
+    Returns ``(results, alerts)`` where ``results`` holds one entry per
+    input item in order and ``alerts`` holds the created readings that
+    opened a new alert incident.
+    """
+    results = [None] * len(items)
+    valid = []
+    positions = []
+
+    for index, item in enumerate(items):
+        if isinstance(item, ValueError):
+            results[index] = {'index': index, 'success': False, 'errors': [str(item)]}
+            continue
+        cleaned, errors = validate_reading(item)
+        if errors:
+            results[index] = {'index': index, 'success': False, 'errors': errors}
+            continue
+        valid.append(cleaned)
+        positions.append(index)
+
+    readings = []
+    alerts = []
+    if valid:
+        heartbeat_tracker.beat_many({cleaned['device_id'] for cleaned in valid})
+        matches = threshold_engine.match_many(
+            [cleaned['sensor_type'] for cleaned in valid],
+            [cleaned['value'] for cleaned in valid],
+            [cleaned['location'] for cleaned in valid],
+        )
+        for cleaned, match in zip(valid, matches):
+            anomalous = is_anomalous(cleaned)
+            reading = SensorReading(is_alert=match is not None or anomalous, **cleaned)
+            readings.append(reading)
+            if alert_tracker.observe(reading.device_id, reading.sensor_type, reading.value, match):
+                alerts.append(reading)
+        with transaction.atomic():
+            readings = SensorReading.objects.bulk_create(readings)
+            rollups.apply_readings(readings)
+
+    # Incidents reference their opening reading, so create them after the insert
+    for reading in alerts:
+        alert_tracker.open_incident(reading)
+    for reading in readings:
+        rule_index.process_reading(reading)
+
+    for index, reading in zip(positions, readings):
+        results[index] = {
+            'index': index,
+            'success': True,
+            'reading_id': reading.id,
+            'is_alert': reading.is_alert,
+        }
+
+    return results, alerts
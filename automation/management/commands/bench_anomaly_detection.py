@@ -0,0 +1,75 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from automation.anomaly import AnomalyDetector
+from automation.thresholds import DEFAULT_THRESHOLDS
+
+
+class Command(BaseCommand):
+    help = 'Benchmark per-reading cost and detection quality of the anomaly detector'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--devices', type=int, default=10000)
+        parser.add_argument('--rounds', type=int, default=100, help='Readings per device')
+        parser.add_argument('--drift-ratio', type=float, default=0.01,
+                            help='Fraction of devices with a slow gas build-up')
+
+    def handle(self, *args, **options):
+        devices = options['devices']
+        rounds = options['rounds']
+        rng = random.Random(11)
+        detector = AnomalyDetector(max_series=devices)
+        drifting = set(rng.sample(range(devices), int(devices * options['drift_ratio'])))
+        warmup = detector.warmup
+        threshold = DEFAULT_THRESHOLDS['gas']
+
+        baselines = [rng.uniform(5, 20) for _ in range(devices)]
+        noise = [rng.uniform(0.5, 2.0) for _ in range(devices)]
+        device_ids = [f'gas-{i:05d}' for i in range(devices)]
+
+        flagged_at = {}
+        false_positives = 0
+        threshold_hits = 0
+        elapsed = 0.0
+        started_at = time.time()
+
+        for step in range(rounds):
+            now = started_at + step * 10
+            values = []
+            for i in range(devices):
+                value = rng.gauss(baselines[i], noise[i])
+                if i in drifting and step > warmup:
+                    # Rises 0.4 units per reading: never reaches the fixed threshold in this run
+                    value += 0.4 * (step - warmup)
+                values.append(value)
+
+            tick = time.perf_counter()
+            flags = [detector.observe(device_ids[i], 'gas', values[i], now) for i in range(devices)]
+            elapsed += time.perf_counter() - tick
+
+            for i, flagged in enumerate(flags):
+                threshold_hits += values[i] > threshold and i in drifting
+                if not flagged:
+                    continue
+                if i in drifting and step > warmup:
+                    flagged_at.setdefault(i, step - warmup)
+                elif i not in drifting:
+                    false_positives += 1
+
+        readings = devices * rounds
+        normal_readings = (devices - len(drifting)) * max(rounds - warmup, 0)
+        stats = detector.stats()
+        self.stdout.write(f'🔎 {devices} devices x {rounds} readings')
+        self.stdout.write(f'   cost:    {elapsed / readings * 1e6:.2f} µs/reading ({readings / elapsed:,.0f} readings/s)')
+        self.stdout.write(f"   state:   {stats['state_bytes'] / devices:.0f} bytes/series in arrays")
+        if drifting:
+            delays = sorted(flagged_at.values())
+            self.stdout.write(
+                f'   drift:   {len(flagged_at)}/{len(drifting)} build-ups flagged'
+                + (f', median after {delays[len(delays) // 2]} readings' if delays else '')
+                + f'; fixed threshold caught {threshold_hits} readings'
+            )
+        rate = false_positives / normal_readings if normal_readings else 0.0
+        self.stdout.write(f'   noise:   {false_positives} false positives ({rate:.4%} of post-warmup readings)')
@@ -0,0 +1,130 @@
+import json
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+
+from automation.dispatch import latency_summary
+from automation.executor import DeviceAction, apply_device_actions
+from automation.models import DeviceStatus
+from automation.state_cache import DeviceStateCache
+from automation import views
+from core.models import Home
+from devices.models import Device
+
+PREFIX = 'bench-state-'
+
+
+def legacy_device_status():
+    """The uncached device_status_api: load, rebuild and render every row"""
+    device_data = [
+        {
+            'device_id': device.device_id,
+            'device_name': device.device_name,
+            'device_type': device.device_type,
+            'is_online': device.is_online,
+            'current_state': device.current_state,
+            'location': device.location,
+            'last_seen': device.last_seen,
+        }
+        for device in DeviceStatus.objects.all()
+    ]
+    return JSONRenderer().render({
+        'devices': device_data,
+        'total_devices': len(device_data),
+        'online_devices': sum(1 for d in device_data if d['is_online']),
+    })
+
+
+def timed(function, rounds):
+    latencies = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        function()
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latency_summary(latencies)
+
+
+class Command(BaseCommand):
+    help = 'Compare device_status_api latency with and without the write-through state cache, ETags and deltas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--devices', type=int, default=5000)
+        parser.add_argument('--homes', type=int, default=50)
+        parser.add_argument('--rounds', type=int, default=200)
+
+    def handle(self, *args, **options):
+        devices, rounds = options['devices'], options['rounds']
+        user, _ = User.objects.get_or_create(username=f'{PREFIX}user')
+        homes = [Home.objects.create(name=f'{PREFIX}{i}', address='-', owner=user) for i in range(options['homes'])]
+        registered = Device.objects.bulk_create([
+            Device(name=f'light {i}', device_type='light', home=homes[i % len(homes)], room=f'room {i % 7}')
+            for i in range(devices)
+        ])
+        DeviceStatus.objects.bulk_create([
+            DeviceStatus(
+                device_id=f'{PREFIX}{device.pk}', device_name=device.name, device_type='light',
+                is_online=True, location=device.room, registered_device=device,
+                current_state={'status': 'off', 'brightness': 80, 'color_temp': 4000},
+            )
+            for device in registered
+        ], batch_size=1000)
+
+        try:
+            self.run(homes, rounds)
+        finally:
+            DeviceStatus.objects.filter(device_id__startswith=PREFIX).delete()
+            Home.objects.filter(name__startswith=PREFIX).delete()
+            user.delete()
+
+    def run(self, homes, rounds):
+        from automation.state_cache import state_cache
+
+        total = DeviceStatus.objects.count()
+        factory = RequestFactory()
+        all_request = factory.get('/automation/api/device-status/')
+        home_request = factory.get('/automation/api/device-status/', {'home': homes[0].pk})
+        state_cache.invalidate()
+
+        self.stdout.write(f'📟 device_status_api over {total} devices in {len(homes)} homes, {rounds} requests each')
+        uncached = timed(legacy_device_status, max(rounds // 10, 5))
+        self.report('uncached, all devices', uncached)
+
+        cold = DeviceStateCache()
+        started = time.perf_counter()
+        cold.render()
+        self.stdout.write(f'   cache fill:              {(time.perf_counter() - started) * 1000:.1f} ms (once per process)')
+
+        views.device_status_api(all_request)
+        with CaptureQueriesContext(connection) as queries:
+            cached = timed(lambda: views.device_status_api(all_request), rounds)
+        self.report('cached, all devices', cached)
+        self.report('cached, one home', timed(lambda: views.device_status_api(home_request), rounds))
+        self.stdout.write(f'   queries while cached:    {len(queries.captured_queries)}')
+
+        # Polling an unchanged state: If-None-Match and an up-to-date cursor
+        response = views.device_status_api(all_request)
+        conditional_request = factory.get('/automation/api/device-status/', HTTP_IF_NONE_MATCH=response['ETag'])
+        delta_request = factory.get('/automation/api/device-status/', {'since': json.loads(response.content)['cursor']})
+        with CaptureQueriesContext(connection) as queries:
+            self.report('304, all devices', timed(lambda: views.device_status_api(conditional_request), rounds))
+            self.report('idle delta, all devices', timed(lambda: views.device_status_api(delta_request), rounds))
+        self.stdout.write(f'   queries while polling:   {len(queries.captured_queries)}')
+
+        # A write followed by a read: the executor patches the cache after commit
+        targets = list(DeviceStatus.objects.filter(registered_device__home=homes[0]).values_list('device_id', flat=True))
+
+        def write_then_read():
+            apply_device_actions([DeviceAction(device_id, 'toggle') for device_id in targets[:10]], broadcast=False)
+            views.device_status_api(home_request)
+
+        self.report('10-device write + read', timed(write_then_read, max(rounds // 4, 5)))
+        speedup = uncached['p50'] / cached['p50'] if cached['p50'] else float('inf')
+        self.stdout.write(self.style.SUCCESS(f'✅ Cached reads are {speedup:,.0f}x faster at p50'))
+
+    def report(self, label, summary):
+        self.stdout.write(f"   {label + ':':<25}p50 {summary['p50']:>8.3f} ms   p99 {summary['p99']:>8.3f} ms")
@@ -0,0 +1,70 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from automation.models import AutomationRule
+from automation.rules import RuleIndex, compile_rule, rule_matches
+
+SENSOR_TYPES = ['temperature', 'humidity', 'gas', 'smoke', 'motion', 'light']
+
+
+class Command(BaseCommand):
+    help = 'Show rule match latency stays flat as the number of active rules grows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100,1000,10000,100000', help='Comma-separated rule counts')
+        parser.add_argument('--rules-per-device', type=int, default=2,
+                            help='Device-specific rules per device (the home grows with the rule count)')
+        parser.add_argument('--wildcard-rules', type=int, default=20, help='Rules that apply to any device')
+        parser.add_argument('--events', type=int, default=20000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(5)
+        self.stdout.write(f"⚙️  {options['events']} readings per size, {options['rules_per_device']} rules per device")
+        self.stdout.write(f"   {'rules':>8} {'indexed µs':>11} {'naive µs':>10} {'candidates':>11} {'matches':>8}")
+
+        for size in [int(value) for value in options['sizes'].split(',')]:
+            devices = max(size // options['rules_per_device'], 1)
+            rules = [
+                self.make_rule(i, rng, None if i < options['wildcard_rules'] else f'dev-{rng.randrange(devices)}')
+                for i in range(size)
+            ]
+            events = [
+                (rng.choice(SENSOR_TYPES), f'dev-{rng.randrange(devices)}', rng.uniform(0, 100))
+                for _ in range(options['events'])
+            ]
+            index = RuleIndex()
+            index.rebuild(rules)
+            # Keep the benchmark off the shared version counter
+            index.check_interval = float('inf')
+
+            started = time.perf_counter()
+            matched = sum(len(index.match('sensor', kind, device, value)) for kind, device, value in events)
+            indexed = (time.perf_counter() - started) / len(events) * 1e6
+
+            # Naive baseline: evaluate every rule for every reading (on a sample at large sizes)
+            compiled = [compile_rule(rule) for rule in rules]
+            sample = events[:max(20, len(events) * 1000 // size)]
+            started = time.perf_counter()
+            for kind, device, value in sample:
+                [rule for rule in compiled
+                 if rule.key[1] in (kind, '*') and rule.key[2] in (device, '*') and rule_matches(rule, value)]
+            naive = (time.perf_counter() - started) / len(sample) * 1e6
+
+            candidates = index.counters['candidates'] / index.counters['events']
+            self.stdout.write(f'   {size:>8} {indexed:>11.2f} {naive:>10.1f} {candidates:>11.2f} {matched:>8}')
+
+    def make_rule(self, i, rng, device_id):
+        """Unsaved sensor rule for one device, or any device when ``device_id`` is None"""
+        conditions = {
+            'sensor_type': rng.choice(SENSOR_TYPES),
+            'operator': rng.choice(['>', '<']),
+            'value': rng.uniform(0, 100),
+        }
+        if device_id:
+            conditions['device_id'] = device_id
+        return AutomationRule(
+            id=i + 1, user_id=1, name=f'bench-{i}', trigger_type='sensor',
+            trigger_conditions=conditions, action_type='turn_on', target_device='bench', is_active=True,
+        )
@@ -0,0 +1,73 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from automation.dispatch import SafetyDispatcher, latency_summary
+from automation.models import AutomationLog
+from automation.views import trigger_safety_protocol
+
+
+class Command(BaseCommand):
+    help = 'Burst alerts through the safety dispatcher and report actuation latency per priority'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--alerts', type=int, default=3000, help='Alerts in the burst')
+        parser.add_argument('--locations', type=int, default=500, help='Distinct locations (fewer means more coalescing)')
+        parser.add_argument('--workers', type=int, default=4, help='Use 1 on SQLite, which serialises writers')
+        parser.add_argument('--max-queue', type=int, default=10000)
+        parser.add_argument('--keep-logs', action='store_true', help='Keep the AutomationLog rows the burst creates')
+
+    def handle(self, *args, **options):
+        rng = random.Random(7)
+        # (sensor_type, value, priority): critical gas/fire mixed into lower-priority work
+        kinds = [('gas', 90.0, 1), ('fire', 95.0, 1), ('smoke', 40.0, 3), ('smoke', 35.0, 5)]
+        alerts = [
+            (*rng.choice(kinds), f"bench-room-{rng.randrange(options['locations'])}")
+            for _ in range(options['alerts'])
+        ]
+        first_log_id = AutomationLog.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+        dispatcher = SafetyDispatcher(
+            workers=options['workers'], max_queue=options['max_queue'], enabled=True
+        )
+        self.stdout.write(
+            f"🚨 {len(alerts)} alerts over {options['locations']} locations, {options['workers']} workers"
+        )
+
+        started = time.monotonic()
+        for sensor_type, value, priority, location in alerts:
+            dispatcher.submit(sensor_type, value, location, started, priority=priority)
+        accepted_at = time.monotonic()
+        dispatcher.drain()
+        finished = time.monotonic()
+        dispatcher.stop()
+
+        stats = dispatcher.stats()
+        self.stdout.write(f'   submit: {(accepted_at - started) * 1000:.1f} ms for the whole burst')
+        self.stdout.write(f'   drain:  {(finished - started) * 1000:.1f} ms')
+        self.stdout.write(
+            f"   executed {stats['executed']}, coalesced {stats['coalesced']}, "
+            f"dropped {stats['dropped']}, failed {stats['failed']}"
+        )
+        for priority, summary in stats['latency_ms_by_priority'].items():
+            self.stdout.write(
+                f"   priority {priority}: p50 {summary['p50']} ms  p99 {summary['p99']} ms  ({summary['count']} runs)"
+            )
+
+        # Inline baseline: every alert actuated in the request, one after another
+        inline = []
+        sample = alerts[:min(len(alerts), 200)]
+        inline_started = time.monotonic()
+        for sensor_type, value, priority, location in sample:
+            trigger_safety_protocol(sensor_type, value, location)
+            inline.append((time.monotonic() - inline_started) * 1000)
+        summary = latency_summary(inline)
+        self.stdout.write(
+            f"   inline ({len(sample)} alerts): p50 {summary['p50']} ms  p99 {summary['p99']} ms"
+        )
+
+        if not options['keep_logs']:
+            deleted, _ = AutomationLog.objects.filter(id__gt=first_log_id, log_type='safety_activated').delete()
+            self.stdout.write(f'   removed {deleted} benchmark log rows')
+
@@ -0,0 +1,65 @@
+import random
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from automation.models import AutomationRule
+from automation.scheduler import Scheduler
+
+
+class Command(BaseCommand):
+    help = 'Schedule many interval rules in memory and measure firing lag and wake-ups'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rules', type=int, default=100000)
+        parser.add_argument('--seconds', type=float, default=10.0, help='How long to run the scheduler')
+        parser.add_argument('--min-interval', type=float, default=2.0)
+        parser.add_argument('--max-interval', type=float, default=30.0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(9)
+        rules = [
+            AutomationRule(
+                id=i + 1, user_id=1, name=f'bench-{i}', trigger_type='time',
+                trigger_conditions={'interval': round(rng.uniform(options['min_interval'], options['max_interval']), 3)},
+                action_type='turn_on', target_device='bench', is_active=True,
+            )
+            for i in range(options['rules'])
+        ]
+        fired = []
+        scheduler = Scheduler(action=lambda rule, scheduled_at: fired.append(rule.id), workers=2)
+
+        started = time.perf_counter()
+        now = timezone.now()
+        for rule in rules:
+            scheduler.schedule(rule, now=now)
+        elapsed = time.perf_counter() - started
+
+        # Memory per rule, measured on a sample so tracing doesn't skew the timing above
+        sample = rules[:10000]
+        tracemalloc.start()
+        probe = Scheduler(action=None, workers=1)
+        for rule in sample:
+            probe.schedule(rule, now=now)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        probe.pool.shutdown()
+        self.stdout.write(f"⏰ Scheduled {len(rules)} rules in {elapsed:.2f}s ({memory / len(sample):.0f} bytes/rule)")
+
+        thread = threading.Thread(target=scheduler.run, kwargs={'load': False})
+        thread.start()
+        time.sleep(options['seconds'])
+        scheduler.stop()
+        thread.join()
+
+        stats = scheduler.stats()
+        lag = np.array(scheduler.lag) * 1000
+        self.stdout.write(f"   ran {options['seconds']:.0f}s: fired {len(fired)}, wake-ups {stats['wakeups']}"
+                          f" ({len(fired) / max(stats['wakeups'], 1):.1f} fires per wake-up)")
+        if len(lag):
+            p50, p99 = np.percentile(lag, [50, 99])
+            self.stdout.write(f'   lag: p50 {p50:.2f} ms  p99 {p99:.2f} ms  max {lag.max():.2f} ms (last 10k fires)')
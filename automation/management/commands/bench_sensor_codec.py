@@ -0,0 +1,68 @@
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from automation.ingest import parse_batch, validate_reading
+from automation.wire import SENSOR_CODES, decode_readings, encode_readings
+
+
+class Command(BaseCommand):
+    help = 'Compare payload bytes and decode cost per reading: JSON webhook vs binary format'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readings', type=int, default=100000)
+        parser.add_argument('--batch-size', type=int, default=100, help='Readings per binary/NDJSON payload')
+
+    def handle(self, *args, **options):
+        count = options['readings']
+        batch_size = options['batch_size']
+        rng = random.Random(3)
+        now = int(time.time())
+        readings = [
+            {
+                'device_id': f'esp32-{i % 64:04d}',
+                'sensor_type': SENSOR_CODES[rng.randint(1, len(SENSOR_CODES))],
+                'value': round(rng.uniform(0, 100), 2),
+                'timestamp': now - i,
+            }
+            for i in range(count)
+        ]
+        batches = [readings[i:i + batch_size] for i in range(0, count, batch_size)]
+
+        single_json = [json.dumps(reading).encode() for reading in readings]
+        ndjson = [b'\n'.join(json.dumps(r).encode() for r in batch) for batch in batches]
+        binary = [encode_readings(batch) for batch in batches]
+
+        def decode_single_json():
+            for body in single_json:
+                validate_reading(json.loads(body))
+
+        def decode_ndjson():
+            for body in ndjson:
+                for item in parse_batch(body, 'application/x-ndjson'):
+                    validate_reading(item)
+
+        def decode_binary():
+            for body in binary:
+                for item in decode_readings(body):
+                    validate_reading(item)
+
+        self.stdout.write(f'📦 {count} readings, {batch_size} per batch payload')
+        self.stdout.write(f"   {'format':<20} {'bytes/reading':>14} {'decode µs/reading':>18}")
+        baseline = None
+        for label, payloads, func in [
+            ('json (per request)', single_json, decode_single_json),
+            ('ndjson batch', ndjson, decode_ndjson),
+            ('binary batch', binary, decode_binary),
+        ]:
+            size = sum(len(payload) for payload in payloads) / count
+            started = time.perf_counter()
+            func()
+            micros = (time.perf_counter() - started) / count * 1e6
+            baseline = baseline or (size, micros)
+            self.stdout.write(
+                f'   {label:<20} {size:>14.1f} {micros:>18.2f}'
+                f'   ({baseline[0] / size:.1f}x smaller, {baseline[1] / micros:.1f}x faster)'
+            )
@@ -0,0 +1,95 @@
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory
+
+from automation.ingest import sensor_buffer
+from automation.views import sensor_data_batch, sensor_data_webhook
+
+
+class Command(BaseCommand):
+    help = 'Benchmark single-item vs batch sensor ingestion (readings per second)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readings', type=int, default=2000, help='Readings per run')
+        parser.add_argument('--batch-size', type=int, default=500, help='Readings per batch request')
+        parser.add_argument('--alert-ratio', type=float, default=0.0, help='Fraction of readings above alert thresholds')
+
+    def handle(self, *args, **options):
+        readings = self.make_readings(options['readings'], options['alert_ratio'])
+        batch_size = options['batch_size']
+        factory = APIRequestFactory()
+
+        self.stdout.write(f"📊 Ingesting {len(readings)} readings (batch size {batch_size})")
+
+        def run_single():
+            with override_settings(WRITE_BUFFER_SETTINGS={'ENABLED': False}):
+                for reading in readings:
+                    request = factory.post('/automation/api/sensor-data/', reading, format='json')
+                    sensor_data_webhook(request)
+
+        def run_single_buffered():
+            # Keep the background flusher idle so every flush happens inside
+            # the benchmark transaction on this thread
+            sensor_buffer.max_batch = sensor_buffer.max_pending = len(readings) + 1
+            sensor_buffer.flush_interval = 3600
+            with override_settings(WRITE_BUFFER_SETTINGS={'ENABLED': True}):
+                for reading in readings:
+                    request = factory.post('/automation/api/sensor-data/', reading, format='json')
+                    sensor_data_webhook(request)
+                    if len(sensor_buffer._pending) >= batch_size:
+                        sensor_buffer.flush()
+                sensor_buffer.flush()
+
+        def run_ndjson():
+            for start in range(0, len(readings), batch_size):
+                chunk = readings[start:start + batch_size]
+                body = '\n'.join(json.dumps(reading) for reading in chunk)
+                request = factory.post('/automation/api/sensor-data/batch/', body,
+                                       content_type='application/x-ndjson')
+                sensor_data_batch(request)
+
+        def run_json_array():
+            for start in range(0, len(readings), batch_size):
+                chunk = readings[start:start + batch_size]
+                request = factory.post('/automation/api/sensor-data/batch/', chunk, format='json')
+                sensor_data_batch(request)
+
+        single_rate = self.measure('single', run_single, len(readings))
+        for label, func in [('single buffered', run_single_buffered),
+                            ('ndjson batch', run_ndjson),
+                            ('json array batch', run_json_array)]:
+            rate = self.measure(label, func, len(readings))
+            self.stdout.write(self.style.SUCCESS(f'   speedup vs single: {rate / single_rate:.1f}x'))
+
+    def make_readings(self, count, alert_ratio):
+        """Generate synthetic gateway readings"""
+        rng = random.Random(42)
+        readings = []
+        for i in range(count):
+            sensor_type = rng.choice(['gas', 'temperature', 'humidity', 'smoke'])
+            alert = rng.random() < alert_ratio
+            readings.append({
+                'device_id': f'bench-{i % 50}',
+                'sensor_type': sensor_type,
+                'value': 99.0 if alert else round(rng.uniform(0, 25), 2),
+                'unit': 'ppm',
+                'location': 'bench',
+            })
+        return readings
+
+    def measure(self, label, func, count):
+        """Time one ingestion strategy inside a rolled-back transaction"""
+        with transaction.atomic():
+            started = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - started
+            transaction.set_rollback(True)
+
+        rate = count / elapsed if elapsed else float('inf')
+        self.stdout.write(f'   {label:<18} {elapsed:8.3f}s  {rate:10.0f} readings/s')
+        return rate
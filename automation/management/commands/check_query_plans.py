@@ -0,0 +1,90 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from automation.models import AutomationLog, SensorReading, SensorRollup
+from core.retention import get_policies
+from energy.models import EnergyReading
+
+
+def hot_queries():
+    """Dashboard queries from automation.views and energy.views with the index each must use"""
+    now = timezone.now()
+    return [
+        ('automation_dashboard: recent logs per user',
+         AutomationLog.objects.filter(user_id=1)[:10], 'autolog_user_ts_idx'),
+        ('automation_dashboard: recent sensor readings',
+         SensorReading.objects.all()[:10], 'sensor_ts_idx'),
+        ('safety_monitoring: recent alerts',
+         SensorReading.objects.filter(is_alert=True)[:10], 'sensor_alert_ts_idx'),
+        ('safety_monitoring: latest gas readings',
+         SensorReading.objects.filter(sensor_type='gas')[:5], 'sensor_type_ts_idx'),
+        ('device history: latest readings per device',
+         SensorReading.objects.filter(device_id='device-1')[:10], 'sensor_device_ts_idx'),
+        ('device history: automation log per device',
+         AutomationLog.objects.filter(device_id='device-1')[:10], 'autolog_device_ts_idx'),
+        ('energy_dashboard / energy_stats: recent readings per user',
+         EnergyReading.objects.filter(user_id=1)[:24], 'energy_user_ts_idx'),
+        ('energy: latest readings per device',
+         EnergyReading.objects.filter(device_id='meter-1')[:24], 'energy_device_ts_idx'),
+        ('sensor_series: rollup range scan',
+         SensorRollup.objects.filter(sensor_type='gas', resolution='1h',
+                                     bucket_start__gte=now - timedelta(days=1)),
+         'rollup_type_res_bucket_idx'),
+    ]
+
+
+RETENTION_INDEXES = {
+    'automation.SensorReading': 'sensor_ts_idx',
+    'automation.SensorRollup': 'rollup_res_bucket_idx',
+    'automation.AutomationLog': 'autolog_ts_idx',
+    'energy.EnergyReading': 'energy_ts_idx',
+    'devices.DeviceLog': 'devicelog_ts_idx',
+    'automation.DeviceStateEvent': 'stateevent_ts_idx',
+    'automation.DeviceStateSnapshot': 'statesnap_ts_idx',
+}
+
+
+def retention_queries():
+    """Chunk-selection queries of the retention policies"""
+    queries = []
+    for policy in get_policies():
+        index_name = RETENTION_INDEXES.get(policy.model._meta.label)
+        if index_name:
+            queries.append((f'retention: {policy.label}',
+                            policy.expired().values_list('pk', flat=True)[:1000], index_name))
+    return queries
+
+
+class Command(BaseCommand):
+    help = 'Check that hot dashboard queries use their designed indexes (query-plan regression check)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true', help='Print every query plan')
+
+    def handle(self, *args, **options):
+        failures = []
+
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                # Small tables make seq scans look cheap; ask the planner what it would
+                # do at production sizes instead
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+
+            for label, queryset, index_name in hot_queries() + retention_queries():
+                plan = queryset.explain()
+                if options['verbose_plans']:
+                    self.stdout.write(f'\n{label}\n{plan}')
+                if index_name in plan:
+                    self.stdout.write(self.style.SUCCESS(f'✅ {label} -> {index_name}'))
+                else:
+                    self.stdout.write(self.style.ERROR(f'❌ {label} does not use {index_name}'))
+                    failures.append((label, plan))
+
+        if failures:
+            details = '\n\n'.join(f'{label}:\n{plan}' for label, plan in failures)
+            raise CommandError(f'{len(failures)} hot queries lost their index:\n\n{details}')
+        self.stdout.write(self.style.SUCCESS('\n🎯 All hot queries use their indexes'))
@@ -0,0 +1,46 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from automation import rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute sensor rollups from raw readings (backfill or periodic compaction)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='ISO start time (default: 1 day ago)')
+        parser.add_argument('--until', help='ISO end time (default: now)')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        end = self.parse(options['until']) or timezone.now()
+        start = self.parse(options['since']) or end - timedelta(days=1)
+        if start >= end:
+            raise CommandError('--since must be before --until')
+
+        self.stdout.write(f'🔄 Rebuilding rollups for {start:%Y-%m-%d} .. {end:%Y-%m-%d}')
+        started = time.perf_counter()
+        processed, rebuilt_start, rebuilt_end = rollups.rebuild(start, end, chunk_size=options['chunk_size'])
+        elapsed = time.perf_counter() - started
+        if rebuilt_start > rollups.bucket_start(start, '1d'):
+            self.stdout.write(self.style.WARNING(
+                f'⚠️  Raw readings before {rebuilt_start:%Y-%m-%d} are past retention; those rollups were kept'
+            ))
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ Rolled up {processed} readings in {elapsed:.2f}s'
+            + (f' ({rebuilt_start:%Y-%m-%d} .. {rebuilt_end:%Y-%m-%d})' if rebuilt_end > rebuilt_start else '')
+        ))
+
+    def parse(self, value):
+        if not value:
+            return None
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise CommandError(f'Invalid datetime: {value}')
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
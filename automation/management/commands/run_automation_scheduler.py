@@ -0,0 +1,35 @@
+import signal
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from automation.scheduler import Scheduler
+
+
+class Command(BaseCommand):
+    help = 'Run the scheduler that fires time-triggered automation rules'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, help='Threads executing fired rules')
+        parser.add_argument('--stats-interval', type=float, default=60, help='Seconds between status lines; 0 disables')
+
+    def handle(self, *args, **options):
+        scheduler = Scheduler(workers=options['workers'])
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: scheduler.stop())
+
+        thread = threading.Thread(target=scheduler.run, name='automation-scheduler', daemon=True)
+        thread.start()
+        self.stdout.write('⏰ Automation scheduler running (Ctrl+C to stop)')
+
+        interval = options['stats_interval']
+        while thread.is_alive():
+            thread.join(timeout=interval or None)
+            if interval and thread.is_alive():
+                stats = scheduler.stats()
+                self.stdout.write(
+                    f"   {time.strftime('%H:%M:%S')} scheduled {stats['scheduled']}, fired {stats['fired']}, "
+                    f"failed {stats['failed']}, wake-ups {stats['wakeups']}"
+                )
+        self.stdout.write(self.style.SUCCESS('✅ Scheduler stopped'))
@@ -0,0 +1,222 @@
+import heapq
+import random
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+
+from automation.command_queue import CommandQueue
+from automation.executor import next_state
+from automation.models import AutomationLog, DeviceCommand, DeviceStateEvent, DeviceStateSnapshot, DeviceStatus
+
+PREFIX = 'sim-cmd-'
+
+INITIAL_STATE = {'status': 'off', 'brightness': 50}
+
+
+class SimulatedDevice:
+    """Applies each command sequence number once and acknowledges every delivery with its state"""
+
+    def __init__(self, device_id, online):
+        self.device_id = device_id
+        self.online = online
+        self.state = dict(INITIAL_STATE)
+        self.applied = set()
+        self.out_of_order = 0   # Commands applied after a newer one
+
+    def receive(self, command):
+        if command['seq'] not in self.applied:
+            if self.applied and command['seq'] < max(self.applied):
+                self.out_of_order += 1
+            self.applied.add(command['seq'])
+            self.state = next_state(self.state, command['action'], command['parameters'])
+        return dict(self.state)
+
+
+class SimulatedNetwork:
+    """Delivers commands to simulated devices with latency and loss in both directions"""
+
+    def __init__(self, devices, loss, latency_ms, seed):
+        self.devices = devices
+        self.loss = loss
+        self.latency = latency_ms / 1000
+        self.rng = random.Random(seed)
+        self.queue = None
+        self._events = []
+        self._order = 0
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='simulated-devices', daemon=True)
+        self._thread.start()
+
+    def deliver(self, commands, reply_to):
+        now = time.monotonic()
+        with self._condition:
+            for command in commands:
+                device = self.devices[command.device_id]
+                if not device.online or self.rng.random() < self.loss:
+                    continue   # Command lost on the way
+                self._order += 1
+                delay = self.rng.expovariate(1 / self.latency) if self.latency else 0
+                heapq.heappush(self._events, (now + delay, self._order, device, command.message()))
+            self._condition.notify()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped and (not self._events or self._events[0][0] > time.monotonic()):
+                    timeout = self._events[0][0] - time.monotonic() if self._events else None
+                    self._condition.wait(timeout)
+                if self._stopped:
+                    return
+                _, _, device, command = heapq.heappop(self._events)
+                lost = self.rng.random() < self.loss
+            state = device.receive(command)
+            if not lost:
+                self.queue.ack(device.device_id, command['seq'], True, state)
+
+
+class Command(BaseCommand):
+    help = ('Drive the device command queue against simulated devices over a lossy network and check that '
+            'every acknowledged command reached DeviceStatus; reports throughput and ack latency')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--devices', type=int, default=200)
+        parser.add_argument('--commands', type=int, default=2000)
+        parser.add_argument('--loss', type=float, default=0.1, help='Chance a command or its ack is lost')
+        parser.add_argument('--offline', type=float, default=0.02, help='Share of devices that never answer')
+        parser.add_argument('--latency-ms', type=float, default=20.0, help='Mean device response time')
+        parser.add_argument('--ack-timeout', type=float, default=0.2)
+        parser.add_argument('--max-attempts', type=int, default=5)
+        parser.add_argument('--spill-after', type=float, default=0.5)
+        parser.add_argument('--crash', action='store_true',
+                            help='Stop the queue halfway and let a new one adopt its commands from the database')
+        parser.add_argument('--seed', type=int, default=7)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        devices = {
+            f'{PREFIX}{i}': SimulatedDevice(f'{PREFIX}{i}', rng.random() >= options['offline'])
+            for i in range(options['devices'])
+        }
+        DeviceStatus.objects.bulk_create([
+            DeviceStatus(device_id=device_id, device_name=device_id, device_type='light', is_online=True,
+                         current_state=dict(INITIAL_STATE))
+            for device_id in devices
+        ])
+        network = SimulatedNetwork(devices, options['loss'], options['latency_ms'], options['seed'])
+        try:
+            self.run(devices, network, rng, options)
+        finally:
+            network.stop()
+            self.cleanup(devices)
+
+    def make_queue(self, network, options):
+        queue = CommandQueue(
+            deliver=network.deliver,
+            ack_timeout=options['ack_timeout'],
+            max_attempts=options['max_attempts'],
+            backoff_base=options['ack_timeout'] / 2,
+            spill_after=options['spill_after'],
+            lease=options['spill_after'] * 3,
+        )
+        network.queue = queue
+        return queue
+
+    def run(self, devices, network, rng, options):
+        device_ids = list(devices)
+        offline = sum(1 for device in devices.values() if not device.online)
+        self.stdout.write(
+            f"📡 {options['commands']} commands to {len(devices)} simulated devices ({offline} offline), "
+            f"{options['loss']:.0%} loss each way, ~{options['latency_ms']:.0f} ms device latency"
+        )
+
+        queue = self.make_queue(network, options)
+        first_seq = None
+        started = time.monotonic()
+        for index in range(options['commands']):
+            if options['crash'] and index == options['commands'] // 2:
+                # Unfinished commands go to the database leased to nobody; the new queue adopts them
+                before = queue.stats()
+                queue.stop()
+                self.stdout.write(f"   💥 queue stopped with {before['in_memory']} commands held; restarting")
+                queue = self.make_queue(network, options)
+            action = rng.choice(['turn_on', 'turn_off', 'toggle', 'set_value'])
+            parameters = {'brightness': rng.randrange(101)} if action == 'set_value' else {}
+            seq = queue.submit(rng.choice(device_ids), action, parameters)
+            first_seq = first_seq or seq
+        submitted = time.monotonic()
+
+        timeout = options['ack_timeout'] * options['max_attempts'] * 20 + 30
+        if not queue.drain(timeout=timeout):
+            raise CommandError(f'Commands still pending after {timeout:.0f}s: {queue.stats()}')
+        finished = time.monotonic()
+        stats = queue.stats()
+        queue.stop()
+
+        elapsed = finished - started
+        self.stdout.write(f"   submit:   {options['commands'] / (submitted - started):,.0f} commands/s")
+        self.stdout.write(f"   complete: {options['commands'] / elapsed:,.0f} commands/s end to end ({elapsed:.2f} s)")
+        latency = stats['ack_latency_ms']
+        self.stdout.write(f"   ack latency: p50 {latency['p50']} ms  p99 {latency['p99']} ms  max {latency['max']} ms")
+        self.stdout.write(
+            f"   sent {stats['sent']}, resent {stats['resent']}, acked {stats['acked']}, "
+            f"timed out {stats['timed_out']}, duplicate acks {stats['duplicate_acks']}, "
+            f"spilled {stats['spilled']}, adopted {stats['adopted']}"
+        )
+
+        commands = DeviceCommand.objects.filter(device_id__startswith=PREFIX, seq__gte=first_seq)
+        outcomes = dict(commands.values_list('status').annotate(count=Count('id')))
+        self.stdout.write(f'   outcomes: {outcomes}')
+        # Every round trip lost: the device may have applied it, so its DeviceStatus is not comparable
+        unknown = set(commands.filter(status='failed').values_list('device_id', flat=True)) - {
+            device_id for device_id, device in devices.items() if not device.online
+        }
+        if unknown:
+            self.stdout.write(f'   {len(unknown)} online devices had a command fail on every attempt; not compared')
+        self.verify(devices, outcomes, unknown, options)
+
+    def verify(self, devices, outcomes, unknown, options):
+        problems = []
+        if sum(outcomes.values()) != options['commands']:
+            problems.append(f"{sum(outcomes.values())} commands recorded, expected {options['commands']}")
+        if outcomes.get('queued') or outcomes.get('sent'):
+            problems.append('commands left pending')
+        stored = dict(DeviceStatus.objects.filter(device_id__startswith=PREFIX).values_list('device_id', 'current_state'))
+        mismatched = [
+            device_id for device_id, device in devices.items()
+            if device.online and device_id not in unknown and stored[device_id] != device.state
+        ]
+        if mismatched:
+            problems.append(f'{len(mismatched)} online devices differ from DeviceStatus, e.g. {mismatched[:3]}')
+        # A late copy of a command that already failed may still arrive after newer ones
+        reordered = [
+            device_id for device_id, device in devices.items() if device_id not in unknown and device.out_of_order
+        ]
+        if reordered:
+            problems.append(f'{len(reordered)} devices applied commands out of order, e.g. {reordered[:3]}')
+        untouched = [
+            device_id for device_id, device in devices.items()
+            if not device.online and stored[device_id] != INITIAL_STATE
+        ]
+        if untouched:
+            problems.append(f'{len(untouched)} offline devices changed without acknowledging anything')
+        if problems:
+            raise CommandError('; '.join(problems))
+        self.stdout.write(self.style.SUCCESS(
+            '✅ Every command finished in order; DeviceStatus matches what each online device applied'
+        ))
+
+    def cleanup(self, devices):
+        DeviceCommand.objects.filter(device_id__startswith=PREFIX).delete()
+        AutomationLog.objects.filter(device_id__startswith=PREFIX).delete()
+        DeviceStateEvent.objects.filter(device_id__startswith=PREFIX).delete()
+        DeviceStateSnapshot.objects.filter(device_id__startswith=PREFIX).delete()
+        DeviceStatus.objects.filter(device_id__startswith=PREFIX).delete()
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from automation.heartbeat import HeartbeatTracker
+
+
+class Command(BaseCommand):
+    help = ('Mark devices without a recent heartbeat as offline. Web processes sweep while they receive '
+            'heartbeats; run this from cron so devices still go offline when none arrive at all')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--offline-after', type=int, help='Seconds without a heartbeat (default: HEARTBEAT_SETTINGS)')
+
+    def handle(self, *args, **options):
+        tracker = HeartbeatTracker(offline_after=options['offline_after'])
+        count = tracker.sweep()
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ {count} devices marked offline (silent for more than {tracker.offline_after}s)'
+        ))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from automation.models import DeviceStatus
+from automation.state_log import state_at
+
+
+class Command(BaseCommand):
+    help = 'Rebuild each device\'s current state from the state log and compare it with DeviceStatus'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--device-id', help='Check one device (default: every device with logged state)')
+
+    def handle(self, *args, **options):
+        devices = DeviceStatus.objects.filter(state_version__gt=0)
+        if options['device_id']:
+            devices = devices.filter(device_id=options['device_id'])
+
+        checked = replayed = 0
+        mismatched = []
+        for device_id, current_state, is_online, version in devices.values_list(
+            'device_id', 'current_state', 'is_online', 'state_version'
+        ).iterator():
+            rebuilt = state_at(device_id)
+            checked += 1
+            replayed += rebuilt['replayed_events'] if rebuilt else 0
+            if rebuilt is None or (rebuilt['state'], rebuilt['is_online'], rebuilt['version']) != (
+                current_state, is_online, version
+            ):
+                mismatched.append(device_id)
+                self.stdout.write(self.style.ERROR(f'❌ {device_id}: log {rebuilt} != stored v{version} {current_state}'))
+
+        average = replayed / checked if checked else 0
+        self.stdout.write(f'📜 {checked} devices rebuilt, {average:.1f} events replayed per device on average')
+        if mismatched:
+            raise CommandError(f'{len(mismatched)} devices differ from their state log')
+        self.stdout.write(self.style.SUCCESS('✅ Every device matches its state log'))
@@ -1,5 +1,7 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
+from django.utils import timezone
+from core.sequences import next_value
 import json
 
 class AutomationRule(models.Model):
@@ -56,11 +58,20 @@ class SensorReading(models.Model):
     value = models.FloatField()
     unit = models.CharField(max_length=20, default='')
     location = models.CharField(max_length=100, blank=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the reading is received, not when a buffered insert is flushed
+    timestamp = models.DateTimeField(default=timezone.now)
     is_alert = models.BooleanField(default=False)
     
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['-timestamp'], name='sensor_ts_idx'),
+            models.Index(fields=['device_id', '-timestamp'], name='sensor_device_ts_idx'),
+            models.Index(fields=['sensor_type', '-timestamp'], name='sensor_type_ts_idx'),
+            # Alerts are a tiny fraction of rows, so index only those
+            models.Index(fields=['-timestamp'], name='sensor_alert_ts_idx',
+                         condition=models.Q(is_alert=True)),
+        ]
     
     def __str__(self):
         return f"{self.sensor_type} reading: {self.value} {self.unit}"
@@ -148,10 +159,18 @@ class AutomationLog(models.Model):
     
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['-timestamp'], name='autolog_ts_idx'),
+            models.Index(fields=['user', '-timestamp'], name='autolog_user_ts_idx'),
+            models.Index(fields=['device_id', '-timestamp'], name='autolog_device_ts_idx'),
+        ]
     
     def __str__(self):
         return f"{self.log_type}: {self.description[:50]}"
 
+# core.sequences counter advanced by every device state change
+DEVICE_CHANGE_SEQUENCE = 'device_changes'
+
 class DeviceStatus(models.Model):
     """Current status of smart home devices"""
     device_id = models.CharField(max_length=100, unique=True)
@@ -160,8 +179,260 @@ class DeviceStatus(models.Model):
     is_online = models.BooleanField(default=False)
     current_state = models.JSONField(default=dict, help_text="Current device state/settings")
     location = models.CharField(max_length=100, blank=True)
-    last_seen = models.DateTimeField(auto_now=True)
+    last_seen = models.DateTimeField(default=timezone.now, help_text="Last heartbeat, written by automation/heartbeat.py")
     firmware_version = models.CharField(max_length=50, blank=True)
+    registered_device = models.OneToOneField(
+        'devices.Device', on_delete=models.SET_NULL, null=True, blank=True, related_name='live_status',
+        help_text="Registered home device this status belongs to, if any"
+    )
+    change_seq = models.BigIntegerField(
+        default=0, help_text="Global change sequence at the device's last state change (polling cursor)"
+    )
+    state_version = models.PositiveIntegerField(
+        default=0, help_text="Number of DeviceStateEvents recorded for the device (see automation/state_log.py)"
+    )
+    
+    class Meta:
+        indexes = [
+            # Offline sweep: online devices whose last heartbeat is too old
+            models.Index(fields=['last_seen'], condition=models.Q(is_online=True), name='devstatus_online_seen_idx'),
+            # Delta polling: devices changed after a cursor
+            models.Index(fields=['change_seq'], name='devstatus_change_seq_idx'),
+        ]
     
     def __str__(self):
         return f"{self.device_name} ({self.device_id})"
+    
+    def save(self, *args, **kwargs):
+        # Single-row saves advance the change sequence and log state changes like bulk writers do
+        from .state_log import is_first_change, logged_versions, record_changes, state_change
+        
+        update_fields = kwargs.get('update_fields')
+        written = lambda name: update_fields is None or name in update_fields
+        with transaction.atomic():
+            previous = None
+            if self.pk is not None:
+                previous = DeviceStatus.objects.select_for_update().filter(pk=self.pk).values(
+                    'current_state', 'is_online', 'state_version'
+                ).first()
+            stored = (previous['current_state'], previous['is_online']) if previous else ({}, None)
+            after = (
+                self.current_state if written('current_state') else stored[0],
+                self.is_online if written('is_online') else stored[1],
+            )
+            if is_first_change(previous):
+                # Continue after events left by an earlier DeviceStatus with this device_id
+                base = logged_versions([self.device_id]).get(self.device_id, 0)
+                change = state_change(self.device_id, base + 1, 'save', None, after)
+            else:
+                base = previous['state_version']
+                change = state_change(self.device_id, base + 1, 'save', stored, after)
+            self.state_version = base + 1 if change is not None else base
+            self.change_seq = next_value(DEVICE_CHANGE_SEQUENCE)
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'change_seq', 'state_version'}
+            super().save(*args, **kwargs)
+            if change is not None:
+                record_changes([change], self.change_seq)
+
+
+class DeviceStateEvent(models.Model):
+    """One change to a device's state, appended by every DeviceStatus writer"""
+    device_id = models.CharField(max_length=100)
+    version = models.PositiveIntegerField(help_text="Per-device event number, from 1")
+    change_seq = models.BigIntegerField(help_text="DeviceStatus.change_seq of the write")
+    action = models.CharField(max_length=50)
+    changes = models.JSONField(
+        help_text='{"state": {set keys}, "removed": [keys], "is_online": bool, "reset": true on a first event}'
+    )
+    timestamp = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['device_id', 'version']
+        indexes = [
+            models.Index(fields=['device_id', 'timestamp'], name='stateevent_device_ts_idx'),
+            # Retention
+            models.Index(fields=['timestamp'], name='stateevent_ts_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['device_id', 'version'], name='unique_state_event_version'),
+        ]
+    
+    def __str__(self):
+        return f"{self.device_id} v{self.version}: {self.action}"
+
+
+class DeviceStateSnapshot(models.Model):
+    """Full device state as of an event, written every SNAPSHOT_EVERY events"""
+    device_id = models.CharField(max_length=100)
+    version = models.PositiveIntegerField(help_text="Last event folded into this snapshot")
+    state = models.JSONField()
+    is_online = models.BooleanField()
+    timestamp = models.DateTimeField(help_text="Timestamp of that event")
+    
+    class Meta:
+        ordering = ['device_id', 'version']
+        indexes = [
+            models.Index(fields=['device_id', 'timestamp'], name='statesnap_device_ts_idx'),
+            # Retention
+            models.Index(fields=['timestamp'], name='statesnap_ts_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['device_id', 'version'], name='unique_state_snapshot_version'),
+        ]
+    
+    def __str__(self):
+        return f"{self.device_id} snapshot at v{self.version}"
+
+
+class DeviceCommand(models.Model):
+    """A device command written by the command queue (see automation/command_queue.py).
+
+    Rows are written for commands unacknowledged past SPILL_AFTER or beyond
+    a process's in-memory capacity, which stay pending under the ``owner``
+    process's lease, and for every finished command.
+    """
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('sent', 'Sent, awaiting acknowledgement'),
+        ('acked', 'Acknowledged'),
+        ('failed', 'Failed'),
+    ]
+    
+    seq = models.BigIntegerField(unique=True)
+    device_id = models.CharField(max_length=100)
+    action = models.CharField(max_length=20)
+    parameters = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    result = models.JSONField(null=True, blank=True, help_text="State the device reported with its acknowledgement")
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    owner = models.CharField(max_length=64, blank=True, help_text="Process holding a pending command")
+    lease_until = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            # Adoption of pending commands whose lease ran out
+            models.Index(fields=['status', 'lease_until'], name='devcommand_status_lease_idx'),
+            models.Index(fields=['device_id', '-created_at'], name='devcommand_device_ts_idx'),
+            # Per-device ordering: a device's pending commands, oldest first
+            models.Index(fields=['device_id', 'seq'], condition=models.Q(status__in=['queued', 'sent']),
+                         name='devcommand_device_pending_idx'),
+        ]
+    
+    def __str__(self):
+        return f"#{self.seq} {self.action} -> {self.device_id} ({self.status})"
+
+
+class SensorRollup(models.Model):
+    """Pre-aggregated sensor readings per device, sensor type and time bucket"""
+    RESOLUTIONS = [
+        ('1m', '1 Minute'),
+        ('1h', '1 Hour'),
+        ('1d', '1 Day'),
+    ]
+    
+    device_id = models.CharField(max_length=100)
+    sensor_type = models.CharField(max_length=20, choices=SensorReading.SENSOR_TYPES)
+    resolution = models.CharField(max_length=2, choices=RESOLUTIONS)
+    bucket_start = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+    min_value = models.FloatField()
+    max_value = models.FloatField()
+    sum_value = models.FloatField(default=0.0)
+    last_value = models.FloatField()
+    last_timestamp = models.DateTimeField()
+    
+    class Meta:
+        ordering = ['bucket_start']
+        indexes = [
+            models.Index(fields=['sensor_type', 'resolution', 'bucket_start'], name='rollup_type_res_bucket_idx'),
+            models.Index(fields=['resolution', 'bucket_start'], name='rollup_res_bucket_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['device_id', 'sensor_type', 'resolution', 'bucket_start'],
+                name='unique_sensor_rollup_bucket',
+            ),
+        ]
+    
+    @property
+    def avg_value(self):
+        """Mean value over the bucket"""
+        return self.sum_value / self.count if self.count else None
+    
+    def __str__(self):
+        return f"{self.sensor_type} {self.resolution} rollup for {self.device_id} at {self.bucket_start}"
+
+
+class AlertIncident(models.Model):
+    """One sustained alert condition on a device sensor.
+
+    Repeated over-threshold readings while the incident is open are counted
+    here instead of raising a new alert each (see automation/alert_state.py).
+    """
+    STATUSES = [
+        ('firing', 'Firing'),
+        ('cooldown', 'Cooling Down'),
+        ('resolved', 'Resolved'),
+    ]
+    
+    device_id = models.CharField(max_length=100)
+    sensor_type = models.CharField(max_length=20, choices=SensorReading.SENSOR_TYPES)
+    location = models.CharField(max_length=100, blank=True)
+    protocol = models.ForeignKey(SafetyProtocol, on_delete=models.SET_NULL, null=True, blank=True)
+    first_reading = models.ForeignKey(SensorReading, on_delete=models.SET_NULL, null=True, blank=True,
+                                      related_name='+')
+    status = models.CharField(max_length=10, choices=STATUSES, default='firing')
+    threshold = models.FloatField()
+    reading_count = models.PositiveIntegerField(default=1, help_text="Over-threshold readings collapsed into this incident")
+    peak_value = models.FloatField()
+    last_value = models.FloatField()
+    started_at = models.DateTimeField(default=timezone.now)
+    last_seen_at = models.DateTimeField(default=timezone.now)
+    ended_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-started_at']
+        indexes = [
+            models.Index(fields=['-started_at'], name='incident_started_idx'),
+            models.Index(fields=['device_id', 'sensor_type', '-started_at'], name='incident_device_idx'),
+            models.Index(fields=['-started_at'], name='incident_open_idx',
+                         condition=~models.Q(status='resolved')),
+        ]
+    
+    def __str__(self):
+        return f"{self.sensor_type} incident on {self.device_id} ({self.status}, {self.reading_count} readings)"
+
+
+class AnomalyFinding(models.Model):
+    """A run of anomalous readings found by a historical scan (see automation/scan.py)"""
+    KINDS = [
+        ('zscore', 'Rolling Z-Score'),
+        ('spike', 'Spike'),
+        ('flatline', 'Flat Line / Stuck Sensor'),
+    ]
+    
+    scan_id = models.CharField(max_length=32, db_index=True)
+    device_id = models.CharField(max_length=100)
+    sensor_type = models.CharField(max_length=20, choices=SensorReading.SENSOR_TYPES)
+    kind = models.CharField(max_length=10, choices=KINDS)
+    start = models.DateTimeField()
+    end = models.DateTimeField()
+    reading_count = models.PositiveIntegerField()
+    peak_value = models.FloatField()
+    score = models.FloatField(help_text="Largest z-score, jump size in MADs, or run length")
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-start']
+        indexes = [
+            models.Index(fields=['device_id', 'sensor_type', '-start'], name='finding_device_idx'),
+            models.Index(fields=['kind', '-start'], name='finding_kind_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.kind} on {self.device_id} {self.sensor_type} ({self.reading_count} readings from {self.start})"
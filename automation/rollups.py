@@ -0,0 +1,295 @@
+"""Incremental 1m / 1h / 1d rollups of SensorReading for chart queries.
+
+New readings are merged into their buckets with one ``INSERT ... ON
+CONFLICT DO UPDATE`` per batch that adds counts and sums and takes min/max
+in SQL, so concurrent writers in any number of processes never lose an
+update. ``apply_readings`` runs in the transaction that stores the readings
+and ``rebuild`` recomputes a day in one transaction under an exclusive
+lock, so a rebuild counts every reading exactly once.
+"""
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from .models import SensorReading, SensorRollup
+
+logger = logging.getLogger(__name__)
+
+# Bucket width in seconds per resolution, finest first
+RESOLUTION_SECONDS = {
+    '1m': 60,
+    '1h': 3600,
+    '1d': 86400,
+}
+
+KEY_FIELDS = ['device_id', 'sensor_type', 'resolution', 'bucket_start']
+
+ROLLUP_FIELDS = ['count', 'min_value', 'max_value', 'sum_value', 'last_value', 'last_timestamp']
+
+# PostgreSQL advisory lock key: appliers hold it shared, rebuilds exclusively
+REBUILD_LOCK_KEY = 0x726f6c6c   # 'roll'
+
+
+def bucket_start(timestamp, resolution):
+    """Align a timestamp to the start of its UTC bucket"""
+    width = RESOLUTION_SECONDS[resolution]
+    epoch = int(timestamp.timestamp())
+    return datetime.fromtimestamp(epoch - epoch % width, tz=dt_timezone.utc)
+
+
+def pick_resolution(step_seconds):
+    """Coarsest resolution whose bucket width still fits inside the requested step"""
+    chosen = '1m'
+    for resolution, width in RESOLUTION_SECONDS.items():
+        if width <= step_seconds:
+            chosen = resolution
+    return chosen
+
+
+def aggregate(readings, resolutions=None):
+    """Fold readings into per-bucket accumulators keyed by rollup identity"""
+    resolutions = resolutions or list(RESOLUTION_SECONDS)
+    buckets = {}
+    for reading in readings:
+        for resolution in resolutions:
+            key = (reading.device_id, reading.sensor_type, resolution,
+                   bucket_start(reading.timestamp, resolution))
+            acc = buckets.get(key)
+            if acc is None:
+                buckets[key] = [1, reading.value, reading.value, reading.value,
+                                reading.value, reading.timestamp]
+                continue
+            acc[0] += 1
+            acc[1] = min(acc[1], reading.value)
+            acc[2] = max(acc[2], reading.value)
+            acc[3] += reading.value
+            if reading.timestamp >= acc[5]:
+                acc[4] = reading.value
+                acc[5] = reading.timestamp
+    return buckets
+
+
+def _lock(exclusive=False):
+    """Take the rollup rebuild lock for the current transaction.
+
+    PostgreSQL uses an advisory lock. SQLite allows one writer at a time,
+    so a rebuild's transaction already excludes every applier.
+    """
+    if connection.vendor == 'postgresql':
+        function = 'pg_advisory_xact_lock' if exclusive else 'pg_advisory_xact_lock_shared'
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT {function}(%s)', [REBUILD_LOCK_KEY])
+
+
+def _upsert(buckets):
+    """Merge accumulators into their rollup rows in SQL, in key order so concurrent writers lock alike"""
+    table = connection.ops.quote_name(SensorRollup._meta.db_table)
+    fields = [SensorRollup._meta.get_field(name) for name in KEY_FIELDS + ROLLUP_FIELDS]
+    columns = [connection.ops.quote_name(field.column) for field in fields]
+    least, greatest = ('LEAST', 'GREATEST') if connection.vendor == 'postgresql' else ('MIN', 'MAX')
+    count, min_value, max_value, sum_value, last_value, last_timestamp = columns[len(KEY_FIELDS):]
+    newer = f'excluded.{last_timestamp} >= {table}.{last_timestamp}'
+    conflict = (
+        f"ON CONFLICT ({', '.join(columns[:len(KEY_FIELDS)])}) DO UPDATE SET "
+        f'{count} = {table}.{count} + excluded.{count}, '
+        f'{min_value} = {least}({table}.{min_value}, excluded.{min_value}), '
+        f'{max_value} = {greatest}({table}.{max_value}, excluded.{max_value}), '
+        f'{sum_value} = {table}.{sum_value} + excluded.{sum_value}, '
+        f'{last_value} = CASE WHEN {newer} THEN excluded.{last_value} ELSE {table}.{last_value} END, '
+        f'{last_timestamp} = CASE WHEN {newer} THEN excluded.{last_timestamp} ELSE {table}.{last_timestamp} END'
+    )
+    rows = [
+        [field.get_db_prep_save(value, connection) for field, value in zip(fields, (*key, *acc))]
+        for key, acc in sorted(buckets.items())
+    ]
+    row_sql = f"({', '.join(['%s'] * len(fields))})"
+    batch_size = max(connection.ops.bulk_batch_size(fields, rows), 1)
+    with connection.cursor() as cursor:
+        for offset in range(0, len(rows), batch_size):
+            batch = rows[offset:offset + batch_size]
+            cursor.execute(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES {', '.join([row_sql] * len(batch))} {conflict}",
+                [value for row in batch for value in row],
+            )
+
+
+def _merge(rollup, acc):
+    count, min_value, max_value, sum_value, last_value, last_timestamp = acc
+    rollup.count += count
+    rollup.min_value = min(rollup.min_value, min_value)
+    rollup.max_value = max(rollup.max_value, max_value)
+    rollup.sum_value += sum_value
+    if last_timestamp >= rollup.last_timestamp:
+        rollup.last_value = last_value
+        rollup.last_timestamp = last_timestamp
+
+
+def _merge_locked(buckets):
+    """Read-modify-write merge under row locks, for backends without ON CONFLICT upserts"""
+    existing = SensorRollup.objects.select_for_update().filter(
+        device_id__in={key[0] for key in buckets},
+        resolution__in={key[2] for key in buckets},
+        bucket_start__in={key[3] for key in buckets},
+    ).order_by(*KEY_FIELDS)
+    found = {
+        (r.device_id, r.sensor_type, r.resolution, r.bucket_start): r
+        for r in existing
+    }
+
+    to_update = []
+    to_create = []
+    for key, acc in buckets.items():
+        rollup = found.get(key)
+        if rollup is not None:
+            _merge(rollup, acc)
+            to_update.append(rollup)
+            continue
+        device_id, sensor_type, resolution, start = key
+        count, min_value, max_value, sum_value, last_value, last_timestamp = acc
+        to_create.append(SensorRollup(
+            device_id=device_id, sensor_type=sensor_type, resolution=resolution,
+            bucket_start=start, count=count, min_value=min_value, max_value=max_value,
+            sum_value=sum_value, last_value=last_value, last_timestamp=last_timestamp,
+        ))
+
+    if to_update:
+        SensorRollup.objects.bulk_update(to_update, ROLLUP_FIELDS)
+    if to_create:
+        SensorRollup.objects.bulk_create(to_create)
+
+
+def _write_buckets(buckets):
+    if connection.vendor in ('postgresql', 'sqlite'):
+        _upsert(buckets)
+        return
+    try:
+        with transaction.atomic():
+            _merge_locked(buckets)
+    except IntegrityError:
+        # Another transaction created one of the buckets first; merge again
+        logger.info('Rollup bucket race, retrying %d buckets', len(buckets))
+        _merge_locked(buckets)
+
+
+def apply_readings(readings):
+    """Merge freshly stored readings into the rollup tables.
+
+    Call it in the transaction that stored the readings, so a concurrent
+    ``rebuild`` either counts them itself or runs before they are stored.
+    """
+    buckets = aggregate(readings)
+    if not buckets:
+        return 0
+
+    with transaction.atomic():
+        _lock()
+        _write_buckets(buckets)
+    return len(buckets)
+
+
+def raw_window_start(now=None):
+    """Start of the first whole UTC day whose raw readings are all still kept, or None without a retention policy"""
+    from core.retention import get_policies
+
+    days = [policy.days for policy in get_policies()
+            if policy.model is SensorReading and not policy.filter and not policy.scope]
+    if not days:
+        return None
+    cutoff = (now or timezone.now()) - timedelta(days=min(days))
+    first_day = bucket_start(cutoff, '1d')
+    return first_day if first_day == cutoff else first_day + timedelta(days=1)
+
+
+def rebuild(start, end, chunk_size=5000):
+    """Recompute rollups from raw readings in [start, end), for backfills and repairs.
+
+    The range is widened to whole days so every rebuilt bucket is complete,
+    then clamped to the days raw retention still fully covers, since older
+    rollups cannot be recomputed. Each day is rebuilt in one transaction
+    under the exclusive rebuild lock. Returns ``(processed, start, end)``
+    for the range actually rebuilt.
+    """
+    start = bucket_start(start, '1d')
+    end = bucket_start(end, '1d') + timedelta(days=1)
+    window_start = raw_window_start()
+    if window_start is not None and start < window_start:
+        logger.warning('Rollups before %s are past raw retention and were left as they are', window_start)
+        start = window_start
+
+    processed = 0
+    day = start
+    while day < end:
+        with transaction.atomic():
+            _lock(exclusive=True)
+            processed += _rebuild_day(day, chunk_size)
+        day += timedelta(days=1)
+    return processed, start, max(start, end)
+
+
+def _rebuild_day(day, chunk_size):
+    following = day + timedelta(days=1)
+    SensorRollup.objects.filter(bucket_start__gte=day, bucket_start__lt=following).delete()
+    readings = (
+        SensorReading.objects
+        .filter(timestamp__gte=day, timestamp__lt=following)
+        .order_by('timestamp')
+        .only('device_id', 'sensor_type', 'value', 'timestamp')
+    )
+    processed = 0
+    chunk = []
+    for reading in readings.iterator(chunk_size=chunk_size):
+        chunk.append(reading)
+        if len(chunk) >= chunk_size:
+            _write_buckets(aggregate(chunk))
+            processed += len(chunk)
+            chunk = []
+    if chunk:
+        _write_buckets(aggregate(chunk))
+        processed += len(chunk)
+    return processed
+
+
+def series(sensor_type, start, end, step_seconds, device_id=None):
+    """Chart series for a time range served from the coarsest usable rollup.
+
+    Without a ``device_id`` the buckets of every device are combined.
+    Returns ``(resolution, points)``.
+    """
+    resolution = pick_resolution(step_seconds)
+    rollups = SensorRollup.objects.filter(
+        sensor_type=sensor_type,
+        resolution=resolution,
+        bucket_start__gte=bucket_start(start, resolution),
+        bucket_start__lt=end,
+    )
+    if device_id:
+        rollups = rollups.filter(device_id=device_id)
+
+    points = {}
+    for row in rollups.values_list('bucket_start', *ROLLUP_FIELDS).iterator():
+        start_at, count, min_value, max_value, sum_value, last_value, last_timestamp = row
+        point = points.get(start_at)
+        if point is None:
+            points[start_at] = [count, min_value, max_value, sum_value, last_value, last_timestamp]
+            continue
+        point[0] += count
+        point[1] = min(point[1], min_value)
+        point[2] = max(point[2], max_value)
+        point[3] += sum_value
+        if last_timestamp >= point[5]:
+            point[4] = last_value
+            point[5] = last_timestamp
+
+    return resolution, [
+        {
+            'timestamp': start_at,
+            'count': count,
+            'min': min_value,
+            'max': max_value,
+            'avg': sum_value / count if count else None,
+            'last': last_value,
+        }
+        for start_at, (count, min_value, max_value, sum_value, last_value, _) in sorted(points.items())
+    ]
@@ -0,0 +1,8 @@
+from django.urls import path
+from . import consumers
+
+# Device-facing websockets; devices send no Origin header and have no session,
+# so these are routed outside the browser middleware stack in safenest/asgi.py
+websocket_urlpatterns = [
+    path('ws/devices/ingest/', consumers.DeviceIngestConsumer.as_asgi()),
+]
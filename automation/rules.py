@@ -0,0 +1,328 @@
+"""Indexed matcher and executor for AutomationRule trigger conditions.
+
+``trigger_conditions`` per trigger type::
+
+    sensor:  {"sensor_type": "temperature", "operator": ">", "value": 28,
+              "device_id": "esp32-01", "location": "bedroom", "cooldown": 300}
+    gesture: {"gesture_type": "swipe_up"}
+    voice:   {"interpreted_action": "turn_on_lights"} and/or {"keywords": ["movie", "night"]}
+
+Active rules are compiled into a dict keyed by (trigger_type, subject,
+device_id), where subject is the sensor type, gesture type or interpreted
+voice action, and missing fields are indexed as ``'*'``. An event is matched
+with four dict lookups, whatever the number of rules, and only those
+candidates are evaluated. Rule saves and deletes update the index in place;
+other processes rebuild when the ``automation_rules`` version changes.
+"""
+import logging
+import operator
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from core import versions
+
+logger = logging.getLogger(__name__)
+
+VERSION_NAME = 'automation_rules'
+
+ANY = '*'
+
+# Condition field holding each trigger type's index subject
+SUBJECT_FIELDS = {
+    'sensor': 'sensor_type',
+    'gesture': 'gesture_type',
+    'voice': 'interpreted_action',
+}
+
+OPERATORS = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+
+CompiledRule = namedtuple('CompiledRule', [
+    'id', 'user_id', 'name', 'key', 'op', 'threshold', 'location', 'keywords', 'cooldown',
+    'action_type', 'action_parameters', 'target_device',
+])
+
+
+def get_rule_settings():
+    """Automation rule engine settings merged over the defaults"""
+    defaults = {
+        'COOLDOWN_SECONDS': 60,        # Minimum gap between firings of a rule per device
+        'VERSION_CHECK_INTERVAL': 1.0,
+        'MAX_COOLDOWNS': 10000,        # (rule, device) cooldowns tracked; the oldest are dropped past this
+    }
+    defaults.update(getattr(settings, 'AUTOMATION_RULE_SETTINGS', {}))
+    return defaults
+
+
+def action_parameters(rule):
+    """A rule's action parameters, or {} when they are not a JSON object"""
+    return rule.action_parameters if isinstance(rule.action_parameters, dict) else {}
+
+
+def action_priority(parameters):
+    """Integer dispatch priority from action parameters, or None for the dispatcher's default"""
+    try:
+        return int(parameters['priority'])
+    except (KeyError, TypeError, ValueError, OverflowError):
+        return None
+
+
+def compile_rule(rule, default_cooldown=0):
+    """CompiledRule for an active event-driven rule, or None if it cannot be indexed"""
+    subject_field = SUBJECT_FIELDS.get(rule.trigger_type)
+    if not rule.is_active or subject_field is None:
+        return None
+    conditions = rule.trigger_conditions if isinstance(rule.trigger_conditions, dict) else {}
+
+    op = conditions.get('operator', '>')
+    threshold = conditions.get('value', conditions.get('threshold'))
+    if op not in OPERATORS:
+        return None
+    try:
+        threshold = float(threshold) if threshold is not None else None
+        cooldown = float(conditions.get('cooldown', default_cooldown))
+    except (TypeError, ValueError):
+        return None
+
+    keywords = conditions.get('keywords') or []
+    if isinstance(keywords, str):
+        keywords = [keywords]
+    key = (rule.trigger_type, conditions.get(subject_field) or ANY, conditions.get('device_id') or ANY)
+    return CompiledRule(
+        rule.id, rule.user_id, rule.name, key, op, threshold, conditions.get('location') or '',
+        tuple(word.lower() for word in keywords), cooldown,
+        rule.action_type, action_parameters(rule), rule.target_device,
+    )
+
+
+def rule_matches(rule, value=None, location='', text='', user_id=None):
+    """Evaluate a candidate rule's remaining conditions against an event"""
+    if user_id is not None and rule.user_id != user_id:
+        return False
+    if rule.location and rule.location != location:
+        return False
+    if rule.threshold is not None and (value is None or not OPERATORS[rule.op](value, rule.threshold)):
+        return False
+    if rule.keywords and not all(word in text for word in rule.keywords):
+        return False
+    return True
+
+
+class RuleIndex:
+    """Compiled active rules keyed by (trigger_type, subject, device_id)"""
+
+    def __init__(self):
+        config = get_rule_settings()
+        self.default_cooldown = config['COOLDOWN_SECONDS']
+        self.check_interval = config['VERSION_CHECK_INTERVAL']
+        self.max_cooldowns = config['MAX_COOLDOWNS']
+        self._index = None
+        self._keys = {}
+        self._quiet_until = OrderedDict()   # (rule id, device_id) -> monotonic end of cooldown, oldest first
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.RLock()
+        self.counters = {'events': 0, 'candidates': 0, 'fired': 0, 'suppressed': 0, 'failed': 0}
+
+    def rebuild(self, rules=None):
+        """Compile all active rules (or the given rule objects) from scratch"""
+        from .models import AutomationRule
+
+        with self._lock:
+            version = versions.get(VERSION_NAME)
+            if rules is None:
+                rules = AutomationRule.objects.filter(is_active=True, trigger_type__in=list(SUBJECT_FIELDS))
+            self._index = {}
+            self._keys = {}
+            for rule in rules:
+                self._add(compile_rule(rule, self.default_cooldown))
+            self._version = version
+            self._checked_at = time.monotonic()
+
+    def update(self, rule):
+        """Re-index one rule after it was saved"""
+        with self._lock:
+            if self._index is None:
+                return
+            self._remove(rule.id)
+            self._add(compile_rule(rule, self.default_cooldown))
+
+    def remove(self, rule_id):
+        with self._lock:
+            if self._index is not None:
+                self._remove(rule_id)
+
+    def changed(self, rule=None, rule_id=None):
+        """Apply a local rule change and publish it to other processes"""
+        if rule is not None:
+            self.update(rule)
+        elif rule_id is not None:
+            self.remove(rule_id)
+        with self._lock:
+            previous = self._version
+            version = versions.bump(VERSION_NAME)
+            # Our own change is already applied; only skip the rebuild if no
+            # other process bumped the version in between
+            if previous is not None and version == previous + 1:
+                self._version = version
+
+    def candidates(self, trigger_type, subject, device_id=''):
+        """Rules indexed under the event's key or its wildcards"""
+        index = self._current()
+        device_id = device_id or ANY
+        found = []
+        for key in {(trigger_type, subject, device_id), (trigger_type, subject, ANY),
+                    (trigger_type, ANY, device_id), (trigger_type, ANY, ANY)}:
+            bucket = index.get(key)
+            if bucket:
+                found.extend(bucket.values())
+        return found
+
+    def match(self, trigger_type, subject, device_id='', value=None, location='', text='', user_id=None):
+        """Candidate rules whose conditions hold for the event"""
+        candidates = self.candidates(trigger_type, subject, device_id)
+        self.counters['events'] += 1
+        self.counters['candidates'] += len(candidates)
+        text = text.lower()
+        return [rule for rule in candidates if rule_matches(rule, value, location, text, user_id)]
+
+    def process_reading(self, reading):
+        """Match and execute sensor rules for a stored SensorReading"""
+        return self.fire(
+            self.match('sensor', reading.sensor_type, reading.device_id, reading.value, reading.location),
+            reading.device_id,
+            {'device_id': reading.device_id, 'sensor_type': reading.sensor_type,
+             'value': reading.value, 'location': reading.location},
+        )
+
+    def process_event(self, trigger_type, subject, user=None, device_id='', text=''):
+        """Match and execute a user's gesture or voice rules"""
+        user_id = user.id if user is not None and user.is_authenticated else None
+        if user_id is None:
+            return []
+        rules = self.match(trigger_type, subject, device_id, text=text, user_id=user_id)
+        return self.fire(rules, device_id, {'trigger': trigger_type, 'subject': subject, 'text': text})
+
+    def fire(self, rules, device_id, context):
+        """Execute matched rules that are outside their cooldown; returns the rules run"""
+        if not rules:
+            return []
+        now = time.monotonic()
+        due = []
+        with self._lock:
+            self._expire_cooldowns(now)
+            for rule in rules:
+                key = (rule.id, device_id)
+                quiet_until = self._quiet_until.get(key)
+                if quiet_until is not None and now < quiet_until:
+                    self.counters['suppressed'] += 1
+                    continue
+                self._quiet_until[key] = now + rule.cooldown
+                self._quiet_until.move_to_end(key)
+                due.append(rule)
+            while len(self._quiet_until) > self.max_cooldowns:
+                self._quiet_until.popitem(last=False)
+
+        if not due:
+            return due
+        try:
+            execute_rules(due, context)
+            self.counters['fired'] += len(due)
+        except Exception:
+            logger.exception('Automation rules %s failed', [rule.id for rule in due])
+            self.counters['failed'] += len(due)
+        return due
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['rules'] = len(self._keys)
+            stats['keys'] = len(self._index or {})
+            stats['cooldowns'] = len(self._quiet_until)
+        return stats
+
+    def _expire_cooldowns(self, now):
+        """Drop cooldowns that have ended, starting from the least recently fired"""
+        while self._quiet_until:
+            key, quiet_until = next(iter(self._quiet_until.items()))
+            if quiet_until > now:
+                break
+            del self._quiet_until[key]
+
+    def _current(self):
+        now = time.monotonic()
+        if self._index is None or now - self._checked_at >= self.check_interval:
+            with self._lock:
+                if self._index is None or versions.get(VERSION_NAME) != self._version:
+                    self.rebuild()
+                self._checked_at = now
+        return self._index
+
+    def _add(self, compiled):
+        if compiled is None:
+            return
+        self._index.setdefault(compiled.key, {})[compiled.id] = compiled
+        self._keys[compiled.id] = compiled.key
+
+    def _remove(self, rule_id):
+        key = self._keys.pop(rule_id, None)
+        if key is None:
+            return
+        bucket = self._index.get(key, {})
+        bucket.pop(rule_id, None)
+        if not bucket:
+            self._index.pop(key, None)
+
+
+def execute_rules(rules, context):
+    """Run the actions of rules fired by one event, stamp last_triggered and log them.
+
+    Device actions of all the rules go through one executor batch, so their
+    state changes and log rows are written together.
+    """
+    from .dispatch import dispatcher
+    from .executor import DEVICE_ACTIONS, DeviceAction, apply_device_actions
+    from .models import AutomationLog, AutomationRule
+
+    actions = []
+    logs = []
+    for rule in rules:
+        parameters = action_parameters(rule)
+        log = {
+            'user_id': rule.user_id,
+            'log_type': 'rule_triggered',
+            'description': parameters.get('message') or f"Rule '{rule.name}': {rule.action_type} {rule.target_device}",
+            'metadata': {'rule_id': rule.id, 'action': rule.action_type, 'trigger': context},
+        }
+        if rule.action_type in DEVICE_ACTIONS:
+            actions.append(DeviceAction(rule.target_device, rule.action_type, parameters, log=log))
+            continue
+        if rule.action_type == 'activate_safety' and 'sensor_type' in context:
+            dispatcher.submit(
+                context['sensor_type'], context['value'], context['location'],
+                priority=action_priority(parameters),
+            )
+        logs.append(AutomationLog(device_id=rule.target_device, **log))
+
+    with transaction.atomic():
+        AutomationRule.objects.filter(id__in=[rule.id for rule in rules]).update(last_triggered=timezone.now())
+        apply_device_actions(actions)
+        AutomationLog.objects.bulk_create(logs)
+
+
+def execute_rule(rule, context):
+    execute_rules([rule], context)
+
+
+rule_index = RuleIndex()
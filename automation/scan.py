@@ -0,0 +1,263 @@
+"""Vectorised historical anomaly scan over SensorReading.
+
+Each (device_id, sensor_type) series is read twice in keyset-paged chunks.
+The first pass keeps only the series' steps as float32 (4 bytes per
+reading, so O(N) in its length) to fix the spike scale. The second pass
+loads one chunk at a time into NumPy arrays and runs it through three
+detectors:
+
+* rolling z-score against the previous ``window`` readings,
+* spikes: a jump and an immediate return, both larger than ``spike_mads``
+  median absolute deviations of the step size over the whole series,
+* flat lines: ``flatline_run`` or more identical consecutive readings, the
+  usual signature of a stuck sensor.
+
+The tail of each chunk is carried into the next so windows and runs span
+chunk boundaries, and since the spike scale is fixed up front no score
+depends on where the chunks split. Series are spread over a process pool
+and findings are written to AnomalyFinding by the parent process.
+"""
+import multiprocessing
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone as dt_timezone
+
+import numpy as np
+from django.db import connections
+from django.db.models import Q
+
+from .models import AnomalyFinding, SensorReading
+
+DEFAULT_OPTIONS = {
+    'window': 60,          # Readings in the rolling z-score baseline
+    'z_threshold': 4.0,
+    'spike_mads': 8.0,
+    'flatline_run': 30,    # Identical readings in a row before a sensor counts as stuck
+    'flatline_eps': 1e-9,
+    'min_std': 0.01,
+    'chunk_size': 50000,
+}
+
+
+def iter_chunks(device_id, sensor_type, start, end, chunk_size):
+    """Yield ``(timestamps, values)`` arrays for one series in time order"""
+    readings = (
+        SensorReading.objects
+        .filter(device_id=device_id, sensor_type=sensor_type, timestamp__gte=start, timestamp__lt=end)
+        .order_by('timestamp', 'id')
+    )
+    last = None
+    while True:
+        page = readings
+        if last is not None:
+            page = page.filter(Q(timestamp__gt=last[0]) | Q(timestamp=last[0], id__gt=last[1]))
+        rows = list(page.values_list('timestamp', 'id', 'value')[:chunk_size])
+        if not rows:
+            return
+        timestamps = np.fromiter((row[0].timestamp() for row in rows), dtype=float, count=len(rows))
+        values = np.fromiter((row[2] for row in rows), dtype=float, count=len(rows))
+        yield timestamps, values
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1][:2]
+
+
+def runs(mask):
+    """``(start, end)`` index pairs (inclusive) of the True runs in a boolean array"""
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.view(np.int8), [0]))))
+    return zip(edges[::2], edges[1::2] - 1)
+
+
+def rolling_zscores(values, window, min_std):
+    """z-score of each reading against the ``window`` readings before it (NaN where too early)"""
+    scores = np.full(len(values), np.nan)
+    if len(values) <= window:
+        return scores
+    history = np.lib.stride_tricks.sliding_window_view(values[:-1], window)
+    std = np.maximum(history.std(axis=1), min_std)
+    scores[window:] = (values[window:] - history.mean(axis=1)) / std
+    return scores
+
+
+def step_scale(steps):
+    """Robust spread of the step sizes: the scaled MAD, or the mean step if that is zero"""
+    if not len(steps):
+        return 1e-9
+    mad = np.median(np.abs(steps - np.median(steps))) * 1.4826
+    return float(mad) if mad > 0 else max(float(np.abs(steps).mean()), 1e-9)
+
+
+def series_step_scale(device_id, sensor_type, start, end, chunk_size):
+    """``step_scale`` over every step of one series, read chunk by chunk"""
+    steps = []
+    last = None
+    for _, values in iter_chunks(device_id, sensor_type, start, end, chunk_size):
+        if last is not None:
+            values = np.concatenate(([last], values))
+        steps.append(np.diff(values).astype(np.float32))
+        last = values[-1]
+    return step_scale(np.concatenate(steps) if steps else np.empty(0))
+
+
+def spike_scores(values, scale=None):
+    """Size of out-and-back jumps in units of ``scale`` per reading (0 where none).
+
+    ``scale`` defaults to the ``step_scale`` of ``values`` themselves.
+    """
+    scores = np.zeros(len(values))
+    if len(values) < 3:
+        return scores
+    steps = np.diff(values)
+    if scale is None:
+        scale = step_scale(steps)
+    rise, fall = steps[:-1], steps[1:]
+    reverses = np.sign(rise) == -np.sign(fall)
+    scores[1:-1] = np.where(reverses, np.minimum(np.abs(rise), np.abs(fall)) / scale, 0.0)
+    return scores
+
+
+def flatline_mask(values, min_run, eps):
+    """Readings that belong to a run of at least ``min_run`` identical values"""
+    mask = np.zeros(len(values), dtype=bool)
+    if len(values) < 2:
+        return mask
+    same = np.abs(np.diff(values)) <= eps
+    for start, end in runs(same):
+        if end - start + 2 >= min_run:
+            mask[start:end + 2] = True
+    return mask
+
+
+def detect(timestamps, values, offset, options, spike_scale=None):
+    """Run all detectors over one chunk; returns findings with global indices"""
+    findings = []
+    detectors = [
+        ('zscore', np.abs(rolling_zscores(values, options['window'], options['min_std'])), options['z_threshold']),
+        ('spike', spike_scores(values, spike_scale), options['spike_mads']),
+    ]
+    for kind, scores, threshold in detectors:
+        for start, end in runs(np.nan_to_num(scores) >= threshold):
+            findings.append(finding(kind, timestamps, values, offset, start, end, scores[start:end + 1].max()))
+
+    for start, end in runs(flatline_mask(values, options['flatline_run'], options['flatline_eps'])):
+        findings.append(finding('flatline', timestamps, values, offset, start, end, end - start + 1))
+    return findings
+
+
+def finding(kind, timestamps, values, offset, start, end, score):
+    return {
+        'kind': kind,
+        'first': offset + int(start),
+        'last': offset + int(end),
+        'start': float(timestamps[start]),
+        'end': float(timestamps[end]),
+        'peak_value': float(values[start:end + 1].max()),
+        'score': float(score),
+    }
+
+
+def merge(findings):
+    """Join findings of the same kind that overlap or touch across chunk boundaries"""
+    merged = []
+    open_by_kind = {}
+    for item in sorted(findings, key=lambda item: (item['kind'], item['first'])):
+        current = open_by_kind.get(item['kind'])
+        if current is not None and item['first'] <= current['last'] + 1:
+            if item['last'] > current['last']:
+                current['last'], current['end'] = item['last'], item['end']
+            current['peak_value'] = max(current['peak_value'], item['peak_value'])
+            current['score'] = max(current['score'], item['score'])
+            if item['kind'] == 'flatline':
+                current['score'] = current['last'] - current['first'] + 1
+            continue
+        current = open_by_kind[item['kind']] = dict(item)
+        merged.append(current)
+    for item in merged:
+        item['reading_count'] = item['last'] - item['first'] + 1
+    return merged
+
+
+def scan_series(task):
+    """Scan one series; runs in a pool worker. Returns (device_id, sensor_type, readings, findings)"""
+    device_id, sensor_type, start, end, options = task
+    carry = max(options['window'], options['flatline_run']) + 1
+    scale = series_step_scale(device_id, sensor_type, start, end, options['chunk_size'])
+    tail_ts = tail_values = np.empty(0)
+    offset = 0
+    total = 0
+    findings = []
+    for timestamps, values in iter_chunks(device_id, sensor_type, start, end, options['chunk_size']):
+        timestamps = np.concatenate((tail_ts, timestamps))
+        values = np.concatenate((tail_values, values))
+        findings.extend(detect(timestamps, values, offset, options, scale))
+        total += len(values) - len(tail_values)
+        offset += len(values) - min(carry, len(values))
+        tail_ts, tail_values = timestamps[-carry:], values[-carry:]
+    return device_id, sensor_type, total, merge(findings)
+
+
+def _init_worker():
+    # Connections inherited from the parent must not be shared across processes
+    connections.close_all()
+
+
+def list_series(start, end, device_id=None, sensor_type=None):
+    readings = SensorReading.objects.filter(timestamp__gte=start, timestamp__lt=end)
+    if device_id:
+        readings = readings.filter(device_id=device_id)
+    if sensor_type:
+        readings = readings.filter(sensor_type=sensor_type)
+    return list(readings.order_by().values_list('device_id', 'sensor_type').distinct())
+
+
+def scan(start, end, device_id=None, sensor_type=None, workers=1, options=None, save=True):
+    """Scan every matching series and record the findings.
+
+    Returns a summary with the ``scan_id`` the findings were saved under.
+    """
+    options = {**DEFAULT_OPTIONS, **(options or {})}
+    series = list_series(start, end, device_id, sensor_type)
+    tasks = [(device, kind, start, end, options) for device, kind in series]
+    scan_id = uuid.uuid4().hex
+    summary = {'scan_id': scan_id, 'series': len(series), 'readings': 0, 'findings': {}}
+
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    if workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        # Forked workers reuse the configured Django setup; close the parent's
+        # connections first so no socket is shared with a child
+        connections.close_all()
+        executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork'),
+                                       initializer=_init_worker)
+        with executor:
+            results = executor.map(scan_series, tasks, chunksize=max(1, len(tasks) // (workers * 4)))
+            record(results, scan_id, summary, save)
+    else:
+        record(map(scan_series, tasks), scan_id, summary, save)
+    return summary
+
+
+def record(results, scan_id, summary, save):
+    pending = []
+    for device_id, sensor_type, readings, findings in results:
+        summary['readings'] += readings
+        for item in findings:
+            summary['findings'][item['kind']] = summary['findings'].get(item['kind'], 0) + 1
+            if not save:
+                continue
+            pending.append(AnomalyFinding(
+                scan_id=scan_id,
+                device_id=device_id,
+                sensor_type=sensor_type,
+                kind=item['kind'],
+                start=datetime.fromtimestamp(item['start'], tz=dt_timezone.utc),
+                end=datetime.fromtimestamp(item['end'], tz=dt_timezone.utc),
+                reading_count=item['reading_count'],
+                peak_value=item['peak_value'],
+                score=item['score'],
+            ))
+        if len(pending) >= 1000:
+            AnomalyFinding.objects.bulk_create(pending)
+            pending = []
+    if pending:
+        AnomalyFinding.objects.bulk_create(pending)
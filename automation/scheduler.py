@@ -0,0 +1,338 @@
+"""Min-heap scheduler for time-triggered automation rules.
+
+Time rules put their schedule in ``trigger_conditions``::
+
+    {"cron": "30 7 * * 1-5"}     minute hour day-of-month month day-of-week
+    {"interval": 900}            every N seconds (fractions allowed)
+    {"at": "22:15:30"}           daily at a local wall-clock time
+
+Each rule has one entry in a heap ordered by its next fire time. The run
+loop sleeps until the earliest entry is due, fires everything due, and
+pushes each rule's following occurrence; it never polls the database.
+Rule changes are picked up from the ``automation_rules`` version counter:
+only then are time rules re-read and diffed, and only changed rules are
+rescheduled (stale heap entries are skipped when popped).
+"""
+import heapq
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from core import versions
+
+from .rules import ANY, VERSION_NAME, CompiledRule, action_parameters, execute_rule
+
+logger = logging.getLogger(__name__)
+
+CRON_FIELDS = [
+    ('minute', 0, 59),
+    ('hour', 0, 23),
+    ('day', 1, 31),
+    ('month', 1, 12),
+    ('weekday', 0, 7),   # 0 and 7 are both Sunday
+]
+
+
+def get_scheduler_settings():
+    """Automation scheduler settings merged over the defaults"""
+    defaults = {
+        'WORKERS': 4,               # Threads executing fired rules
+        'VERSION_CHECK_INTERVAL': 1.0,
+        'RELOAD_INTERVAL': 300,     # Full reconcile as a safety net for per-process caches; 0 disables
+    }
+    defaults.update(getattr(settings, 'AUTOMATION_SCHEDULER_SETTINGS', {}))
+    return defaults
+
+
+def parse_cron_field(text, low, high):
+    """Set of values matched by one cron field (``*``, ``a-b``, ``*/n``, ``a-b/n`` and lists)"""
+    values = set()
+    for part in text.split(','):
+        expression, _, step = part.partition('/')
+        step = int(step) if step else 1
+        if expression == '*':
+            start, end = low, high
+        elif '-' in expression:
+            start, end = (int(value) for value in expression.split('-', 1))
+        else:
+            start = int(expression)
+            end = high if step > 1 else start
+        if not low <= start <= end <= high or step < 1:
+            raise ValueError(f'Cron field {text!r} is out of range {low}-{high}')
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+class CronSchedule:
+    """Five-field cron expression evaluated in the project time zone"""
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError('Cron expressions need five fields: minute hour day month weekday')
+        parsed = [parse_cron_field(text, low, high) for text, (_, low, high) in zip(fields, CRON_FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        self.weekdays = frozenset(day % 7 for day in weekdays)
+        # Standard cron: if both day fields are restricted, either may match. As
+        # in Vixie cron, a field starting with '*' (e.g. '*/2') counts as unrestricted
+        self.any_day = fields[2].startswith('*')
+        self.any_weekday = fields[4].startswith('*')
+        self.expression = expression
+
+    def day_matches(self, moment):
+        day_ok = moment.day in self.days
+        weekday_ok = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day_ok and weekday_ok
+        return day_ok or weekday_ok
+
+    def next_after(self, moment):
+        """First matching minute strictly after ``moment`` (aware datetime)"""
+        tz = timezone.get_default_timezone()
+        local = timezone.localtime(moment, tz).replace(tzinfo=None, second=0, microsecond=0) + timedelta(minutes=1)
+        limit = local + timedelta(days=366 * 5)
+        while local < limit:
+            if local.month not in self.months:
+                year, month = (local.year + 1, 1) if local.month == 12 else (local.year, local.month + 1)
+                local = local.replace(year=year, month=month, day=1, hour=0, minute=0)
+            elif not self.day_matches(local):
+                local = (local + timedelta(days=1)).replace(hour=0, minute=0)
+            elif local.hour not in self.hours:
+                local = (local + timedelta(hours=1)).replace(minute=0)
+            elif local.minute not in self.minutes:
+                later = [minute for minute in self.minutes if minute > local.minute]
+                local = local.replace(minute=min(later)) if later else (local + timedelta(hours=1)).replace(minute=0)
+            else:
+                return timezone.make_aware(local, tz)
+        raise ValueError(f'Cron expression {self.expression!r} never fires')
+
+
+class DailySchedule:
+    """Every day at a local HH:MM[:SS[.ffffff]]"""
+
+    FORMATS = ['%H:%M', '%H:%M:%S', '%H:%M:%S.%f']
+
+    def __init__(self, at):
+        for fmt in self.FORMATS:
+            try:
+                self.at = datetime.strptime(at, fmt).time()
+                return
+            except ValueError:
+                continue
+        raise ValueError(f'at must be HH:MM[:SS[.ffffff]], not {at!r}')
+
+    def next_after(self, moment):
+        tz = timezone.get_default_timezone()
+        local = timezone.localtime(moment, tz)
+        candidate = timezone.make_aware(datetime.combine(local.date(), self.at), tz)
+        if candidate <= moment:
+            candidate = timezone.make_aware(datetime.combine(local.date() + timedelta(days=1), self.at), tz)
+        return candidate
+
+
+class IntervalSchedule:
+    """Every ``seconds`` seconds"""
+
+    def __init__(self, seconds):
+        self.seconds = float(seconds)
+        if self.seconds <= 0:
+            raise ValueError('interval must be positive')
+
+    def next_after(self, moment):
+        return moment + timedelta(seconds=self.seconds)
+
+
+def parse_schedule(conditions):
+    """Schedule object for a time rule's trigger_conditions; raises ValueError if invalid"""
+    if not isinstance(conditions, dict):
+        raise ValueError('trigger_conditions must be an object')
+    if conditions.get('cron'):
+        return CronSchedule(conditions['cron'])
+    if conditions.get('interval') is not None:
+        try:
+            return IntervalSchedule(conditions['interval'])
+        except (TypeError, ValueError):
+            raise ValueError('interval must be a positive number of seconds')
+    if conditions.get('at'):
+        return DailySchedule(str(conditions['at']))
+    raise ValueError('Time rules need a cron, interval or at condition')
+
+
+def compile_time_rule(rule):
+    return CompiledRule(
+        rule.id, rule.user_id, rule.name, ('time', ANY, ANY), '>', None, '', (), 0,
+        rule.action_type, action_parameters(rule), rule.target_device,
+    )
+
+
+def fingerprint(rule):
+    return json.dumps([rule.trigger_conditions, rule.action_type, rule.action_parameters,
+                       rule.target_device, rule.name], sort_keys=True, default=str)
+
+
+def run_time_rule(rule, scheduled_at):
+    try:
+        execute_rule(rule, {'trigger': 'time', 'scheduled_at': scheduled_at})
+    finally:
+        close_old_connections()
+
+
+class Scheduler:
+    """Heap of (next fire time, rule) woken once per due instant"""
+
+    def __init__(self, action=run_time_rule, workers=None):
+        config = get_scheduler_settings()
+        self.action = action
+        self.version_check_interval = config['VERSION_CHECK_INTERVAL']
+        self.reload_interval = config['RELOAD_INTERVAL']
+        self.pool = ThreadPoolExecutor(workers or config['WORKERS'], thread_name_prefix='automation-scheduler')
+
+        self._heap = []
+        self._entries = {}
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._version = None
+        self.counters = {'wakeups': 0, 'fired': 0, 'failed': 0, 'invalid': 0, 'reloads': 0}
+        self.lag = deque(maxlen=10000)  # Seconds between due time and execution start
+
+    def __len__(self):
+        return len(self._entries)
+
+    def schedule(self, rule, schedule=None, now=None):
+        """Add or replace a rule's entry; returns False if its schedule is invalid"""
+        try:
+            schedule = schedule or parse_schedule(rule.trigger_conditions)
+        except ValueError as e:
+            logger.warning('Time rule %s has an invalid schedule: %s', rule.id, e)
+            self.counters['invalid'] += 1
+            self.unschedule(rule.id)
+            return False
+        now = now or timezone.now()
+        fire_at = schedule.next_after(now).timestamp()
+        with self._lock:
+            generation = next(self._sequence)
+            self._entries[rule.id] = (generation, compile_time_rule(rule), schedule, fingerprint(rule))
+            heapq.heappush(self._heap, (fire_at, generation, rule.id))
+            earliest = self._heap[0][1] == generation
+        if earliest:
+            self._wakeup.set()
+        return True
+
+    def unschedule(self, rule_id):
+        # The heap entry is left behind and skipped when popped
+        with self._lock:
+            self._entries.pop(rule_id, None)
+
+    def reconcile(self):
+        """Diff active time rules against the heap and reschedule only what changed"""
+        from .models import AutomationRule
+
+        self._version = versions.get(VERSION_NAME)
+        rules = AutomationRule.objects.filter(trigger_type='time', is_active=True)
+        seen = set()
+        changed = 0
+        now = timezone.now()
+        for rule in rules.iterator(chunk_size=2000):
+            seen.add(rule.id)
+            entry = self._entries.get(rule.id)
+            if entry is None or entry[3] != fingerprint(rule):
+                self.schedule(rule, now=now)
+                changed += 1
+        for rule_id in set(self._entries) - seen:
+            self.unschedule(rule_id)
+            changed += 1
+        self.counters['reloads'] += 1
+        return changed
+
+    def next_due(self):
+        """Timestamp of the earliest live entry, or None"""
+        with self._lock:
+            while self._heap and self._stale(self._heap[0]):
+                heapq.heappop(self._heap)
+            return self._heap[0][0] if self._heap else None
+
+    def run_due(self, now=None):
+        """Fire every entry due by ``now`` and schedule each rule's next occurrence"""
+        now = now or time.time()
+        fired = 0
+        while True:
+            with self._lock:
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                entry = heapq.heappop(self._heap)
+                if self._stale(entry):
+                    continue
+                fire_at, generation, rule_id = entry
+                _, rule, schedule, _ = self._entries[rule_id]
+                # Chain from the due time so intervals don't drift, but never
+                # schedule into the past: a late wake-up skips missed occurrences
+                next_at = schedule.next_after(datetime.fromtimestamp(fire_at, tz=dt_timezone.utc)).timestamp()
+                if next_at <= now:
+                    next_at = schedule.next_after(datetime.fromtimestamp(now, tz=dt_timezone.utc)).timestamp()
+                heapq.heappush(self._heap, (next_at, generation, rule_id))
+            self.pool.submit(self._fire, rule, fire_at)
+            fired += 1
+        return fired
+
+    def run(self, load=True):
+        """Serve the heap until ``stop()`` is called; ``load`` reads time rules from the database first"""
+        if load:
+            self.reconcile()
+        else:
+            self._version = versions.get(VERSION_NAME)
+        next_check = time.monotonic() + self.version_check_interval
+        next_reload = time.monotonic() + self.reload_interval if self.reload_interval else float('inf')
+        while not self._stopped.is_set():
+            self.run_due()
+
+            now = time.monotonic()
+            if now >= next_check:
+                next_check = now + self.version_check_interval
+                if versions.get(VERSION_NAME) != self._version or (load and now >= next_reload):
+                    self.reconcile()
+                    if self.reload_interval:
+                        next_reload = now + self.reload_interval
+
+            due = self.next_due()
+            timeout = next_check - time.monotonic()
+            if due is not None:
+                timeout = min(timeout, due - time.time())
+            self._wakeup.wait(max(timeout, 0))
+            self._wakeup.clear()
+            self.counters['wakeups'] += 1
+        self.pool.shutdown(wait=True)
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['scheduled'] = len(self._entries)
+            stats['heap'] = len(self._heap)
+        return stats
+
+    def _stale(self, entry):
+        current = self._entries.get(entry[2])
+        return current is None or current[0] != entry[1]
+
+    def _fire(self, rule, fire_at):
+        self.lag.append(time.time() - fire_at)
+        try:
+            self.action(rule, datetime.fromtimestamp(fire_at, tz=dt_timezone.utc).isoformat())
+            self.counters['fired'] += 1
+        except Exception:
+            logger.exception('Scheduled rule %s failed', rule.id)
+            self.counters['failed'] += 1
@@ -0,0 +1,50 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from devices.models import Device
+from .models import AutomationRule, DeviceStatus, SafetyProtocol
+from .rules import rule_index
+from .state_cache import state_cache
+from .thresholds import protocols_changed
+
+
+@receiver(post_save, sender=SafetyProtocol)
+@receiver(post_delete, sender=SafetyProtocol)
+def reload_thresholds(sender, instance, **kwargs):
+    """Recompile alert thresholds after a protocol is added, edited or removed"""
+    protocols_changed()
+
+
+@receiver(post_save, sender=AutomationRule)
+def reindex_rule(sender, instance, **kwargs):
+    """Update the compiled rule index in place once a rule save commits.
+
+    Publishing the new version before the commit would let other processes
+    reload the old rows under it; a rolled-back save changes nothing.
+    """
+    transaction.on_commit(lambda: rule_index.changed(rule=instance))
+
+
+@receiver(post_delete, sender=AutomationRule)
+def unindex_rule(sender, instance, **kwargs):
+    rule_id = instance.id
+    transaction.on_commit(lambda: rule_index.changed(rule_id=rule_id))
+
+
+@receiver(post_save, sender=DeviceStatus)
+def cache_device_state(sender, instance, created, **kwargs):
+    """Write single-row saves (admin, shell) through to the device state cache"""
+    transaction.on_commit(lambda: state_cache.saved([instance], membership_changed=created))
+
+
+@receiver(post_delete, sender=DeviceStatus)
+def uncache_device_state(sender, instance, **kwargs):
+    transaction.on_commit(lambda: state_cache.deleted([instance.device_id]))
+
+
+@receiver(post_save, sender=Device)
+def rehome_device_state(sender, instance, **kwargs):
+    """Publish a device's move to another home once the save commits"""
+    registered_id, home = instance.pk, instance.home_id
+    transaction.on_commit(lambda: state_cache.rehomed(registered_id, home))
@@ -0,0 +1,396 @@
+"""Write-through cache of serialized device state, per home.
+
+Each home's devices (statuses linked to a registered device of that home;
+statuses with no registered device are grouped under ``UNASSIGNED``) are
+held per process as one pre-encoded JSON string per device, and the
+response body for a home is joined from those strings once per change.
+Serving ``device_status_api`` therefore touches neither the database nor
+the JSON encoder.
+
+Writers update the cache after their transaction commits: the action
+executor and DeviceStatus saves pass the saved rows, the heartbeat flusher
+and offline sweep pass their ``last_seen``/``is_online`` changes. Each
+write bumps the ``device_state:<home>`` version of the homes it touched;
+other processes compare versions at most once per ``VERSION_CHECK_INTERVAL``
+and reload only the stale homes, one query each. Adding, deleting or
+re-homing a device bumps ``device_state:homes``, which reloads everything.
+
+Every state change stamps the row with a ``change_seq`` from a
+commit-ordered database sequence (see core/sequences.py). Each response
+carries a weak ETag built from the device count and ``change_seq`` max and
+sum, so an unchanged poll is answered 304 from in-memory numbers, and a
+``cursor``: the sequence value read when the snapshot was loaded, below
+which nothing committed is missing from it. ``render_delta`` returns only
+devices changed after a client's cursor; it skips the database entirely
+when no cached device is newer than the cursor and otherwise runs one
+indexed query. Deletions are not listed in deltas; clients detect them
+from ``total_devices`` and fetch the full list again. ``last_seen`` alone
+does not advance ``change_seq``, so it is only as fresh as the last full
+response.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from core import versions
+from core.sequences import current_value
+
+HOMES_VERSION = 'device_state:homes'
+
+# Home key for device statuses that are not linked to a registered device
+UNASSIGNED = 0
+
+FIELDS = ['device_id', 'device_name', 'device_type', 'is_online', 'current_state', 'location', 'last_seen', 'change_seq']
+
+encoder = DjangoJSONEncoder(separators=(',', ':'))
+
+
+def get_state_cache_settings():
+    """Device state cache settings merged over the defaults"""
+    defaults = {
+        'VERSION_CHECK_INTERVAL': 1.0,   # Seconds between version checks against the cache backend
+        'MAX_DELTA_DEVICES': 500,        # Larger deltas are answered with the full list
+    }
+    defaults.update(getattr(settings, 'DEVICE_STATE_CACHE_SETTINGS', {}))
+    return defaults
+
+
+def version_name(home):
+    return f'device_state:{home}'
+
+
+class HomeSnapshot:
+    __slots__ = ('entries', 'encoded', 'version', 'cursor', 'fragment', 'online', 'max_seq', 'seq_sum')
+
+    def __init__(self, version, cursor=0):
+        self.entries = {}    # device_id -> entry dict
+        self.encoded = {}    # device_id -> JSON text of the entry
+        self.version = version
+        self.cursor = cursor  # change sequence value when loaded from the database
+        self.fragment = None
+        self.online = 0
+        self.max_seq = 0
+        self.seq_sum = 0
+
+    def put(self, entry):
+        previous = self.entries.get(entry['device_id'])
+        if previous is not None:
+            self.seq_sum -= previous['change_seq']
+        self.seq_sum += entry['change_seq']
+        self.max_seq = max(self.max_seq, entry['change_seq'])
+        self.entries[entry['device_id']] = entry
+        self.encoded[entry['device_id']] = encoder.encode(entry)
+        self.fragment = None
+
+    def remove(self, device_id):
+        previous = self.entries.pop(device_id, None)
+        if previous is not None:
+            self.seq_sum -= previous['change_seq']
+        self.encoded.pop(device_id, None)
+        self.fragment = None
+
+    def render(self):
+        if self.fragment is None:
+            self.fragment = ','.join(self.encoded.values())
+            self.online = sum(1 for entry in self.entries.values() if entry['is_online'])
+        return self.fragment
+
+
+class DeviceStateCache:
+    """Per-home device snapshots kept current by write-through and version checks"""
+
+    def __init__(self, check_interval=None):
+        config = get_state_cache_settings()
+        self.check_interval = config['VERSION_CHECK_INTERVAL'] if check_interval is None else check_interval
+        self.max_delta = config['MAX_DELTA_DEVICES']
+        self._homes = None        # home key -> HomeSnapshot, None until first load
+        self._homes_version = None
+        self._home_of = {}        # device_id -> home key
+        self._registered = {}     # registered Device pk -> home key
+        self._cursor = 0          # change sequence value at the last full load
+        self._checked_at = 0.0
+        self._lock = threading.RLock()
+        self.counters = {
+            'reads': 0, 'not_modified': 0, 'deltas': 0, 'delta_queries': 0,
+            'full_loads': 0, 'home_loads': 0, 'writes': 0,
+        }
+
+    # Reads
+
+    def etag(self, home=None):
+        """Weak ETag of one home's or all devices' state; changes whenever any change_seq does"""
+        with self._lock:
+            self._refresh()
+            snapshots = self._snapshots(home)
+            count = sum(len(snapshot.entries) for snapshot in snapshots)
+            max_seq = max((snapshot.max_seq for snapshot in snapshots), default=0)
+            seq_sum = sum(snapshot.seq_sum for snapshot in snapshots)
+        return f'W/"{count}-{max_seq}-{seq_sum}"'
+
+    def not_modified(self):
+        with self._lock:
+            self.counters['not_modified'] += 1
+
+    def summary(self, home=None):
+        """Device counts and cursor without rendering a body"""
+        with self._lock:
+            self._refresh()
+            return self._summary(self._snapshots(home))
+
+    def render(self, home=None):
+        """JSON body listing one home's devices, or every device when ``home`` is None"""
+        with self._lock:
+            self._refresh()
+            self.counters['reads'] += 1
+            snapshots = self._snapshots(home)
+            fragments = [snapshot.render() for snapshot in snapshots]
+            summary = self._summary(snapshots)
+        return (
+            '{"devices":[' + ','.join(fragment for fragment in fragments if fragment) + ']'
+            + f',"total_devices":{summary["total_devices"]},"online_devices":{summary["online_devices"]}'
+            + f',"cursor":{summary["cursor"]}}}'
+        )
+
+    def render_delta(self, since, home=None):
+        """JSON body listing only devices changed after cursor ``since``, or the full body if too many did"""
+        with self._lock:
+            self._refresh()
+            self.counters['deltas'] += 1
+            snapshots = self._snapshots(home)
+            summary = self._summary(snapshots)
+            newest = max((snapshot.max_seq for snapshot in snapshots), default=0)
+        if since >= newest:
+            # Nothing cached is newer; anything committed since is picked up on a later poll
+            rows = []
+        else:
+            rows = self._changed_since(since, home)
+            if rows is None:
+                return self.render(home)
+        cursor = max([since] + [row['change_seq'] for row in rows])
+        return (
+            '{"devices":[' + ','.join(encoder.encode(row) for row in rows) + ']'
+            + f',"total_devices":{summary["total_devices"]},"online_devices":{summary["online_devices"]}'
+            + f',"cursor":{cursor},"since":{since}}}'
+        )
+
+    def devices(self, home=None):
+        """Entry dicts for one home or all devices"""
+        with self._lock:
+            self._refresh()
+            return [dict(entry) for snapshot in self._snapshots(home) for entry in snapshot.entries.values()]
+
+    # Writes
+
+    def saved(self, devices, membership_changed=False):
+        """Refresh entries from saved DeviceStatus rows; pass ``membership_changed`` for new or re-homed rows"""
+        devices = list(devices)
+        if not devices:
+            return
+        homes = self._homes_for_registered({device.registered_device_id for device in devices})
+        with self._lock:
+            touched = set()
+            for device in devices:
+                home = homes.get(device.registered_device_id, UNASSIGNED)
+                previous = self._home_of.get(device.device_id)
+                if previous is not None and previous != home:
+                    membership_changed = True
+                    if self._homes is not None and previous in self._homes:
+                        self._homes[previous].remove(device.device_id)
+                    touched.add(previous)
+                self._home_of[device.device_id] = home
+                touched.add(home)
+                if self._homes is None:
+                    continue
+                if home not in self._homes:
+                    # First device of a home this process has not loaded; reload it on the next read
+                    self._homes[home] = HomeSnapshot(None)
+                    membership_changed = True
+                self._homes[home].put(entry_from(device))
+            self._published(touched, membership_changed)
+
+    def patched(self, changes):
+        """Apply ``{device_id: {field: value}}`` updates, e.g. heartbeats"""
+        if not changes:
+            return
+        homes = self._homes_for_devices(changes)
+        with self._lock:
+            touched = set()
+            for device_id, fields in changes.items():
+                home = homes.get(device_id)
+                if home is None:
+                    continue
+                touched.add(home)
+                snapshot = self._homes.get(home) if self._homes is not None else None
+                entry = snapshot.entries.get(device_id) if snapshot else None
+                if entry is not None:
+                    snapshot.put({**entry, **fields})
+            self._published(touched, False)
+
+    def deleted(self, device_ids):
+        with self._lock:
+            touched = set()
+            for device_id in device_ids:
+                home = self._home_of.pop(device_id, None)
+                if home is not None and self._homes is not None and home in self._homes:
+                    self._homes[home].remove(device_id)
+                touched.add(home if home is not None else UNASSIGNED)
+            self._published(touched, True)
+
+    def rehomed(self, registered_id, home):
+        """A registered device may have moved to another home"""
+        with self._lock:
+            previous = self._registered.get(registered_id)
+            self._registered[registered_id] = home
+            if previous is None or previous == home:
+                return
+            self.invalidate()
+            versions.bump(HOMES_VERSION)
+
+    def invalidate(self):
+        """Drop everything; the next read reloads from the database"""
+        with self._lock:
+            self._homes = None
+            self._home_of.clear()
+            self._registered.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['homes'] = len(self._homes or {})
+            stats['devices'] = sum(len(snapshot.entries) for snapshot in (self._homes or {}).values())
+        return stats
+
+    # Internals
+
+    def _snapshots(self, home):
+        if home is None:
+            return list(self._homes.values())
+        return [self._homes[home]] if home in self._homes else []
+
+    def _summary(self, snapshots):
+        for snapshot in snapshots:
+            snapshot.render()
+        return {
+            'total_devices': sum(len(snapshot.entries) for snapshot in snapshots),
+            'online_devices': sum(snapshot.online for snapshot in snapshots),
+            'cursor': min((snapshot.cursor for snapshot in snapshots), default=self._cursor),
+        }
+
+    def _changed_since(self, since, home):
+        """Rows changed after ``since``, oldest first; None when there are more than ``max_delta``"""
+        from .models import DeviceStatus
+
+        rows = DeviceStatus.objects.filter(change_seq__gt=since)
+        if home == UNASSIGNED:
+            rows = rows.filter(registered_device__isnull=True)
+        elif home is not None:
+            rows = rows.filter(registered_device__home_id=home)
+        rows = list(rows.order_by('change_seq').values(*FIELDS)[:self.max_delta + 1])
+        with self._lock:
+            self.counters['delta_queries'] += 1
+        return rows if len(rows) <= self.max_delta else None
+
+    def _published(self, homes, membership_changed):
+        """Bump the versions of changed homes, keeping ours current if nobody else wrote in between"""
+        self.counters['writes'] += 1
+        for home in homes:
+            version = versions.bump(version_name(home))
+            snapshot = self._homes.get(home) if self._homes is not None else None
+            if snapshot is not None and snapshot.version == version - 1:
+                snapshot.version = version
+            elif snapshot is not None:
+                snapshot.version = None
+        if membership_changed:
+            version = versions.bump(HOMES_VERSION)
+            if self._homes_version == version - 1:
+                self._homes_version = version
+            else:
+                self._homes_version = None
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._homes is not None and now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        if self._homes is None:
+            self._load_all()
+            return
+        names = [HOMES_VERSION] + [version_name(home) for home in self._homes]
+        current = versions.get_many(names)
+        if current[HOMES_VERSION] != self._homes_version:
+            self._load_all()
+            return
+        for home, snapshot in self._homes.items():
+            if current[version_name(home)] != snapshot.version:
+                self._load_home(home, current[version_name(home)])
+
+    def _load_all(self):
+        from .models import DEVICE_CHANGE_SEQUENCE, DeviceStatus
+
+        homes_version = versions.get(HOMES_VERSION)
+        # Read before the rows: every change up to this value is committed and so in them
+        cursor = current_value(DEVICE_CHANGE_SEQUENCE)
+        rows = list(DeviceStatus.objects.values(*FIELDS, 'registered_device_id', 'registered_device__home_id'))
+        keys = {row['registered_device__home_id'] or UNASSIGNED for row in rows}
+        current = versions.get_many([version_name(home) for home in keys])
+        self._homes = {home: HomeSnapshot(current[version_name(home)], cursor) for home in keys}
+        self._home_of.clear()
+        for row in rows:
+            home = row.pop('registered_device__home_id') or UNASSIGNED
+            registered = row.pop('registered_device_id')
+            if registered is not None:
+                self._registered[registered] = home
+            self._home_of[row['device_id']] = home
+            self._homes[home].put(row)
+        self._homes_version = homes_version
+        self._cursor = cursor
+        self.counters['full_loads'] += 1
+
+    def _load_home(self, home, version):
+        from .models import DEVICE_CHANGE_SEQUENCE, DeviceStatus
+
+        cursor = current_value(DEVICE_CHANGE_SEQUENCE)
+        rows = DeviceStatus.objects.all()
+        if home == UNASSIGNED:
+            rows = rows.filter(registered_device__isnull=True)
+        else:
+            rows = rows.filter(registered_device__home_id=home)
+        snapshot = HomeSnapshot(version, cursor)
+        for row in rows.values(*FIELDS):
+            self._home_of[row['device_id']] = home
+            snapshot.put(row)
+        self._homes[home] = snapshot
+        self.counters['home_loads'] += 1
+
+    def _homes_for_registered(self, registered_ids):
+        from devices.models import Device
+
+        registered_ids.discard(None)
+        missing = [pk for pk in registered_ids if pk not in self._registered]
+        if missing:
+            found = dict(Device.objects.filter(pk__in=missing).values_list('pk', 'home_id'))
+            with self._lock:
+                self._registered.update(found)
+        return {pk: self._registered.get(pk, UNASSIGNED) for pk in registered_ids}
+
+    def _homes_for_devices(self, device_ids):
+        from .models import DeviceStatus
+
+        missing = [device_id for device_id in device_ids if device_id not in self._home_of]
+        if missing:
+            found = DeviceStatus.objects.filter(device_id__in=missing).values_list(
+                'device_id', 'registered_device__home_id'
+            )
+            with self._lock:
+                for device_id, home in found:
+                    self._home_of[device_id] = home or UNASSIGNED
+        return {device_id: self._home_of.get(device_id) for device_id in device_ids}
+
+
+def entry_from(device):
+    return {field: getattr(device, field) for field in FIELDS}
+
+
+state_cache = DeviceStateCache()
@@ -0,0 +1,178 @@
+"""Append-only device state log with periodic snapshots.
+
+Every writer of ``DeviceStatus.current_state`` or ``is_online`` (the action
+executor, single-row saves, the heartbeat flusher and the offline sweep)
+records a DeviceStateEvent in the same transaction. An event holds only
+what changed: the state keys set or removed and the new ``is_online``.
+A device's first event holds its whole state and is marked ``reset``, so
+devices that predate the log need no backfill. Events are numbered per
+device_id by ``DeviceStatus.state_version``, and every
+``SNAPSHOT_EVERY``-th event also writes a DeviceStateSnapshot of the full
+state. A DeviceStatus deleted and created again under the same device_id
+continues numbering after the highest logged version (see
+``logged_versions``), so its history stays one contiguous sequence.
+
+Retention (see core/retention.py) keeps each device's newest snapshot
+older than the window and every event after it, so replay from the
+oldest retained point still starts at a full state.
+
+``state_at`` rebuilds a device's state at any time from the nearest
+snapshot at or before it plus at most ``SNAPSHOT_EVERY - 1`` events, so the
+cost does not grow with the length of the history. DeviceStatus stays the
+materialized current state that everything else reads.
+"""
+from collections import namedtuple
+
+from django.conf import settings
+from django.db.models import Max, OuterRef, Subquery
+from django.utils import timezone
+
+from .models import DeviceStateEvent, DeviceStateSnapshot
+
+# ``state``/``is_online`` are the device's values after the change, for snapshots
+StateChange = namedtuple('StateChange', ['device_id', 'version', 'action', 'changes', 'state', 'is_online'])
+
+
+def get_state_log_settings():
+    """Device state log settings merged over the defaults"""
+    defaults = {
+        'SNAPSHOT_EVERY': 50,   # Events per device between full-state snapshots
+    }
+    defaults.update(getattr(settings, 'DEVICE_STATE_LOG_SETTINGS', {}))
+    return defaults
+
+
+def logged_versions(device_ids):
+    """Highest logged event version per device_id, for devices that have any"""
+    return dict(
+        DeviceStateEvent.objects.filter(device_id__in=list(device_ids))
+        .values('device_id').annotate(version=Max('version')).values_list('device_id', 'version')
+    )
+
+
+def state_change(device_id, version, action, before, after):
+    """StateChange from ``before`` to ``after`` (``(state, is_online)`` pairs), or None if nothing changed.
+
+    ``before`` is None for a device's first event, which records everything
+    and resets the state so replay needs nothing earlier.
+    """
+    changes = {}
+    if before is None:
+        changes['reset'] = True
+        before = ({}, None)
+    (old_state, old_online), (state, is_online) = before, after
+    updated = {key: value for key, value in state.items() if key not in old_state or old_state[key] != value}
+    if updated:
+        changes['state'] = updated
+    removed = [key for key in old_state if key not in state]
+    if removed:
+        changes['removed'] = removed
+    if is_online != old_online:
+        changes['is_online'] = is_online
+    if not changes:
+        return None
+    return StateChange(device_id, version, action, changes, state, is_online)
+
+
+def is_first_change(previous):
+    """Whether a write to a device with these stored values starts its log"""
+    return previous is None or previous['state_version'] == 0
+
+
+def device_change(device, action, previous, logged=0):
+    """Log entry for a DeviceStatus about to be written; bumps ``device.state_version`` if it changed.
+
+    ``previous`` holds the stored ``current_state``, ``is_online`` and
+    ``state_version``, or is None for a new device. For a first change
+    ``logged`` is the device_id's highest logged version (see
+    ``logged_versions``), non-zero when the DeviceStatus was recreated.
+    """
+    if is_first_change(previous):
+        version, before = logged + 1, None
+    else:
+        version = previous['state_version'] + 1
+        before = (previous['current_state'], previous['is_online'])
+    change = state_change(device.device_id, version, action, before, (device.current_state, device.is_online))
+    if change is not None:
+        device.state_version = version
+    return change
+
+
+def record_changes(changes, change_seq, timestamp=None):
+    """Append events, and snapshots where due; call inside the transaction writing the devices"""
+    changes = list(changes)
+    if not changes:
+        return
+    timestamp = timezone.now() if timestamp is None else timestamp
+    every = get_state_log_settings()['SNAPSHOT_EVERY']
+    DeviceStateEvent.objects.bulk_create([
+        DeviceStateEvent(device_id=change.device_id, version=change.version, change_seq=change_seq,
+                         action=change.action, changes=change.changes, timestamp=timestamp)
+        for change in changes
+    ])
+    snapshots = [
+        DeviceStateSnapshot(device_id=change.device_id, version=change.version, state=change.state,
+                            is_online=change.is_online, timestamp=timestamp)
+        for change in changes if change.version % every == 0
+    ]
+    if snapshots:
+        DeviceStateSnapshot.objects.bulk_create(snapshots)
+
+
+def _last_snapshot_before(cutoff):
+    return Subquery(
+        DeviceStateSnapshot.objects.filter(device_id=OuterRef('device_id'), timestamp__lt=cutoff)
+        .order_by('-version').values('version')[:1]
+    )
+
+
+def expired_events(queryset, cutoff):
+    """Retention scope: old events already folded into a snapshot older than ``cutoff``"""
+    return queryset.filter(version__lte=_last_snapshot_before(cutoff))
+
+
+def expired_snapshots(queryset, cutoff):
+    """Retention scope: old snapshots superseded by a newer one older than ``cutoff``"""
+    return queryset.filter(version__lt=_last_snapshot_before(cutoff))
+
+
+def fold(state, is_online, changes):
+    """Apply one event's ``changes`` to ``(state, is_online)``"""
+    if changes.get('reset'):
+        state, is_online = {}, None
+    state = {**state, **changes.get('state', {})}
+    for key in changes.get('removed', ()):
+        state.pop(key, None)
+    return state, changes.get('is_online', is_online)
+
+
+def state_at(device_id, when=None):
+    """Device state as of ``when`` (default: now) rebuilt from the log, or None before its first event"""
+    events = DeviceStateEvent.objects.filter(device_id=device_id)
+    if when is not None:
+        # Seek by version, not timestamp, so replay always covers a contiguous prefix
+        events = events.filter(timestamp__lte=when)
+    target = events.aggregate(version=Max('version'))['version']
+    if target is None:
+        return None
+
+    snapshot = (DeviceStateSnapshot.objects.filter(device_id=device_id, version__lte=target)
+                .order_by('-version').first())
+    if snapshot is not None:
+        state, is_online, version, timestamp = snapshot.state, snapshot.is_online, snapshot.version, snapshot.timestamp
+    else:
+        state, is_online, version, timestamp = {}, None, 0, None
+    tail = list(DeviceStateEvent.objects.filter(device_id=device_id, version__gt=version, version__lte=target)
+                .order_by('version').values('changes', 'version', 'timestamp'))
+    for event in tail:
+        state, is_online = fold(state, is_online, event['changes'])
+        version, timestamp = event['version'], event['timestamp']
+    return {
+        'device_id': device_id,
+        'state': state,
+        'is_online': is_online,
+        'version': version,
+        'timestamp': timestamp,
+        'snapshot_version': snapshot.version if snapshot is not None else None,
+        'replayed_events': len(tail),
+    }
@@ -0,0 +1,194 @@
+"""Alert threshold engine compiled from active SafetyProtocol trigger conditions.
+
+``SafetyProtocol.trigger_conditions`` holds one condition or a list of them
+under ``"conditions"``::
+
+    {"sensor_type": "gas", "operator": ">", "threshold": 50, "location": "kitchen"}
+
+``sensor_type`` defaults from the protocol type (gas_leak -> gas, ...),
+``operator`` defaults to ``>`` and a blank ``location`` matches anywhere.
+Conditions are compiled into a dict keyed by (sensor_type, location) so a
+reading is checked with one or two dict lookups and no database access.
+The compiled table is rebuilt when the ``safety_protocols`` version changes.
+"""
+import logging
+import operator
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+from django.db import transaction
+
+from core import versions
+
+logger = logging.getLogger(__name__)
+
+VERSION_NAME = 'safety_protocols'
+
+# Seconds between checks of the shared version counter
+VERSION_CHECK_INTERVAL = 1.0
+
+# Thresholds used for sensor types no active protocol covers
+DEFAULT_THRESHOLDS = {
+    'gas': 50,    # Gas concentration threshold
+    'fire': 80,   # Fire detection threshold
+    'smoke': 30,  # Smoke threshold
+}
+
+PROTOCOL_SENSOR_TYPES = {
+    'gas_leak': ['gas'],
+    'fire_detection': ['fire'],
+    'smoke_detection': ['smoke'],
+    'water_leak': ['water'],
+    'intrusion': ['motion', 'door', 'window'],
+}
+
+OPERATORS = {
+    '>': (operator.gt, np.greater),
+    '>=': (operator.ge, np.greater_equal),
+    '<': (operator.lt, np.less),
+    '<=': (operator.le, np.less_equal),
+    '==': (operator.eq, np.equal),
+}
+
+# One compiled condition; protocol_id is None for the built-in defaults
+Rule = namedtuple('Rule', ['op', 'threshold', 'priority', 'protocol_id', 'protocol_type', 'name'])
+
+
+def _conditions(protocol):
+    conditions = protocol.trigger_conditions or {}
+    if isinstance(conditions, dict) and 'conditions' in conditions:
+        conditions = conditions['conditions']
+    if isinstance(conditions, dict):
+        conditions = [conditions]
+    return [condition for condition in conditions if isinstance(condition, dict)]
+
+
+def compile_protocols(protocols):
+    """Build the (sensor_type, location) -> rules table from protocol rows"""
+    specific = {}
+    wildcard = {}
+    covered = set()
+
+    for protocol in protocols:
+        for condition in _conditions(protocol):
+            if 'threshold' not in condition:
+                continue
+            op = condition.get('operator', '>')
+            if op not in OPERATORS:
+                logger.warning('Safety protocol %s: skipping condition with unknown operator %r', protocol.id, op)
+                continue
+            try:
+                threshold = float(condition['threshold'])
+            except (TypeError, ValueError):
+                logger.warning('Safety protocol %s: skipping condition with non-numeric threshold %r',
+                               protocol.id, condition['threshold'])
+                continue
+            location = condition.get('location') or ''
+            if not isinstance(condition.get('sensor_type') or '', str) or not isinstance(location, str):
+                logger.warning('Safety protocol %s: skipping condition whose sensor_type or location is not a string',
+                               protocol.id)
+                continue
+            sensor_types = ([condition['sensor_type']] if condition.get('sensor_type')
+                            else PROTOCOL_SENSOR_TYPES.get(protocol.protocol_type, []))
+            rule = Rule(op, threshold, protocol.priority,
+                        protocol.id, protocol.protocol_type, protocol.name)
+            for sensor_type in sensor_types:
+                covered.add(sensor_type)
+                target = specific.setdefault((sensor_type, location), []) if location \
+                    else wildcard.setdefault(sensor_type, [])
+                target.append(rule)
+
+    for sensor_type, threshold in DEFAULT_THRESHOLDS.items():
+        if sensor_type not in covered:
+            wildcard[sensor_type] = [Rule('>', float(threshold), 1, None, None, f'Default {sensor_type} threshold')]
+
+    # Location-specific keys also carry the wildcard rules, so evaluation is
+    # a single lookup with a single fallback
+    table = {(sensor_type, ''): rules for sensor_type, rules in wildcard.items()}
+    for (sensor_type, location), rules in specific.items():
+        table[(sensor_type, location)] = rules + wildcard.get(sensor_type, [])
+    return {key: tuple(sorted(rules, key=lambda rule: rule.priority)) for key, rules in table.items()}
+
+
+class ThresholdEngine:
+    """Versioned, lazily compiled threshold table"""
+
+    def __init__(self):
+        self._table = None
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """Force a recompile on next use (called from protocol change signals)"""
+        self._table = None
+
+    def fresh(self):
+        """Whether ``table()`` would return without touching the version counter or the database"""
+        return self._table is not None and time.monotonic() - self._checked_at < VERSION_CHECK_INTERVAL
+
+    def table(self):
+        now = time.monotonic()
+        if self._table is not None and now - self._checked_at < VERSION_CHECK_INTERVAL:
+            return self._table
+        with self._lock:
+            version = versions.get(VERSION_NAME)
+            if self._table is None or version != self._version:
+                from .models import SafetyProtocol
+                self._table = compile_protocols(SafetyProtocol.objects.filter(is_active=True))
+                self._version = version
+            self._checked_at = now
+            return self._table
+
+    def rules_for(self, sensor_type, location=''):
+        table = self.table()
+        return table.get((sensor_type, location or '')) or table.get((sensor_type, ''), ())
+
+    def match(self, sensor_type, value, location=''):
+        """Highest-priority rule the reading trips, or None"""
+        for rule in self.rules_for(sensor_type, location):
+            if OPERATORS[rule.op][0](value, rule.threshold):
+                return rule
+        return None
+
+    def match_many(self, sensor_types, values, locations):
+        """Vectorised ``match`` for a batch; returns a list of rules or None per reading"""
+        values = np.asarray(values, dtype=float)
+        matches = [None] * len(values)
+        groups = {}
+        for index, key in enumerate(zip(sensor_types, locations)):
+            groups.setdefault(key, []).append(index)
+
+        for (sensor_type, location), indexes in groups.items():
+            rules = self.rules_for(sensor_type, location)
+            if not rules:
+                continue
+            indexes = np.asarray(indexes)
+            pending = np.ones(len(indexes), dtype=bool)
+            group_values = values[indexes]
+            for rule in rules:
+                hit = pending & OPERATORS[rule.op][1](group_values, rule.threshold)
+                for index in indexes[hit]:
+                    matches[index] = rule
+                pending &= ~hit
+                if not pending.any():
+                    break
+        return matches
+
+
+engine = ThresholdEngine()
+
+
+def protocols_changed():
+    """Invalidate compiled thresholds here and, via the shared version, elsewhere.
+
+    Deferred until the change commits; a reload before that would compile
+    the old protocols under the new version and keep them.
+    """
+    def invalidate():
+        engine.invalidate()
+        versions.bump(VERSION_NAME)
+
+    transaction.on_commit(invalidate)
@@ -14,6 +14,19 @@ urlpatterns = [
     path('api/voice-command/', views.process_voice_command, name='api_voice_command'),
     path('api/gesture-command/', views.process_gesture_command, name='api_gesture_command'),
     path('api/sensor-data/', views.sensor_data_webhook, name='api_sensor_data'),
+    path('api/sensor-data/batch/', views.sensor_data_batch, name='api_sensor_data_batch'),
+    path('api/sensor-data/binary/', views.sensor_data_binary, name='api_sensor_data_binary'),
+    path('api/sensor-series/', views.sensor_series, name='api_sensor_series'),
+    path('api/anomaly-scan/', views.anomaly_scan, name='api_anomaly_scan'),
+    path('api/anomaly-findings/', views.anomaly_findings, name='api_anomaly_findings'),
+    path('api/rules/backtest/', views.backtest_rule, name='api_rule_backtest'),
+    path('api/heartbeat/', views.device_heartbeat, name='api_device_heartbeat'),
     path('api/device-status/', views.device_status_api, name='api_device_status'),
+    path('api/device-status/<str:device_id>/history/', views.device_state_history, name='api_device_state_history'),
     path('api/control-device/', views.control_device, name='api_control_device'),
+    path('api/commands/<int:seq>/', views.device_command_status, name='api_device_command'),
+    
+    # Streaming exports
+    path('export/sensor-readings/', views.export_sensor_readings, name='export_sensor_readings'),
+    path('export/logs/', views.export_automation_logs, name='export_logs'),
 ]
@@ -1,14 +1,35 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.http import require_GET
+from django.db.models import Q
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
+from core.exports import filter_queryset, streaming_export
+from . import backtest, rollups, scan, state_log
+from devices.auth import authenticate_request
+from .dispatch import dispatcher
+from .command_queue import command_queue
+from .executor import DeviceAction, apply_device_actions
+from .heartbeat import tracker as heartbeat_tracker
+from .state_cache import state_cache
+from .rules import rule_index
 from .models import (
     AutomationRule, SensorReading, VoiceCommand, GestureCommand,
-    SafetyProtocol, AutomationLog, DeviceStatus
+    SafetyProtocol, AutomationLog, DeviceStatus, AnomalyFinding
 )
+from .ingest import (
+    MAX_BATCH_SIZE, alert_tracker, classify_reading, ingest_batch, parse_batch,
+    store_reading, validate_reading
+)
+from .wire import decode_readings
 import json
+import time
 from datetime import datetime, timedelta
 
 @login_required
@@ -60,12 +81,19 @@ def safety_monitoring(request):
     gas_sensors = SensorReading.objects.filter(sensor_type='gas')[:5]
     fire_sensors = SensorReading.objects.filter(sensor_type='fire')[:5]
     
+    # Hourly history for the last day, served from rollups instead of raw rows
+    now = timezone.now()
+    _, gas_history = rollups.series('gas', now - timedelta(days=1), now, 3600)
+    _, smoke_history = rollups.series('smoke', now - timedelta(days=1), now, 3600)
+    
     context = {
         'title': 'Safety Monitoring',
         'active_protocols': active_protocols,
         'recent_alerts': recent_alerts,
         'gas_sensors': gas_sensors,
         'fire_sensors': fire_sensors,
+        'gas_history': gas_history,
+        'smoke_history': smoke_history,
     }
     return render(request, 'automation/safety_monitoring.html', context)
 
@@ -132,12 +160,16 @@ def process_voice_command(request):
         metadata={'confidence': confidence, 'action': interpreted_action}
     )
     
+    # User's voice-triggered automation rules
+    fired = rule_index.process_event('voice', interpreted_action, user=request.user, text=command_text)
+    
     return Response({
         'success': True,
         'interpreted_action': interpreted_action,
         'target_device': target_device,
         'confidence': confidence,
         'executed': confidence > 0.7,
+        'rules_triggered': len(fired),
         'response': f"Command '{interpreted_action}' executed on {target_device}" if confidence > 0.7 else "Command not recognized"
     })
 
@@ -189,167 +221,367 @@ def process_gesture_command(request):
         metadata={'confidence': confidence, 'action': interpreted_action}
     )
     
+    # User's gesture-triggered automation rules
+    fired = rule_index.process_event('gesture', gesture_type, user=request.user)
+    
     return Response({
         'success': True,
         'interpreted_action': interpreted_action,
         'target_device': target_device,
         'confidence': confidence,
-        'executed': confidence > 0.7
+        'executed': confidence > 0.7,
+        'rules_triggered': len(fired),
     })
 
 @api_view(['POST'])
 def sensor_data_webhook(request):
     """Webhook for receiving sensor data from IoT devices"""
-    device_id = request.data.get('device_id')
-    sensor_type = request.data.get('sensor_type')
-    value = request.data.get('value')
-    unit = request.data.get('unit', '')
-    location = request.data.get('location', '')
-    
-    if not all([device_id, sensor_type, value is not None]):
-        return Response({'error': 'Missing required fields'}, status=400)
-    
-    # Determine if this is an alert condition
-    is_alert = False
-    if sensor_type == 'gas' and float(value) > 50:  # Gas concentration threshold
-        is_alert = True
-    elif sensor_type == 'fire' and float(value) > 80:  # Fire detection threshold
-        is_alert = True
-    elif sensor_type == 'smoke' and float(value) > 30:  # Smoke threshold
-        is_alert = True
-    
-    # Create sensor reading
-    reading = SensorReading.objects.create(
-        device_id=device_id,
-        sensor_type=sensor_type,
-        value=float(value),
-        unit=unit,
-        location=location,
-        is_alert=is_alert
-    )
+    received_at = time.monotonic()
+    cleaned, errors = validate_reading(request.data)
+    if errors:
+        return Response({'error': errors[0], 'errors': errors}, status=400)
+    
+    # Determine if this is an alert condition, and whether it starts a new incident
+    is_alert, opens_incident = classify_reading(cleaned)
+    
+    # Create sensor reading (readings that don't open an incident may be queued for a bulk insert)
+    reading, queued = store_reading(cleaned, is_alert, urgent=opens_incident)
+    if reading is None:
+        return Response({'error': 'Ingestion buffer is full, retry later'}, status=503)
+    
+    # A new incident queues safety protocols ahead of lower-priority work;
+    # repeats of an open incident are only counted on it
+    if opens_incident:
+        alert_tracker.open_incident(reading)
+        dispatcher.submit(reading.sensor_type, reading.value, reading.location, received_at)
     
-    # If it's an alert, trigger safety protocols
-    if is_alert:
-        trigger_safety_protocol(sensor_type, float(value), location)
+    # Sensor-triggered automation rules (only indexed candidates are evaluated)
+    rule_index.process_reading(reading)
     
     return Response({
         'success': True,
         'reading_id': reading.id,
+        'queued': queued,
         'is_alert': is_alert,
+        'new_incident': opens_incident,
         'timestamp': reading.timestamp
     })
 
+@api_view(['POST'])
+def sensor_data_batch(request):
+    """Batch webhook accepting a JSON array or NDJSON stream of sensor readings"""
+    received_at = time.monotonic()
+    try:
+        items = parse_batch(request.body, request.content_type or '')
+    except (UnicodeDecodeError, ValueError) as e:
+        return Response({'error': f'Invalid batch payload: {e}'}, status=400)
+    
+    if not items:
+        return Response({'error': 'No readings provided'}, status=400)
+    if len(items) > MAX_BATCH_SIZE:
+        return Response({'error': f'Batch exceeds {MAX_BATCH_SIZE} readings'}, status=413)
+    
+    return batch_ingest_response(items, received_at)
+
+@api_view(['POST'])
+def sensor_data_binary(request):
+    """Batch webhook for the compact binary reading format used by constrained devices"""
+    received_at = time.monotonic()
+    try:
+        items = decode_readings(request.body)
+    except ValueError as e:
+        return Response({'error': f'Invalid binary payload: {e}'}, status=400)
+    
+    if not items:
+        return Response({'error': 'No readings provided'}, status=400)
+    if len(items) > MAX_BATCH_SIZE:
+        return Response({'error': f'Batch exceeds {MAX_BATCH_SIZE} readings'}, status=413)
+    
+    return batch_ingest_response(items, received_at)
+
+def batch_ingest_response(items, received_at=None):
+    """Ingest parsed batch items and build the per-item response"""
+    results, alerts = ingest_batch(items)
+    
+    # Queue safety protocols for each reading that opened an incident
+    for reading in alerts:
+        dispatcher.submit(reading.sensor_type, reading.value, reading.location, received_at)
+    
+    accepted = sum(1 for result in results if result['success'])
+    return Response({
+        'success': accepted == len(results),
+        'accepted': accepted,
+        'rejected': len(results) - accepted,
+        'alerts': len(alerts),
+        'results': results,
+    }, status=200 if accepted else 400)
+
+@api_view(['GET'])
+def sensor_series(request):
+    """Chart series for a sensor type from the coarsest rollup that fits the step"""
+    sensor_type = request.query_params.get('sensor_type')
+    if not sensor_type:
+        return Response({'error': 'sensor_type is required'}, status=400)
+    
+    end = parse_datetime(request.query_params.get('end', '')) or timezone.now()
+    start = parse_datetime(request.query_params.get('start', '')) or end - timedelta(days=1)
+    if start >= end:
+        return Response({'error': 'start must be before end'}, status=400)
+    
+    try:
+        points = int(request.query_params.get('points', 200))
+        step = float(request.query_params.get('step') or (end - start).total_seconds() / max(points, 1))
+    except ValueError:
+        return Response({'error': 'step and points must be numbers'}, status=400)
+    
+    resolution, series = rollups.series(
+        sensor_type, start, end, step, device_id=request.query_params.get('device_id')
+    )
+    return Response({
+        'sensor_type': sensor_type,
+        'device_id': request.query_params.get('device_id'),
+        'start': start,
+        'end': end,
+        'resolution': resolution,
+        'points': series,
+    })
+
+# Longest history an API-triggered scan may cover; use `manage.py scan_anomalies` beyond that
+MAX_API_SCAN_DAYS = 31
+
+@api_view(['POST'])
+def anomaly_scan(request):
+    """Scan one device or sensor type's history for anomalies and save the findings"""
+    if not request.user.is_authenticated:
+        return Response({'error': 'Authentication required'}, status=401)
+    
+    device_id = request.data.get('device_id')
+    sensor_type = request.data.get('sensor_type')
+    if not device_id and not sensor_type:
+        return Response({'error': 'device_id or sensor_type is required'}, status=400)
+    
+    end = parse_datetime(request.data.get('end') or '') or timezone.now()
+    start = parse_datetime(request.data.get('start') or '') or end - timedelta(days=7)
+    if start >= end:
+        return Response({'error': 'start must be before end'}, status=400)
+    if end - start > timedelta(days=MAX_API_SCAN_DAYS):
+        return Response({'error': f'Scans are limited to {MAX_API_SCAN_DAYS} days'}, status=400)
+    
+    options = {}
+    for name, cast in [('window', int), ('z_threshold', float), ('spike_mads', float), ('flatline_run', int)]:
+        if request.data.get(name) is not None:
+            try:
+                options[name] = cast(request.data[name])
+            except (TypeError, ValueError):
+                return Response({'error': f'{name} must be a number'}, status=400)
+    
+    summary = scan.scan(start, end, device_id=device_id, sensor_type=sensor_type, options=options)
+    return Response({'success': True, 'start': start, 'end': end, **summary})
+
+@api_view(['GET'])
+def anomaly_findings(request):
+    """List saved anomaly findings, newest first"""
+    if not request.user.is_authenticated:
+        return Response({'error': 'Authentication required'}, status=401)
+    
+    findings = AnomalyFinding.objects.all()
+    for name in ('scan_id', 'device_id', 'sensor_type', 'kind'):
+        value = request.query_params.get(name)
+        if value:
+            findings = findings.filter(**{name: value})
+    
+    try:
+        limit = min(int(request.query_params.get('limit') or 100), 1000)
+    except ValueError:
+        return Response({'error': 'limit must be a number'}, status=400)
+    fields = ['id', 'scan_id', 'device_id', 'sensor_type', 'kind', 'start', 'end',
+              'reading_count', 'peak_value', 'score']
+    return Response({'findings': list(findings.values(*fields)[:limit])})
+
+@api_view(['POST'])
+def backtest_rule(request):
+    """Replay a time range of history through a saved or draft rule"""
+    if not request.user.is_authenticated:
+        return Response({'error': 'Authentication required'}, status=401)
+    
+    if request.data.get('rule_id'):
+        rule = AutomationRule.objects.filter(id=request.data['rule_id'], user=request.user).first()
+        if rule is None:
+            return Response({'error': 'Rule not found'}, status=404)
+    elif isinstance(request.data.get('rule'), dict):
+        rule = backtest.build_rule(request.data['rule'], request.user)
+    else:
+        return Response({'error': 'rule_id or a rule definition is required'}, status=400)
+    
+    end = parse_datetime(request.data.get('end') or '') or timezone.now()
+    start = parse_datetime(request.data.get('start') or '') or end - timedelta(days=30)
+    if start >= end:
+        return Response({'error': 'start must be before end'}, status=400)
+    if end - start > timedelta(days=MAX_API_SCAN_DAYS * 3):
+        return Response({'error': f'Backtests are limited to {MAX_API_SCAN_DAYS * 3} days'}, status=400)
+    
+    try:
+        report = backtest.backtest(rule, start, end)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+    return Response({'success': True, 'rule': rule.name, **report})
+
 def trigger_safety_protocol(sensor_type, value, location):
     """Trigger appropriate safety protocol based on sensor reading"""
     if sensor_type == 'gas':
         # Gas leak detected - turn on exhaust fan
-        AutomationLog.objects.create(
-            log_type='safety_activated',
-            description=f"Gas leak detected ({value}) at {location}. Activating exhaust fan.",
-            device_id='exhaust_fan',
-            success=True,
-            metadata={'sensor_type': sensor_type, 'value': value, 'location': location}
-        )
-        
-        # Update device status
-        DeviceStatus.objects.update_or_create(
-            device_id='exhaust_fan',
-            defaults={
-                'device_name': 'Exhaust Fan',
-                'device_type': 'fan',
-                'is_online': True,
-                'current_state': {'status': 'on', 'speed': 'high', 'reason': 'gas_leak_detected'}
-            }
+        action = DeviceAction(
+            'exhaust_fan', 'set_value',
+            {'status': 'on', 'speed': 'high', 'reason': 'gas_leak_detected'},
+            defaults={'device_name': 'Exhaust Fan', 'device_type': 'fan', 'is_online': True},
+            log={
+                'log_type': 'safety_activated',
+                'description': f"Gas leak detected ({value}) at {location}. Activating exhaust fan.",
+                'metadata': {'sensor_type': sensor_type, 'value': value, 'location': location},
+            },
         )
-    
     elif sensor_type == 'fire':
         # Fire detected - activate water spray system
-        AutomationLog.objects.create(
-            log_type='safety_activated',
-            description=f"Fire detected ({value}) at {location}. Activating water spray system.",
-            device_id='water_spray_system',
-            success=True,
-            metadata={'sensor_type': sensor_type, 'value': value, 'location': location}
-        )
-        
-        # Update device status
-        DeviceStatus.objects.update_or_create(
-            device_id='water_spray_system',
-            defaults={
-                'device_name': 'Water Spray System',
-                'device_type': 'safety',
-                'is_online': True,
-                'current_state': {'status': 'active', 'reason': 'fire_detected'}
-            }
+        action = DeviceAction(
+            'water_spray_system', 'set_value',
+            {'status': 'active', 'reason': 'fire_detected'},
+            defaults={'device_name': 'Water Spray System', 'device_type': 'safety', 'is_online': True},
+            log={
+                'log_type': 'safety_activated',
+                'description': f"Fire detected ({value}) at {location}. Activating water spray system.",
+                'metadata': {'sensor_type': sensor_type, 'value': value, 'location': location},
+            },
         )
+    else:
+        return
+    apply_device_actions([action])
 
-@api_view(['GET'])
-def device_status_api(request):
-    """Get current status of all devices"""
-    devices = DeviceStatus.objects.all()
-    
-    device_data = []
-    for device in devices:
-        device_data.append({
-            'device_id': device.device_id,
-            'device_name': device.device_name,
-            'device_type': device.device_type,
-            'is_online': device.is_online,
-            'current_state': device.current_state,
-            'location': device.location,
-            'last_seen': device.last_seen
-        })
+@api_view(['POST'])
+def device_heartbeat(request):
+    """Liveness ping from a device, or from a gateway for the devices behind it"""
+    identity = authenticate_request(request)
+    if identity is None:
+        return Response({'error': 'A valid device key is required (X-Device-Key header)'}, status=401)
+    
+    if identity.device_id:
+        # Keys bound to a device may only report for that device
+        if request.data.get('device_id') not in (None, '', identity.device_id):
+            return Response({'error': 'This key is bound to a different device'}, status=403)
+        device_ids = [identity.device_id]
+    else:
+        device_ids = request.data.get('device_ids') or [request.data.get('device_id')]
+        if not isinstance(device_ids, list) or not all(isinstance(device_id, str) and device_id for device_id in device_ids):
+            return Response({'error': 'device_id or a list of device_ids is required'}, status=400)
     
+    # Recorded in memory; last_seen is written in bulk by the heartbeat flusher
+    heartbeat_tracker.beat_many(device_ids)
     return Response({
-        'devices': device_data,
-        'total_devices': len(device_data),
-        'online_devices': sum(1 for d in device_data if d['is_online'])
+        'success': True,
+        'devices': len(device_ids),
+        'offline_after': heartbeat_tracker.offline_after,
     })
 
+@api_view(['GET'])
+def device_status_api(request):
+    """Get current status of all devices, or of one home's with ?home=<id>
+
+    ?since=<cursor> returns only devices changed after a previous response's
+    cursor, and a matching If-None-Match is answered 304 without a body.
+    """
+    home = request.query_params.get('home')
+    since = request.query_params.get('since')
+    try:
+        home = int(home) if home is not None else None
+        since = int(since) if since is not None else None
+    except ValueError:
+        return Response({'error': 'home must be a home id and since a cursor'}, status=400)
+    
+    # Pre-serialized by the write-through state cache; no database access
+    etag = state_cache.etag(home)
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        state_cache.not_modified()
+    elif since is not None:
+        response = HttpResponse(state_cache.render_delta(since, home), content_type='application/json')
+    else:
+        response = HttpResponse(state_cache.render(home), content_type='application/json')
+    response['ETag'] = etag
+    patch_cache_control(response, no_cache=True)
+    return response
+
+@api_view(['GET'])
+def device_state_history(request, device_id):
+    """State of one device now, or at ?at=<ISO datetime>, rebuilt from the state log"""
+    at = request.query_params.get('at')
+    when = None
+    if at:
+        when = parse_datetime(at)
+        if when is None:
+            return Response({'error': 'at must be an ISO 8601 datetime'}, status=400)
+        if timezone.is_naive(when):
+            when = timezone.make_aware(when)
+    
+    state = state_log.state_at(device_id, when)
+    if state is None:
+        return Response({'error': f'No recorded state for {device_id}' + (f' at {at}' if at else '')}, status=404)
+    return Response({'at': when or timezone.now(), **state})
+
 @api_view(['POST'])
 def control_device(request):
-    """Control a specific device"""
+    """Queue a command for a device; DeviceStatus changes once the device acknowledges it"""
     device_id = request.data.get('device_id')
     action = request.data.get('action')
     parameters = request.data.get('parameters', {})
     
     if not device_id or not action:
         return Response({'error': 'device_id and action are required'}, status=400)
+    if not isinstance(parameters, dict):
+        return Response({'error': 'parameters must be an object'}, status=400)
+    if not DeviceStatus.objects.filter(device_id=device_id).exists():
+        return Response({'error': 'Device not found'}, status=404)
     
     try:
-        device = DeviceStatus.objects.get(device_id=device_id)
-        
-        # Update device state based on action
-        new_state = device.current_state.copy()
-        
-        if action == 'turn_on':
-            new_state['status'] = 'on'
-        elif action == 'turn_off':
-            new_state['status'] = 'off'
-        elif action == 'toggle':
-            new_state['status'] = 'off' if new_state.get('status') == 'on' else 'on'
-        elif action == 'set_value':
-            new_state.update(parameters)
-        
-        device.current_state = new_state
-        device.save()
-        
-        # Log the action
-        AutomationLog.objects.create(
-            user=request.user if request.user.is_authenticated else None,
-            log_type='manual_action',
-            description=f"Device {device_id} action: {action}",
-            device_id=device_id,
-            success=True,
-            metadata={'action': action, 'parameters': parameters}
+        seq = command_queue.submit(
+            device_id, action, parameters, user_id=request.user.id if request.user.is_authenticated else None
         )
-        
-        return Response({
-            'success': True,
-            'device_id': device_id,
-            'new_state': new_state,
-            'message': f"Device {device_id} {action} executed successfully"
-        })
-        
-    except DeviceStatus.DoesNotExist:
-        return Response({'error': 'Device not found'}, status=404)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+    
+    return Response({
+        'success': True,
+        'device_id': device_id,
+        'command': seq,
+        'status': 'queued',
+        'status_url': reverse('automation:api_device_command', args=[seq]),
+        'message': f"Command {seq} ({action}) queued for device {device_id}"
+    }, status=202)
+
+@api_view(['GET'])
+def device_command_status(request, seq):
+    """Delivery status of a queued device command"""
+    status = command_queue.status(seq)
+    if status is None:
+        return Response({'error': f'Unknown command {seq}'}, status=404)
+    return Response(status)
+
+@login_required
+@require_GET
+def export_sensor_readings(request):
+    """Stream sensor readings as CSV or NDJSON"""
+    readings = filter_queryset(request, SensorReading.objects.all())
+    sensor_type = request.GET.get('sensor_type')
+    if sensor_type:
+        readings = readings.filter(sensor_type=sensor_type)
+    
+    fields = ['timestamp', 'device_id', 'sensor_type', 'value', 'unit', 'location', 'is_alert']
+    return streaming_export(request, readings, fields, 'sensor-readings')
+
+@login_required
+@require_GET
+def export_automation_logs(request):
+    """Stream the user's automation log (plus system entries) as CSV or NDJSON"""
+    logs = AutomationLog.objects.filter(Q(user=request.user) | Q(user__isnull=True))
+    logs = filter_queryset(request, logs)
+    
+    fields = ['timestamp', 'log_type', 'device_id', 'success', 'description', 'error_message', 'metadata']
+    return streaming_export(request, logs, fields, 'automation-log')
@@ -0,0 +1,291 @@
+"""Columnar archive of cold readings as memory-mappable per-device files.
+
+Each archived series (one device + sensor type, or one energy meter) is a
+set of append-only files kept sorted by time:
+
+    <ARCHIVE_ROOT>/<kind>/<device_id>/<series>.ts   int64 microseconds since epoch
+    <ARCHIVE_ROOT>/<kind>/<device_id>/<series>.val  float64 values
+    <ARCHIVE_ROOT>/<kind>/<device_id>/<series>.id   int64 source row pk (-1 if unknown)
+
+Queries memory-map both files and binary-search the timestamp column, so a
+range scan only touches the pages it needs and never hits the database.
+The id column lets archiving skip rows already stored, so copying the same
+rows again (a purge that died before deleting them) does not duplicate them.
+"""
+import logging
+import os
+import threading
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+from urllib.parse import quote, unquote
+
+import numpy as np
+from django.apps import apps
+from django.conf import settings
+
+TS_DTYPE = np.dtype('<i8')
+VALUE_DTYPE = np.dtype('<f8')
+ID_DTYPE = np.dtype('<i8')
+
+# Rows aggregated per step, bounding memory for long range scans
+SCAN_CHUNK = 1_000_000
+
+# How rows of each archivable model map onto archive series
+ARCHIVE_SPECS = {
+    'automation.SensorReading': {'kind': 'sensor', 'series_field': 'sensor_type', 'value_field': 'value'},
+    'energy.EnergyReading': {'kind': 'energy', 'series_field': None, 'value_field': 'power_consumption'},
+}
+
+_write_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+def archive_root():
+    return Path(getattr(settings, 'READING_ARCHIVE_ROOT', settings.BASE_DIR / 'archive'))
+
+
+def series_names(kind):
+    """Series names a kind of archive can hold: the sensor type codes, or 'power'"""
+    for label, spec in ARCHIVE_SPECS.items():
+        if spec['kind'] != kind:
+            continue
+        if spec['series_field'] is None:
+            return ['power']
+        field = apps.get_model(label)._meta.get_field(spec['series_field'])
+        return [code for code, _ in field.choices]
+    raise ValueError(f'Unknown archive kind {kind!r}')
+
+
+def to_micros(moment):
+    return int(moment.timestamp() * 1_000_000)
+
+
+def from_micros(micros):
+    return datetime.fromtimestamp(int(micros) / 1_000_000, tz=dt_timezone.utc)
+
+
+class ArchiveSeries:
+    """One archived time series, e.g. ('sensor', 'kitchen-01', 'gas')
+
+    Raises ``ValueError`` for a series name the kind cannot hold or a
+    device_id whose directory would fall outside the archive root.
+    """
+
+    def __init__(self, kind, device_id, series='power'):
+        if series not in series_names(kind):
+            raise ValueError(f'Unknown {kind} series {series!r}')
+        self.kind = kind
+        self.device_id = device_id
+        self.series = series
+        root = (archive_root() / kind).resolve()
+        base = (root / quote(device_id, safe='')).resolve()
+        if base.parent != root:
+            raise ValueError(f'Invalid device_id {device_id!r}')
+        self.ts_path = base / f'{series}.ts'
+        self.val_path = base / f'{series}.val'
+        self.id_path = base / f'{series}.id'
+
+    def __len__(self):
+        if not self.ts_path.exists():
+            return 0
+        return self.ts_path.stat().st_size // TS_DTYPE.itemsize
+
+    def append(self, timestamps, values, ids=None):
+        """Append rows; out-of-order rows trigger a sorted rewrite of the series.
+
+        ``ids`` are the source rows' primary keys; rows whose id the series
+        already holds are skipped. Returns the number of rows written.
+        """
+        timestamps = np.asarray(timestamps, dtype=TS_DTYPE)
+        values = np.asarray(values, dtype=VALUE_DTYPE)
+        ids = np.full(len(timestamps), -1, ID_DTYPE) if ids is None else np.asarray(ids, dtype=ID_DTYPE)
+        if not len(timestamps):
+            return 0
+        order = np.argsort(timestamps, kind='stable')
+        timestamps, values, ids = timestamps[order], values[order], ids[order]
+
+        with _write_lock:
+            self.ts_path.parent.mkdir(parents=True, exist_ok=True)
+            existing = len(self)
+            if existing:
+                self._fill_ids(existing)
+                timestamps, values, ids = self._unseen(timestamps, values, ids)
+                if not len(timestamps):
+                    return 0
+                with open(self.ts_path, 'rb') as ts_file:
+                    ts_file.seek(-TS_DTYPE.itemsize, os.SEEK_END)
+                    last = np.frombuffer(ts_file.read(TS_DTYPE.itemsize), dtype=TS_DTYPE)[0]
+                if timestamps[0] < last:
+                    self._rewrite_merged(timestamps, values, ids)
+                    return len(timestamps)
+            with open(self.ts_path, 'ab') as ts_file, open(self.val_path, 'ab') as val_file, \
+                    open(self.id_path, 'ab') as id_file:
+                ts_file.write(timestamps.tobytes())
+                val_file.write(values.tobytes())
+                id_file.write(ids.tobytes())
+        return len(timestamps)
+
+    def _fill_ids(self, count):
+        """Pad the id column of a series archived before ids were kept"""
+        stored = self.id_path.stat().st_size // ID_DTYPE.itemsize if self.id_path.exists() else 0
+        if stored < count:
+            with open(self.id_path, 'ab') as id_file:
+                id_file.write(np.full(count - stored, -1, ID_DTYPE).tobytes())
+
+    def _ids(self):
+        return np.memmap(self.id_path, dtype=ID_DTYPE, mode='r', shape=(len(self),))
+
+    def _unseen(self, timestamps, values, ids):
+        """Drop rows whose id is already stored within the batch's time span"""
+        stored_ts, _ = self.columns()
+        lo = np.searchsorted(stored_ts, timestamps[0], 'left')
+        hi = np.searchsorted(stored_ts, timestamps[-1], 'right')
+        if lo == hi:
+            return timestamps, values, ids
+        keep = (ids < 0) | ~np.isin(ids, self._ids()[lo:hi])
+        return timestamps[keep], values[keep], ids[keep]
+
+    def _rewrite_merged(self, timestamps, values, ids):
+        old_ts, old_val = self.columns()
+        merged_ts = np.concatenate([old_ts, timestamps])
+        merged_val = np.concatenate([old_val, values])
+        merged_ids = np.concatenate([self._ids(), ids])
+        order = np.argsort(merged_ts, kind='stable')
+        columns = ((self.ts_path, merged_ts), (self.val_path, merged_val), (self.id_path, merged_ids))
+        for path, column in columns:
+            tmp = path.with_suffix(path.suffix + '.tmp')
+            column[order].tofile(tmp)
+            os.replace(tmp, path)
+
+    def columns(self):
+        """Read-only memory maps of the timestamp and value columns"""
+        count = len(self)
+        if not count:
+            return np.empty(0, TS_DTYPE), np.empty(0, VALUE_DTYPE)
+        return (
+            np.memmap(self.ts_path, dtype=TS_DTYPE, mode='r', shape=(count,)),
+            np.memmap(self.val_path, dtype=VALUE_DTYPE, mode='r', shape=(count,)),
+        )
+
+    def range(self, start=None, end=None):
+        """Column slices (still memory-mapped) for rows with start <= ts < end"""
+        timestamps, values = self.columns()
+        lo = np.searchsorted(timestamps, to_micros(start), 'left') if start else 0
+        hi = np.searchsorted(timestamps, to_micros(end), 'left') if end else len(timestamps)
+        return timestamps[lo:hi], values[lo:hi]
+
+    def aggregate(self, start=None, end=None):
+        """count/min/max/sum/mean over a time range, scanned in bounded chunks"""
+        timestamps, values = self.range(start, end)
+        count = len(values)
+        if not count:
+            return {'count': 0, 'min': None, 'max': None, 'sum': 0.0, 'mean': None}
+
+        total, low, high = 0.0, np.inf, -np.inf
+        for offset in range(0, count, SCAN_CHUNK):
+            chunk = values[offset:offset + SCAN_CHUNK]
+            total += float(chunk.sum())
+            low = min(low, float(chunk.min()))
+            high = max(high, float(chunk.max()))
+        return {
+            'count': count,
+            'min': low,
+            'max': high,
+            'sum': total,
+            'mean': total / count,
+            'first': from_micros(timestamps[0]),
+            'last': from_micros(timestamps[-1]),
+        }
+
+    def buckets(self, start, end, bucket_seconds):
+        """Per-bucket count/min/max/mean over a time range"""
+        width = int(bucket_seconds * 1_000_000)
+        if width <= 0:
+            raise ValueError('bucket_seconds must be at least one microsecond')
+        timestamps, values = self.range(start, end)
+        merged = {}
+        for offset in range(0, len(values), SCAN_CHUNK):
+            ts_chunk = np.asarray(timestamps[offset:offset + SCAN_CHUNK])
+            val_chunk = np.asarray(values[offset:offset + SCAN_CHUNK])
+            bucket_ids = ts_chunk // width
+            edges = np.concatenate([[0], np.flatnonzero(np.diff(bucket_ids)) + 1])
+            counts = np.diff(np.append(edges, len(bucket_ids)))
+            sums = np.add.reduceat(val_chunk, edges)
+            mins = np.minimum.reduceat(val_chunk, edges)
+            maxs = np.maximum.reduceat(val_chunk, edges)
+            for bucket, count, total, low, high in zip(bucket_ids[edges], counts, sums, mins, maxs):
+                acc = merged.get(bucket)
+                if acc is None:
+                    merged[bucket] = [int(count), float(total), float(low), float(high)]
+                else:
+                    # A bucket split across two chunks
+                    acc[0] += int(count)
+                    acc[1] += float(total)
+                    acc[2] = min(acc[2], float(low))
+                    acc[3] = max(acc[3], float(high))
+        return [
+            {
+                'timestamp': from_micros(bucket * width),
+                'count': count,
+                'min': low,
+                'max': high,
+                'mean': total / count,
+            }
+            for bucket, (count, total, low, high) in sorted(merged.items())
+        ]
+
+
+def list_series(kind, device_id):
+    """Series names archived for a device"""
+    base = archive_root() / kind / quote(device_id, safe='')
+    if not base.exists():
+        return []
+    known = set(series_names(kind))
+    return sorted(path.stem for path in base.glob('*.ts') if path.stem in known)
+
+
+def list_devices(kind):
+    base = archive_root() / kind
+    if not base.exists():
+        return []
+    return sorted(unquote(path.name) for path in base.iterdir() if path.is_dir())
+
+
+def archive_rows(model, pks):
+    """Copy the given rows of an archivable model into the columnar archive.
+
+    Rows the archive already holds are skipped, so archiving a chunk again
+    is harmless. Rows that cannot be stored (a device_id or series the
+    archive rejects) are logged and left out. Returns the number of rows
+    newly archived. Models without an ``ARCHIVE_SPECS`` entry raise
+    ``ValueError``.
+    """
+    spec = ARCHIVE_SPECS.get(model._meta.label)
+    if spec is None:
+        raise ValueError(f'{model._meta.label} cannot be archived')
+
+    series_field = spec['series_field']
+    fields = ['pk', 'device_id', 'timestamp', spec['value_field']]
+    if series_field:
+        fields.append(series_field)
+
+    grouped = {}
+    rows = model.objects.filter(pk__in=pks).order_by('timestamp').values_list(*fields)
+    for row in rows.iterator():
+        pk, device_id, timestamp, value = row[:4]
+        series = row[4] if series_field else 'power'
+        columns = grouped.setdefault((device_id, series), ([], [], []))
+        columns[0].append(to_micros(timestamp))
+        columns[1].append(value if value is not None else np.nan)
+        columns[2].append(pk)
+
+    archived = 0
+    for (device_id, series), (timestamps, values, ids) in grouped.items():
+        try:
+            target = ArchiveSeries(spec['kind'], device_id, series)
+        except ValueError as error:
+            logger.warning('Not archiving %d %s rows: %s', len(ids), model._meta.label, error)
+            continue
+        archived += target.append(timestamps, values, ids)
+    return archived
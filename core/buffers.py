@@ -0,0 +1,179 @@
+"""In-process write-behind buffers that coalesce model inserts into bulk_create"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def get_buffer_settings():
+    """Return write buffer settings merged over the defaults"""
+    defaults = {
+        'ENABLED': True,
+        'MAX_BATCH': 500,         # Flush as soon as this many rows are queued
+        'FLUSH_INTERVAL': 1.0,    # Seconds between time-based flushes
+        'MAX_PENDING': 10000,     # Hard cap on queued rows; extra rows are dropped
+    }
+    defaults.update(getattr(settings, 'WRITE_BUFFER_SETTINGS', {}))
+    return defaults
+
+
+class WriteBehindBuffer:
+    """Collects unsaved model instances and flushes them with bulk_create.
+
+    A flush happens when ``max_batch`` rows are queued or ``flush_interval``
+    seconds have passed, whichever comes first. Memory is bounded by
+    ``max_pending``: rows offered while the buffer is full are dropped and
+    counted rather than queued. A batch the database rejects is retried in
+    halves, so only the rows that fail on their own are dropped (and counted
+    as ``failed``). ``on_flush`` is called with the created rows
+    in the inserting transaction, under a savepoint so a failing hook never
+    loses the rows.
+    """
+
+    def __init__(self, name, model, max_batch=None, flush_interval=None,
+                 max_pending=None, on_flush=None):
+        config = get_buffer_settings()
+        self.name = name
+        self.model = model
+        self.max_batch = max_batch or config['MAX_BATCH']
+        self.flush_interval = flush_interval or config['FLUSH_INTERVAL']
+        self.max_pending = max_pending or config['MAX_PENDING']
+        self.on_flush = on_flush
+
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self.counters = {
+            'queued': 0,
+            'flushed': 0,
+            'dropped': 0,
+            'failed': 0,
+            'flushes': 0,
+        }
+
+        with _registry_lock:
+            _registry[name] = self
+
+    def add(self, instance):
+        """Queue an unsaved instance; returns False if it was dropped"""
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self.counters['dropped'] += 1
+                return False
+            self._pending.append(instance)
+            self.counters['queued'] += 1
+            full = len(self._pending) >= self.max_batch
+
+        self._ensure_worker()
+        if full:
+            self._wakeup.set()
+        return True
+
+    def flush(self):
+        """Write all queued rows now; returns the number of rows written"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+
+            created = self._write(batch)
+            with self._lock:
+                self.counters['flushed'] += len(created)
+                self.counters['flushes'] += 1
+        return len(created)
+
+    def _write(self, batch):
+        """Insert a batch; if that fails, retry its halves so only failing rows are dropped"""
+        try:
+            return self._insert(batch)
+        except Exception:
+            if len(batch) == 1:
+                logger.exception('Write buffer %s dropped a row it could not insert: %r', self.name, batch[0])
+                with self._lock:
+                    self.counters['failed'] += 1
+                return []
+            logger.warning('Write buffer %s failed to insert %d rows; retrying in halves',
+                           self.name, len(batch), exc_info=True)
+        for instance in batch:
+            # Keys assigned before the rollback are not in the table
+            instance.pk = None
+        middle = len(batch) // 2
+        return self._write(batch[:middle]) + self._write(batch[middle:])
+
+    def _insert(self, batch):
+        with transaction.atomic():
+            created = self.model.objects.bulk_create(batch, batch_size=self.max_batch)
+            if self.on_flush:
+                try:
+                    with transaction.atomic():
+                        self.on_flush(created)
+                except Exception:
+                    logger.exception('Write buffer %s flush hook failed', self.name)
+        return created
+
+    def stats(self):
+        """Snapshot of the buffer counters"""
+        with self._lock:
+            stats = dict(self.counters)
+            stats['pending'] = len(self._pending)
+        stats['rows_per_flush'] = round(stats['flushed'] / stats['flushes'], 1) if stats['flushes'] else 0.0
+        return stats
+
+    def stop(self):
+        """Stop the background worker and flush whatever is left"""
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=self.flush_interval * 2)
+        self.flush()
+
+    def _ensure_worker(self):
+        if self._thread is not None or self._stopped:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name=f'write-buffer-{self.name}', daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if self._stopped:
+                break
+            started = time.monotonic()
+            self.flush()
+            close_old_connections()
+            logger.debug('Write buffer %s flushed in %.3fs', self.name, time.monotonic() - started)
+
+
+def buffer_stats():
+    """Counters for every registered write buffer"""
+    with _registry_lock:
+        buffers = list(_registry.values())
+    return {buffer.name: buffer.stats() for buffer in buffers}
+
+
+def flush_all():
+    """Flush every registered buffer, e.g. on shutdown"""
+    with _registry_lock:
+        buffers = list(_registry.values())
+    for buffer in buffers:
+        buffer.stop()
+
+
+atexit.register(flush_all)
@@ -0,0 +1,128 @@
+"""Constant-memory CSV / NDJSON exports streamed straight from querysets"""
+import csv
+import json
+import zlib
+
+from django.core.exceptions import BadRequest, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+# Rows fetched per database round trip
+ITERATOR_CHUNK_SIZE = 2000
+
+# Bytes collected before a chunk is handed to the server
+FLUSH_BYTES = 64 * 1024
+
+
+class _Echo:
+    """File-like object whose write() just returns the line (for csv.writer)"""
+
+    def write(self, value):
+        return value
+
+
+def _cell(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, cls=DjangoJSONEncoder)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def encode_rows(rows, fields, fmt='csv'):
+    """Yield encoded text lines for an iterable of value tuples"""
+    if fmt == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(fields)
+        for row in rows:
+            yield writer.writerow([_cell(value) for value in row])
+    else:
+        encoder = DjangoJSONEncoder()
+        for row in rows:
+            yield encoder.encode(dict(zip(fields, row))) + '\n'
+
+
+def export_chunks(rows, fields, fmt='csv', compress=False):
+    """Yield byte chunks of roughly FLUSH_BYTES, optionally gzip-compressed on the fly"""
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    pending = []
+    size = 0
+    for line in encode_rows(rows, fields, fmt):
+        data = line.encode('utf-8')
+        pending.append(data)
+        size += len(data)
+        if size >= FLUSH_BYTES:
+            chunk = b''.join(pending)
+            pending, size = [], 0
+            if compressor:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+
+    chunk = b''.join(pending)
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+
+def _parse_bound(request, name):
+    try:
+        return parse_datetime(request.GET.get(name, ''))
+    except ValueError:
+        raise BadRequest(f'{name} is not a valid date/time')
+
+
+def filter_queryset(request, queryset, time_field='timestamp', device_field='device_id'):
+    """Apply ?start=, ?end= and ?device_id= filters from the request.
+
+    Values the fields cannot hold (an impossible date, a non-numeric id for
+    a foreign key) raise ``BadRequest``, which Django answers with a 400.
+    """
+    start = _parse_bound(request, 'start')
+    end = _parse_bound(request, 'end')
+    device_id = request.GET.get('device_id')
+    if start:
+        queryset = queryset.filter(**{f'{time_field}__gte': start})
+    if end:
+        queryset = queryset.filter(**{f'{time_field}__lt': end})
+    if device_id and device_field:
+        try:
+            device_id = queryset.model._meta.get_field(device_field).to_python(device_id)
+        except ValidationError:
+            raise BadRequest(f'device_id {device_id!r} is not a valid device id')
+        queryset = queryset.filter(**{device_field: device_id})
+    return queryset.order_by(time_field)
+
+
+def streaming_export(request, queryset, fields, name, headers=None):
+    """StreamingHttpResponse exporting ``fields`` of ``queryset``.
+
+    ``headers`` optionally renames the output columns. Format and
+    compression come from ``?format=csv|ndjson`` and ``?gzip=1``.
+    """
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        fmt = 'csv'
+    compress = request.GET.get('gzip') in ('1', 'true', 'yes')
+
+    rows = queryset.values_list(*fields).iterator(chunk_size=ITERATOR_CHUNK_SIZE)
+    filename = f"{name}-{timezone.now():%Y%m%d-%H%M%S}.{fmt}"
+    content_type = EXPORT_FORMATS[fmt]
+    if compress:
+        filename += '.gz'
+        content_type = 'application/gzip'
+
+    response = StreamingHttpResponse(
+        export_chunks(rows, headers or fields, fmt, compress),
+        content_type=content_type,
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
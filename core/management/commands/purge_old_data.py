@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from core.retention import run_retention
+
+
+class Command(BaseCommand):
+    help = 'Purge time-series rows past their retention window (see core/retention.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Rows deleted per transaction')
+        parser.add_argument('--pause', type=float, default=0.05, help='Seconds to sleep between chunks')
+        parser.add_argument('--max-seconds', type=float, help='Stop after this much wall time')
+        parser.add_argument('--dry-run', action='store_true', help='Only count expired rows')
+
+    def handle(self, *args, **options):
+        self.stdout.write('🧹 Applying retention policies' + (' (dry run)' if options['dry_run'] else ''))
+
+        results = run_retention(
+            chunk_size=options['chunk_size'],
+            pause=options['pause'],
+            max_seconds=options['max_seconds'],
+            dry_run=options['dry_run'],
+        )
+
+        total = 0
+        for result in results:
+            total += result['purged']
+            status = '' if result['complete'] else '  (stopped at time limit)'
+            self.stdout.write(
+                f"   {result['policy']:<50} {result['purged']:>10} rows "
+                f"{result['chunks']:>6} chunks {result['seconds']:>8.2f}s"
+                + (f"  ({result['archived']} archived)" if result['archived'] else '')
+                + status
+            )
+
+        verb = 'would be purged' if options['dry_run'] else 'purged'
+        seconds = sum(result['seconds'] for result in results)
+        self.stdout.write(self.style.SUCCESS(f'✅ {total} rows {verb} in {seconds:.2f}s'))
@@ -17,4 +17,12 @@ class Home(models.Model):
     address = models.TextField()
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
     members = models.ManyToManyField(User, related_name='homes')
-    created_at = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    created_at = models.DateTimeField(auto_now_add=True)
+
+class Sequence(models.Model):
+    """Named counter advanced under a row lock (see core/sequences.py)"""
+    name = models.CharField(max_length=100, unique=True)
+    value = models.BigIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.name}: {self.value}"
\ No newline at end of file
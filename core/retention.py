@@ -0,0 +1,118 @@
+"""Retention policies that purge old time-series rows in small chunks"""
+import time
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+# Used when settings.RETENTION_POLICIES is not defined. Hourly and daily
+# sensor rollups have no policy, so they are kept forever. Policies with
+# 'archive' copy expired rows into the columnar archive before deleting them.
+DEFAULT_POLICIES = [
+    {'model': 'automation.SensorReading', 'field': 'timestamp', 'days': 7, 'archive': True},
+    {'model': 'automation.SensorRollup', 'field': 'bucket_start', 'days': 90,
+     'filter': {'resolution': '1m'}},
+    {'model': 'energy.EnergyReading', 'field': 'timestamp', 'days': 30, 'archive': True},
+    {'model': 'automation.AutomationLog', 'field': 'timestamp', 'days': 90},
+    {'model': 'devices.DeviceLog', 'field': 'timestamp', 'days': 30},
+    # The newest snapshot older than the window and the events after it are kept for replay
+    {'model': 'automation.DeviceStateEvent', 'field': 'timestamp', 'days': 90,
+     'scope': 'automation.state_log.expired_events'},
+    {'model': 'automation.DeviceStateSnapshot', 'field': 'timestamp', 'days': 90,
+     'scope': 'automation.state_log.expired_snapshots'},
+]
+
+
+class RetentionPolicy:
+    """Delete rows of ``model`` whose ``field`` is older than ``days``.
+
+    With ``archive`` set, each chunk is copied into the columnar archive
+    (see core.archive) before it is deleted; the archive skips rows it
+    already holds, so a chunk archived by a run that died before deleting
+    it is not archived twice. ``scope`` is the dotted path of
+    a ``function(queryset, cutoff)`` that narrows the expired rows, for
+    tables where some old rows must outlive the window.
+    """
+
+    def __init__(self, model, field, days, filter=None, archive=False, scope=None):
+        self.model = apps.get_model(model) if isinstance(model, str) else model
+        self.field = field
+        self.days = days
+        self.filter = filter or {}
+        self.archive = archive
+        self.scope = import_string(scope) if scope else None
+
+    @property
+    def label(self):
+        extra = ''.join(f' {key}={value}' for key, value in self.filter.items())
+        return f'{self.model._meta.label}{extra} > {self.days}d'
+
+    def expired(self, now=None):
+        """Queryset of rows past the retention window, oldest first"""
+        cutoff = (now or timezone.now()) - timedelta(days=self.days)
+        expired = (
+            self.model.objects
+            .filter(**self.filter)
+            .filter(**{f'{self.field}__lt': cutoff})
+            .order_by(self.field)
+        )
+        return self.scope(expired, cutoff) if self.scope else expired
+
+
+def get_policies():
+    """Configured retention policies"""
+    configured = getattr(settings, 'RETENTION_POLICIES', DEFAULT_POLICIES)
+    return [RetentionPolicy(**policy) for policy in configured]
+
+
+def purge(policy, chunk_size=1000, pause=0.05, deadline=None, dry_run=False, now=None):
+    """Delete expired rows for one policy in chunks of ``chunk_size``.
+
+    Each chunk is its own short transaction so writers are never blocked for
+    long, with a ``pause`` between chunks to let them in. Stops early once
+    ``deadline`` (a ``time.monotonic()`` value) has passed.
+    """
+    started = time.monotonic()
+    expired = policy.expired(now)
+    result = {'policy': policy.label, 'purged': 0, 'archived': 0, 'chunks': 0, 'complete': True}
+
+    if dry_run:
+        result['purged'] = expired.count()
+        result['seconds'] = round(time.monotonic() - started, 3)
+        return result
+
+    while True:
+        if deadline is not None and time.monotonic() >= deadline:
+            result['complete'] = False
+            break
+        pks = list(expired.values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            break
+        if policy.archive:
+            from core.archive import archive_rows
+            result['archived'] += archive_rows(policy.model, pks)
+        with transaction.atomic():
+            deleted, _ = policy.model.objects.filter(pk__in=pks).delete()
+        result['purged'] += deleted
+        result['chunks'] += 1
+        if len(pks) < chunk_size:
+            break
+        if pause:
+            time.sleep(pause)
+
+    result['seconds'] = round(time.monotonic() - started, 3)
+    return result
+
+
+def run_retention(chunk_size=1000, pause=0.05, max_seconds=None, dry_run=False):
+    """Apply every configured policy and return one result per policy"""
+    deadline = time.monotonic() + max_seconds if max_seconds else None
+    now = timezone.now()
+    return [
+        purge(policy, chunk_size=chunk_size, pause=pause, deadline=deadline,
+              dry_run=dry_run, now=now)
+        for policy in get_policies()
+    ]
@@ -0,0 +1,38 @@
+"""Gap-tolerant, commit-ordered counters stored in the database.
+
+``next_value(name)`` increments a Sequence row and returns the new value.
+The row stays locked until the caller's transaction ends, so writers that
+take a value inside their transaction commit in value order: once a value
+is visible, every smaller value that was committed is visible too. That
+makes the values safe to use as polling cursors, unlike the cache-backed
+counters in core/versions.py. Rolled-back transactions leave gaps.
+``reserve`` hands out a block of values at once for callers that only
+need unique, increasing numbers and not commit order.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import Sequence
+
+
+def next_value(name):
+    """Advance ``name`` and return its new value; call inside the writing transaction"""
+    return reserve(name, 1)[0]
+
+
+def reserve(name, count):
+    """Advance ``name`` by ``count`` and return the reserved values as a range"""
+    with transaction.atomic():
+        if not Sequence.objects.filter(name=name).update(value=F('value') + count):
+            try:
+                with transaction.atomic():
+                    Sequence.objects.create(name=name, value=0)
+            except IntegrityError:
+                pass  # Created concurrently
+            Sequence.objects.filter(name=name).update(value=F('value') + count)
+        value = Sequence.objects.filter(name=name).values_list('value', flat=True).get()
+    return range(value - count + 1, value + 1)
+
+
+def current_value(name):
+    return Sequence.objects.filter(name=name).values_list('value', flat=True).first() or 0
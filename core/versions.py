@@ -0,0 +1,32 @@
+"""Named version counters for invalidating in-process caches across workers.
+
+A writer calls ``bump(name)`` after changing the data behind a cache. Readers
+compare ``get(name)`` with the version they compiled from. The counter lives
+in the Django cache, so every process sharing a cache backend sees a bump;
+with the default per-process LocMemCache only the bumping process does.
+"""
+from django.core.cache import cache
+
+KEY_PREFIX = 'safenest:version:'
+
+
+def get(name):
+    return cache.get(KEY_PREFIX + name, 0)
+
+
+def get_many(names):
+    """Versions for several names in one cache round trip"""
+    found = cache.get_many([KEY_PREFIX + name for name in names])
+    return {name: found.get(KEY_PREFIX + name, 0) for name in names}
+
+
+def bump(name):
+    """Increment and return the version for ``name``"""
+    key = KEY_PREFIX + name
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Not set yet or evicted. Readers compare for inequality, so
+        # restarting the counter still triggers their reload.
+        cache.add(key, 1, timeout=None)
+        return cache.incr(key)
@@ -3,8 +3,8 @@ from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+from devices import scenes
+from devices.models import Device
 import json
 
 def index(request):
@@ -103,23 +103,14 @@ def dashboard_view(request):
 
 @api_view(['POST'])
 def toggle_lights(request):
-    # lights = Device.objects.filter(device_type='light') # Uncomment when Device model is available
-    # for light in lights:
-    #     current_status = light.status.get('on', False)
-    #     light.status['on'] = not current_status
-    #     light.save()
+    if not request.user.is_authenticated:
+        return Response({'error': 'Authentication required'}, status=401)
     
-    # Send real-time update
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        'dashboard',
-        {
-            'type': 'device_update',
-            'message': 'Lights toggled'
-        }
-    )
+    # Device updates are broadcast to the dashboard group by the executor
+    lights = Device.objects.filter(home__in=scenes.user_homes(request.user), device_type='light')
+    report = scenes.toggle_devices(lights, user=request.user, description='Toggle all lights')
     
-    return Response({'status': 'success'})
+    return Response({'status': 'success' if not report['failed'] else 'partial', **report})
 
 @api_view(['POST'])
 def ai_chat(request):
@@ -0,0 +1,26 @@
+from django.contrib import admin
+from .models import DeviceAPIKey, DeviceGroup, Scene
+
+@admin.register(DeviceAPIKey)
+class DeviceAPIKeyAdmin(admin.ModelAdmin):
+    list_display = ['prefix', 'name', 'device_id', 'user', 'home', 'is_active', 'created_at', 'revoked_at']
+    list_filter = ['is_active']
+    readonly_fields = ['prefix', 'key_hash', 'created_at', 'revoked_at']
+    actions = ['revoke_keys']
+    
+    @admin.action(description='Revoke selected keys')
+    def revoke_keys(self, request, queryset):
+        for key in queryset.filter(is_active=True):
+            key.revoke()
+
+
+@admin.register(DeviceGroup)
+class DeviceGroupAdmin(admin.ModelAdmin):
+    list_display = ['name', 'home', 'room', 'device_type', 'created_at']
+    list_filter = ['device_type']
+    filter_horizontal = ['devices']
+
+@admin.register(Scene)
+class SceneAdmin(admin.ModelAdmin):
+    list_display = ['name', 'home', 'created_by', 'last_applied', 'created_at']
+    readonly_fields = ['last_applied']
@@ -0,0 +1,116 @@
+"""Device API key authentication backed by an in-process LRU cache"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+
+DeviceIdentity = namedtuple('DeviceIdentity', ['key_id', 'device_id', 'user_id', 'home_id'])
+
+
+def get_auth_settings():
+    defaults = {
+        'CACHE_SIZE': 10000,   # Keys held in memory per process
+        'CACHE_TTL': 300,      # Seconds before a cached key is checked again
+    }
+    defaults.update(getattr(settings, 'DEVICE_AUTH_SETTINGS', {}))
+    return defaults
+
+
+class DeviceKeyCache:
+    """LRU map of key hash -> DeviceIdentity with a per-entry TTL.
+
+    Revoking or deleting a key invalidates its entry in this process via
+    signals (see devices/signals.py); other processes pick the change up
+    within ``ttl`` seconds.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key_hash):
+        with self._lock:
+            entry = self._entries.get(key_hash)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, identity = entry
+            if expires_at < time.monotonic():
+                del self._entries[key_hash]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key_hash)
+            self.hits += 1
+            return identity
+
+    def put(self, key_hash, identity):
+        with self._lock:
+            self._entries[key_hash] = (time.monotonic() + self.ttl, identity)
+            self._entries.move_to_end(key_hash)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key_hash):
+        with self._lock:
+            self._entries.pop(key_hash, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            size = len(self._entries)
+        return {'size': size, 'hits': self.hits, 'misses': self.misses}
+
+
+_config = get_auth_settings()
+key_cache = DeviceKeyCache(_config['CACHE_SIZE'], _config['CACHE_TTL'])
+
+
+def authenticate_key(raw_key):
+    """Resolve a raw device key to a DeviceIdentity, or None if unknown or revoked.
+
+    Costs one query on a cache miss and none on a hit.
+    """
+    from .models import DeviceAPIKey
+
+    if not raw_key:
+        return None
+    key_hash = DeviceAPIKey.hash_key(raw_key)
+    identity = key_cache.get(key_hash)
+    if identity is not None:
+        return identity
+
+    row = (
+        DeviceAPIKey.objects
+        .filter(key_hash=key_hash, is_active=True)
+        .values_list('id', 'device_id', 'user_id', 'home_id')
+        .first()
+    )
+    if row is None:
+        return None
+    identity = DeviceIdentity(*row)
+    key_cache.put(key_hash, identity)
+    return identity
+
+
+def key_from_request(request):
+    """Device key from the X-Device-Key header or an 'Authorization: Device <key>' header"""
+    key = request.headers.get('X-Device-Key')
+    if key:
+        return key.strip()
+    authorization = request.headers.get('Authorization', '')
+    scheme, _, credentials = authorization.partition(' ')
+    if scheme.lower() == 'device':
+        return credentials.strip()
+    return None
+
+
+def authenticate_request(request):
+    return authenticate_key(key_from_request(request))
@@ -0,0 +1,65 @@
+import json
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+
+from devices.auth import authenticate_key, key_cache
+from devices.models import DeviceAPIKey
+from energy.views import energy_buffer, log_energy_reading
+
+
+class Command(BaseCommand):
+    help = 'Check that authenticating a device reading costs zero queries once the key is cached'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readings', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = options['readings']
+        factory = APIRequestFactory()
+
+        with transaction.atomic():
+            user = User.objects.create(username='bench-device-auth')
+            key, raw_key = DeviceAPIKey.issue(user, device_id='bench-meter')
+            key_cache.clear()
+
+            with CaptureQueriesContext(connection) as cold:
+                authenticate_key(raw_key)
+            self.stdout.write(f'   cold lookup: {len(cold)} queries')
+
+            # Steady state: every reading through the view, inserts left in the buffer
+            energy_buffer.max_batch = energy_buffer.max_pending = count + 1
+            energy_buffer.flush_interval = 3600
+            body = json.dumps({'device_id': 'bench-meter', 'power_consumption': 120.5})
+            with override_settings(WRITE_BUFFER_SETTINGS={'ENABLED': True}):
+                with CaptureQueriesContext(connection) as warm:
+                    started = time.perf_counter()
+                    for _ in range(count):
+                        request = factory.post('/energy/api/log-reading/', body, content_type='application/json',
+                                               HTTP_X_DEVICE_KEY=raw_key)
+                        response = log_energy_reading(request)
+                        if response.status_code != 200:
+                            raise CommandError(f'Reading rejected: {response.data}')
+                    elapsed = time.perf_counter() - started
+            energy_buffer.flush()
+
+            per_reading = len(warm) / count
+            self.stdout.write(f'   steady state: {len(warm)} queries for {count} readings '
+                              f'({per_reading:.2f}/reading, {count / elapsed:.0f} readings/s)')
+
+            with CaptureQueriesContext(connection) as revoked:
+                key.revoke()
+                rejected = authenticate_key(raw_key) is None
+            self.stdout.write(f'   after revoke: rejected={rejected} ({len(revoked)} queries)')
+            transaction.set_rollback(True)
+
+        if len(warm):
+            raise CommandError(f'Expected 0 queries per reading in steady state, got {per_reading:.2f}')
+        if not rejected:
+            raise CommandError('Revoked key was still accepted')
+        self.stdout.write(self.style.SUCCESS('✅ Device authentication is query-free once cached'))
@@ -0,0 +1,31 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Home
+from devices.models import DeviceAPIKey
+
+
+class Command(BaseCommand):
+    help = 'Issue an API key for a device (the raw key is shown once)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='Owner of the readings sent with this key')
+        parser.add_argument('--device-id', default='', help='Bind the key to one device id')
+        parser.add_argument('--home', type=int, help='Home id the device belongs to')
+        parser.add_argument('--name', default='')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User '{options['username']}' not found")
+
+        home = None
+        if options['home']:
+            home = Home.objects.filter(pk=options['home']).first()
+            if home is None:
+                raise CommandError(f"Home {options['home']} not found")
+
+        key, raw_key = DeviceAPIKey.issue(user, device_id=options['device_id'], home=home, name=options['name'])
+        self.stdout.write(self.style.SUCCESS(f'🔑 Issued key {key.prefix}… for {key.device_id or "gateway"}'))
+        self.stdout.write(raw_key)
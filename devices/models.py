@@ -1,4 +1,9 @@
+import hashlib
+import secrets
+
+from django.contrib.auth.models import User
 from django.db import models
+from django.utils import timezone
 from core.models import Home
 
 class Device(models.Model):
@@ -23,4 +28,101 @@ class DeviceLog(models.Model):
     device = models.ForeignKey(Device, on_delete=models.CASCADE)
     action = models.CharField(max_length=100)
     data = models.JSONField()
-    timestamp = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    timestamp = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['timestamp'], name='devicelog_ts_idx'),
+        ]
+
+class DeviceAPIKey(models.Model):
+    """API key a device uses to submit readings on behalf of a user/home"""
+    name = models.CharField(max_length=100, blank=True)
+    device_id = models.CharField(max_length=100, blank=True, help_text="Device this key is bound to; blank for a home gateway")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='device_api_keys')
+    home = models.ForeignKey(Home, on_delete=models.CASCADE, null=True, blank=True)
+    prefix = models.CharField(max_length=8, help_text="First characters of the key, for identification")
+    key_hash = models.CharField(max_length=64, unique=True)
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    revoked_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"{self.prefix}… ({self.device_id or 'gateway'})"
+    
+    @staticmethod
+    def hash_key(raw_key):
+        return hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
+    
+    @classmethod
+    def issue(cls, user, device_id='', home=None, name=''):
+        """Create a key and return (instance, raw_key); the raw key is never stored"""
+        raw_key = secrets.token_urlsafe(32)
+        instance = cls.objects.create(
+            name=name,
+            device_id=device_id,
+            user=user,
+            home=home,
+            prefix=raw_key[:8],
+            key_hash=cls.hash_key(raw_key),
+        )
+        return instance, raw_key
+    
+    def revoke(self):
+        self.is_active = False
+        self.revoked_at = timezone.now()
+        self.save(update_fields=['is_active', 'revoked_at'])
+
+class DeviceGroup(models.Model):
+    """Named set of a home's devices.
+
+    Members are the devices matching ``room`` and/or ``device_type`` (when
+    either is set) plus the explicitly listed ``devices``.
+    """
+    home = models.ForeignKey(Home, on_delete=models.CASCADE, related_name='device_groups')
+    name = models.CharField(max_length=100)
+    room = models.CharField(max_length=50, blank=True)
+    device_type = models.CharField(max_length=20, choices=Device.DEVICE_TYPES, blank=True)
+    devices = models.ManyToManyField(Device, blank=True, related_name='groups')
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        unique_together = ['home', 'name']
+    
+    def __str__(self):
+        return f"{self.name} ({self.home})"
+    
+    def members(self):
+        """Queryset of the group's devices"""
+        selected = models.Q(pk__in=self.devices.values('pk'))
+        if self.room or self.device_type:
+            matching = models.Q()
+            if self.room:
+                matching &= models.Q(room=self.room)
+            if self.device_type:
+                matching &= models.Q(device_type=self.device_type)
+            selected |= matching
+        return Device.objects.filter(selected, home=self.home_id)
+
+class Scene(models.Model):
+    """Named set of target device states applied together.
+
+    ``actions`` is a list of ``{"group": <id>}`` or ``{"device": <id>}``
+    targets, each with an ``action`` (turn_on, turn_off, toggle or
+    set_value, the default) and its ``parameters``, e.g.
+    ``{"group": 3, "parameters": {"status": "on", "brightness": 30}}``.
+    Later entries win where targets overlap.
+    """
+    home = models.ForeignKey(Home, on_delete=models.CASCADE, related_name='scenes')
+    name = models.CharField(max_length=100)
+    description = models.TextField(blank=True)
+    actions = models.JSONField(default=list)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_applied = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        unique_together = ['home', 'name']
+    
+    def __str__(self):
+        return f"{self.name} ({self.home})"
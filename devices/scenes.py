@@ -0,0 +1,165 @@
+"""Group and scene control on top of the batched device executor.
+
+Registered devices are resolved to their live DeviceStatus row (created on
+first use for devices that have none yet), and every target of a group or
+scene becomes one DeviceAction in a single ``apply_device_actions`` batch:
+one read, one bulk update, one bulk log insert and one dashboard broadcast
+however many devices are involved.
+"""
+import time
+
+from django.db.models import Q
+from django.utils import timezone
+
+from automation.executor import DEVICE_ACTIONS, DeviceAction, apply_device_actions
+from core.models import Home
+from .models import Device, DeviceGroup
+
+DEFAULT_SCENE_ACTION = 'set_value'
+
+
+def user_homes(user):
+    return Home.objects.filter(Q(owner=user) | Q(members=user)).distinct()
+
+
+def status_device_id(device_pk):
+    """device_id given to the DeviceStatus created for a registered device"""
+    return f'device-{device_pk}'
+
+
+def clean_actions(entries):
+    """Validate a scene's action list; returns it normalised or raises ValueError"""
+    if not isinstance(entries, list) or not entries:
+        raise ValueError('actions must be a non-empty list')
+    cleaned = []
+    for position, entry in enumerate(entries):
+        if not isinstance(entry, dict) or ('group' in entry) == ('device' in entry):
+            raise ValueError(f'actions[{position}] needs exactly one of group or device')
+        action = entry.get('action', DEFAULT_SCENE_ACTION)
+        if action not in DEVICE_ACTIONS:
+            raise ValueError(f"actions[{position}]: unknown action '{action}'")
+        parameters = entry.get('parameters') or {}
+        if not isinstance(parameters, dict):
+            raise ValueError(f'actions[{position}]: parameters must be an object')
+        target = 'group' if 'group' in entry else 'device'
+        try:
+            cleaned.append({target: int(entry[target]), 'action': action, 'parameters': parameters})
+        except (TypeError, ValueError):
+            raise ValueError(f'actions[{position}]: {target} must be an id')
+    return cleaned
+
+
+def build_actions(targets, log):
+    """DeviceActions for ``(device pks, action, parameters)`` targets, in order"""
+    pks = {pk for device_pks, _, _ in targets for pk in device_pks}
+    devices = {
+        row['pk']: row
+        for row in Device.objects.filter(pk__in=pks).values(
+            'pk', 'name', 'device_type', 'room', 'is_online', 'live_status__device_id'
+        )
+    }
+    actions = []
+    registered = {}
+    for device_pks, action, parameters in targets:
+        for pk in device_pks:
+            device = devices.get(pk)
+            if device is None:
+                continue
+            status_id = device['live_status__device_id']
+            defaults = None
+            if status_id is None:
+                status_id = status_device_id(pk)
+                defaults = {
+                    'device_name': device['name'],
+                    'device_type': device['device_type'],
+                    'location': device['room'],
+                    'is_online': device['is_online'],
+                    'registered_device_id': pk,
+                }
+            registered[status_id] = pk
+            actions.append(DeviceAction(status_id, action, parameters, defaults=defaults, log=log))
+    return actions, registered
+
+
+def run(actions, registered):
+    """Apply the actions as one batch and report per-device results and timing"""
+    started = time.perf_counter()
+    results = apply_device_actions(actions)
+    elapsed = time.perf_counter() - started
+
+    # A device targeted more than once reports its final state
+    by_device = {}
+    for result in results:
+        entry = by_device.setdefault(result.device_id, {
+            'device': registered.get(result.device_id),
+            'device_id': result.device_id,
+            'success': True,
+            'errors': [],
+        })
+        entry['state'] = result.state
+        if not result.success:
+            entry['success'] = False
+            entry['errors'].append(result.error)
+    devices = list(by_device.values())
+    succeeded = sum(1 for device in devices if device['success'])
+    return {
+        'devices': len(devices),
+        'succeeded': succeeded,
+        'failed': len(devices) - succeeded,
+        'actions': len(actions),
+        'elapsed_ms': round(elapsed * 1000, 2),
+        'results': devices,
+    }
+
+
+def apply_devices(devices, action, parameters=None, user=None, description=''):
+    """Apply one action to a queryset of registered devices"""
+    log = {
+        'user': user,
+        'log_type': 'manual_action',
+        'description': description or f'Group action: {action}',
+        'metadata': {'action': action, 'parameters': parameters or {}},
+    }
+    targets = [(list(devices.values_list('pk', flat=True)), action, parameters or {})]
+    return run(*build_actions(targets, log))
+
+
+def toggle_devices(devices, user=None, description=''):
+    """Turn all ``devices`` off if any is on, otherwise turn them all on"""
+    states = devices.values_list('live_status__current_state', flat=True)
+    action = 'turn_off' if any((state or {}).get('status') == 'on' for state in states) else 'turn_on'
+    return apply_devices(devices, action, user=user, description=description or f'Toggle all: {action}')
+
+
+def apply_group(group, action, parameters=None, user=None):
+    return apply_devices(group.members(), action, parameters, user,
+                         description=f"Group '{group.name}': {action}")
+
+
+def apply_scene(scene, user=None):
+    entries = clean_actions(scene.actions)
+    group_ids = {entry['group'] for entry in entries if 'group' in entry}
+    groups = {group.pk: group for group in DeviceGroup.objects.filter(home=scene.home_id, pk__in=group_ids)}
+    home_devices = set(Device.objects.filter(
+        home=scene.home_id, pk__in=[entry['device'] for entry in entries if 'device' in entry]
+    ).values_list('pk', flat=True))
+
+    targets = []
+    for entry in entries:
+        if 'group' in entry:
+            group = groups.get(entry['group'])
+            pks = list(group.members().values_list('pk', flat=True)) if group else []
+        else:
+            pks = [entry['device']] if entry['device'] in home_devices else []
+        targets.append((pks, entry['action'], entry['parameters']))
+
+    log = {
+        'user': user,
+        'log_type': 'manual_action',
+        'description': f"Scene '{scene.name}' applied",
+        'metadata': {'scene_id': scene.pk},
+    }
+    report = run(*build_actions(targets, log))
+    scene.last_applied = timezone.now()
+    scene.save(update_fields=['last_applied'])
+    return report
@@ -0,0 +1,12 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .auth import key_cache
+from .models import DeviceAPIKey
+
+
+@receiver(post_save, sender=DeviceAPIKey)
+@receiver(post_delete, sender=DeviceAPIKey)
+def invalidate_device_key(sender, instance, **kwargs):
+    """Drop a changed, revoked or deleted key from the in-process cache"""
+    key_cache.invalidate(instance.key_hash)
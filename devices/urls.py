@@ -7,4 +7,9 @@ urlpatterns = [
     # Add device-related URLs here when views are available
     # path('', views.device_list, name='device_list'),
     # path('<int:device_id>/', views.device_detail, name='device_detail'),
+    path('api/groups/', views.device_groups, name='api_device_groups'),
+    path('api/groups/<int:group_id>/apply/', views.apply_device_group, name='api_apply_device_group'),
+    path('api/scenes/', views.scene_list, name='api_scenes'),
+    path('api/scenes/<int:scene_id>/apply/', views.apply_scene, name='api_apply_scene'),
+    path('export/logs/', views.export_device_logs, name='export_logs'),
 ]
@@ -1,7 +1,14 @@
 from django.shortcuts import render
 from django.http import JsonResponse
+from django.contrib.auth.decorators import login_required
+from django.db.models import Q
+from django.views.decorators.http import require_GET
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
+from core.exports import filter_queryset, streaming_export
+from core.models import Home
+from . import scenes
+from .models import Device, DeviceGroup, DeviceLog, Scene
 
 # Create your views here.
 
@@ -38,3 +45,136 @@ def toggle_device(request, device_id):
         'status': 'toggled',
         'message': 'Device toggled successfully'
     })
+
+def group_data(group):
+    return {
+        'id': group.id,
+        'home': group.home_id,
+        'name': group.name,
+        'room': group.room,
+        'device_type': group.device_type,
+        'devices': [device.id for device in group.devices.all()],
+    }
+
+def scene_data(scene):
+    return {
+        'id': scene.id,
+        'home': scene.home_id,
+        'name': scene.name,
+        'description': scene.description,
+        'actions': scene.actions,
+        'last_applied': scene.last_applied,
+    }
+
+def requested_home(request, homes):
+    """The home whose id is in the request data, if it is one of ``homes``"""
+    try:
+        return homes.filter(id=int(request.data.get('home'))).first()
+    except (TypeError, ValueError):
+        return None
+
+@api_view(['GET', 'POST'])
+def device_groups(request):
+    """List the user's device groups, or create one"""
+    if not request.user.is_authenticated:
+        return Response({'error': 'Authentication required'}, status=401)
+    
+    homes = scenes.user_homes(request.user)
+    if request.method == 'GET':
+        groups = DeviceGroup.objects.filter(home__in=homes).prefetch_related('devices')
+        return Response({'groups': [group_data(group) for group in groups]})
+    
+    home = requested_home(request, homes)
+    name = (request.data.get('name') or '').strip()
+    if home is None or not name:
+        return Response({'error': 'home and name are required'}, status=400)
+    device_type = request.data.get('device_type') or ''
+    if device_type and device_type not in dict(Device.DEVICE_TYPES):
+        return Response({'error': f"Unknown device_type '{device_type}'"}, status=400)
+    device_ids = request.data.get('devices') or []
+    try:
+        if not isinstance(device_ids, list):
+            raise TypeError
+        device_ids = {int(device_id) for device_id in device_ids}
+    except (TypeError, ValueError):
+        return Response({'error': 'devices must be a list of device ids'}, status=400)
+    devices = list(Device.objects.filter(home=home, id__in=device_ids))
+    if len(devices) != len(device_ids):
+        return Response({'error': 'devices must belong to the home'}, status=400)
+    if DeviceGroup.objects.filter(home=home, name=name).exists():
+        return Response({'error': f"Group '{name}' already exists"}, status=400)
+    
+    group = DeviceGroup.objects.create(
+        home=home, name=name, room=request.data.get('room') or '', device_type=device_type
+    )
+    group.devices.set(devices)
+    return Response(group_data(group), status=201)
+
+@api_view(['POST'])
+def apply_device_group(request, group_id):
+    """Apply one action to every device in a group"""
+    if not request.user.is_authenticated:
+        return Response({'error': 'Authentication required'}, status=401)
+    
+    group = DeviceGroup.objects.filter(id=group_id, home__in=scenes.user_homes(request.user)).first()
+    if group is None:
+        return Response({'error': 'Group not found'}, status=404)
+    action = request.data.get('action')
+    parameters = request.data.get('parameters') or {}
+    if action not in scenes.DEVICE_ACTIONS or not isinstance(parameters, dict):
+        return Response({'error': f'action must be one of {", ".join(scenes.DEVICE_ACTIONS)}'}, status=400)
+    
+    report = scenes.apply_group(group, action, parameters, user=request.user)
+    return Response({'success': report['failed'] == 0, 'group': group.name, **report})
+
+@api_view(['GET', 'POST'])
+def scene_list(request):
+    """List the user's scenes, or create one"""
+    if not request.user.is_authenticated:
+        return Response({'error': 'Authentication required'}, status=401)
+    
+    homes = scenes.user_homes(request.user)
+    if request.method == 'GET':
+        return Response({'scenes': [scene_data(scene) for scene in Scene.objects.filter(home__in=homes)]})
+    
+    home = requested_home(request, homes)
+    name = (request.data.get('name') or '').strip()
+    if home is None or not name:
+        return Response({'error': 'home and name are required'}, status=400)
+    try:
+        actions = scenes.clean_actions(request.data.get('actions'))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+    if Scene.objects.filter(home=home, name=name).exists():
+        return Response({'error': f"Scene '{name}' already exists"}, status=400)
+    
+    scene = Scene.objects.create(
+        home=home, name=name, description=request.data.get('description') or '',
+        actions=actions, created_by=request.user,
+    )
+    return Response(scene_data(scene), status=201)
+
+@api_view(['POST'])
+def apply_scene(request, scene_id):
+    """Apply every target state of a scene in one batch"""
+    if not request.user.is_authenticated:
+        return Response({'error': 'Authentication required'}, status=401)
+    
+    scene = Scene.objects.filter(id=scene_id, home__in=scenes.user_homes(request.user)).first()
+    if scene is None:
+        return Response({'error': 'Scene not found'}, status=404)
+    try:
+        report = scenes.apply_scene(scene, user=request.user)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+    return Response({'success': report['failed'] == 0, 'scene': scene.name, **report})
+
+@login_required
+@require_GET
+def export_device_logs(request):
+    """Stream device logs for the user's homes as CSV or NDJSON"""
+    homes = Home.objects.filter(Q(owner=request.user) | Q(members=request.user))
+    logs = filter_queryset(request, DeviceLog.objects.filter(device__home__in=homes))
+    fields = ['timestamp', 'device_id', 'device__name', 'action', 'data']
+    headers = ['timestamp', 'device_id', 'device_name', 'action', 'data']
+    return streaming_export(request, logs, fields, 'device-log', headers=headers)
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 class Appliance(models.Model):
     """Model for household appliances"""
@@ -73,10 +74,16 @@ class EnergyReading(models.Model):
     power_consumption = models.FloatField(help_text="Current power consumption in watts")
     voltage = models.FloatField(null=True, blank=True)
     current = models.FloatField(null=True, blank=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the reading is received, not when a buffered insert is flushed
+    timestamp = models.DateTimeField(default=timezone.now)
     
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['-timestamp'], name='energy_ts_idx'),
+            models.Index(fields=['user', '-timestamp'], name='energy_user_ts_idx'),
+            models.Index(fields=['device_id', '-timestamp'], name='energy_device_ts_idx'),
+        ]
     
     def __str__(self):
         return f"Reading for {self.device_id} at {self.timestamp}"
@@ -14,4 +14,5 @@ urlpatterns = [
     path('api/calculate/', views.calculate_consumption, name='api_calculate'),
     path('api/log-reading/', views.log_energy_reading, name='api_log_reading'),
     path('api/stats/', views.energy_stats, name='api_stats'),
+    path('export/readings/', views.export_energy_readings, name='export_readings'),
 ]
@@ -4,9 +4,16 @@ from django.contrib import messages
 from django.http import JsonResponse
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
+from django.views.decorators.http import require_GET
+from core.buffers import WriteBehindBuffer, get_buffer_settings
+from core.exports import filter_queryset, streaming_export
+from devices.auth import authenticate_request
 from .models import Appliance, UserEnergyProfile, EnergyReading, EnergyTip
 import json
 
+# Write-behind buffer coalescing energy reading inserts into bulk_create
+energy_buffer = WriteBehindBuffer('energy_readings', EnergyReading)
+
 def energy_calculator(request):
     """Energy consumption calculator page"""
     appliances = Appliance.objects.all()
@@ -136,29 +143,40 @@ def calculate_consumption(request):
 @api_view(['POST'])
 def log_energy_reading(request):
     """API endpoint for IoT devices to log energy readings"""
-    device_id = request.data.get('device_id')
+    identity = authenticate_request(request)
+    if identity is None:
+        return Response({'error': 'A valid device key is required (X-Device-Key header)'}, status=401)
+    
+    # Keys bound to a device may only report for that device
+    device_id = identity.device_id or request.data.get('device_id')
     power_consumption = request.data.get('power_consumption')
     voltage = request.data.get('voltage')
     current = request.data.get('current')
     
     if not device_id or power_consumption is None:
         return Response({'error': 'device_id and power_consumption are required'}, status=400)
+    if request.data.get('device_id') not in (None, '', device_id):
+        return Response({'error': 'This key is bound to a different device'}, status=403)
     
-    # For now, we'll use a default user. In production, this would be authenticated
-    from django.contrib.auth.models import User
-    user = User.objects.first()  # This should be properly authenticated
-    
-    reading = EnergyReading.objects.create(
-        user=user,
+    reading = EnergyReading(
+        user_id=identity.user_id,
         device_id=device_id,
         power_consumption=float(power_consumption),
         voltage=float(voltage) if voltage else None,
         current=float(current) if current else None
     )
     
+    # Queue the insert for the write-behind buffer, or write it straight away
+    queued = get_buffer_settings()['ENABLED']
+    if not queued:
+        reading.save()
+    elif not energy_buffer.add(reading):
+        return Response({'error': 'Ingestion buffer is full, retry later'}, status=503)
+    
     return Response({
         'status': 'success',
         'reading_id': reading.id,
+        'queued': queued,
         'timestamp': reading.timestamp
     })
 
@@ -187,3 +205,11 @@ def energy_stats(request):
         })
     except UserEnergyProfile.DoesNotExist:
         return Response({'error': 'Energy profile not found'}, status=404)
+
+@login_required
+@require_GET
+def export_energy_readings(request):
+    """Stream the user's energy readings as CSV or NDJSON"""
+    readings = filter_queryset(request, EnergyReading.objects.filter(user=request.user))
+    fields = ['timestamp', 'device_id', 'power_consumption', 'voltage', 'current']
+    return streaming_export(request, readings, fields, 'energy-readings')
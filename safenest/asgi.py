@@ -9,6 +9,7 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 
 import os
 from django.core.asgi import get_asgi_application
+from django.urls import re_path
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 from channels.security.websocket import AllowedHostsOriginValidator
@@ -17,13 +18,17 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'safenest.settings')
 
 django_asgi_app = get_asgi_application()
 
+from automation.routing import websocket_urlpatterns as device_websocket_urlpatterns  # noqa: E402
+
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
-    "websocket": AllowedHostsOriginValidator(
-        AuthMiddlewareStack(
-            URLRouter([
-                # Add your websocket URL patterns here
-            ])
-        )
-    ),
+    "websocket": URLRouter(device_websocket_urlpatterns + [
+        re_path(r'', AllowedHostsOriginValidator(
+            AuthMiddlewareStack(
+                URLRouter([
+                    # Add your websocket URL patterns here
+                ])
+            )
+        )),
+    ]),
 })
@@ -99,6 +99,110 @@ CHANNEL_LAYERS = {
 CELERY_BROKER_URL = 'redis://localhost:6379'
 CELERY_RESULT_BACKEND = 'redis://localhost:6379'
 
+# Write-behind buffering for high-volume reading inserts (see core/buffers.py)
+WRITE_BUFFER_SETTINGS = {
+    'ENABLED': config('WRITE_BUFFER_ENABLED', default=True, cast=bool),
+    'MAX_BATCH': 500,
+    'FLUSH_INTERVAL': 1.0,
+    'MAX_PENDING': 10000,
+}
+
+# Device API key cache (see devices/auth.py)
+DEVICE_AUTH_SETTINGS = {
+    'CACHE_SIZE': 10000,
+    'CACHE_TTL': 300,
+}
+
+# Device websocket ingestion (see automation/consumers.py)
+DEVICE_INGEST_SETTINGS = {
+    'TOKEN': config('DEVICE_INGEST_TOKEN', default=''),
+    'BATCH_SIZE': 200,
+    'FLUSH_INTERVAL': 0.5,
+    'MAX_PENDING': 2000,
+}
+
+# Alert debouncing: repeated alerts from one sensor collapse into an AlertIncident
+# (see automation/alert_state.py)
+ALERT_STATE_SETTINGS = {
+    'DEBOUNCE_SECONDS': 0,
+    'HYSTERESIS': 0.1,
+    'COOLDOWN_SECONDS': 60,
+    'FLUSH_INTERVAL': 5.0,
+}
+
+# Online EWMA/CUSUM anomaly detection on incoming readings (see automation/anomaly.py)
+ANOMALY_SETTINGS = {
+    'ENABLED': config('ANOMALY_DETECTION_ENABLED', default=True, cast=bool),
+    'ALPHA': 0.05,
+    'Z_THRESHOLD': 4.0,
+    'CUSUM_K': 0.5,
+    'CUSUM_H': 8.0,
+    'WARMUP': 30,
+}
+
+# Indexed AutomationRule matching (see automation/rules.py)
+AUTOMATION_RULE_SETTINGS = {
+    'COOLDOWN_SECONDS': 60,
+    'VERSION_CHECK_INTERVAL': 1.0,
+    'MAX_COOLDOWNS': 10000,
+}
+
+# Append-only device state history; a full snapshot every SNAPSHOT_EVERY events per
+# device bounds the replay behind "state at time T" (see automation/state_log.py)
+DEVICE_STATE_LOG_SETTINGS = {
+    'SNAPSHOT_EVERY': 50,
+}
+
+# Device commands: resent with exponential backoff until acknowledged, held in
+# memory and spilled to the DeviceCommand table under a lease (see automation/command_queue.py)
+DEVICE_COMMAND_SETTINGS = {
+    'ACK_TIMEOUT': 5.0,
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF_BASE': 1.0,
+    'BACKOFF_MAX': 60.0,
+    'SPILL_AFTER': 10.0,
+    'LEASE': 30.0,
+    'MAX_IN_MEMORY': 10000,
+}
+
+# Time-triggered rules, fired by `manage.py run_automation_scheduler` (see automation/scheduler.py)
+AUTOMATION_SCHEDULER_SETTINGS = {
+    'WORKERS': 4,
+    'VERSION_CHECK_INTERVAL': 1.0,
+    'RELOAD_INTERVAL': 300,
+}
+
+# Device liveness: heartbeats are coalesced in memory and written in bulk, and
+# devices silent for OFFLINE_AFTER seconds are swept offline (see automation/heartbeat.py)
+HEARTBEAT_SETTINGS = {
+    'FLUSH_INTERVAL': 10.0,
+    'OFFLINE_AFTER': 90,
+    'SWEEP_INTERVAL': 30.0,
+    'BATCH_SIZE': 1000,
+}
+
+# Per-home device state served by device_status_api; writers update it in place and
+# other processes reload a home when its version changes (see automation/state_cache.py)
+DEVICE_STATE_CACHE_SETTINGS = {
+    'VERSION_CHECK_INTERVAL': 1.0,
+    'MAX_DELTA_DEVICES': 500,
+}
+
+# Safety protocol dispatch queue and worker pool (see automation/dispatch.py)
+SAFETY_DISPATCH_SETTINGS = {
+    'ENABLED': config('SAFETY_DISPATCH_ENABLED', default=True, cast=bool),
+    'WORKERS': 4,
+    'MAX_QUEUE': 10000,
+    'LATENCY_SAMPLES': 10000,
+}
+
+# Retention windows for time-series tables, applied by `manage.py purge_old_data`,
+# are defined by DEFAULT_POLICIES in core/retention.py. Set RETENTION_POLICIES
+# here only to replace them for a deployment.
+
+# Columnar archive of readings past retention (see core/archive.py)
+READING_ARCHIVE_ROOT = config('READING_ARCHIVE_ROOT', default=str(BASE_DIR / 'archive'))
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 